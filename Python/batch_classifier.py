@@ -0,0 +1,355 @@
+"""
+Микро-батчинг LLM-классификации.
+
+Во время рейда сообщения приходят пачками, и на каждое уходит отдельный запрос
+с ~3 КБ правил. BatchClassifier собирает сообщения, пришедшие в пределах окна,
+классифицирует их одним запросом со списком ответов и раздаёт каждому ожидающему
+вызову его собственный вердикт. Если ответ на пачку не удалось разобрать —
+сообщения классифицируются по одному.
+
+Правила передаются отдельным неизменным системным сообщением, а сообщение
+пользователя — коротким user-сообщением после него: у всех запросов общий
+префикс, и бэкенд (Ollama / llama.cpp) переиспользует его KV-кэш.
+
+В режиме минимального декодирования одиночный запрос ограничен парой токенов
+и останавливается на переводе строки; если бэкенд отдаёт logprobs, вердикт
+считается по вероятностям первого токена, иначе ответ читается потоком и
+обрывается на первом решающем токене.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Tuple
+
+import metrics
+from llm_pool import count_llm_calls, current_llm_calls
+from prompt_loader import cap_message
+
+logger = logging.getLogger(__name__)
+
+SINGLE_ANSWER_FORMAT = "Отвечай только 'SPAM' или 'NOT_SPAM' без пояснений.\n"
+
+BATCH_ANSWER_FORMAT = (
+    "Ниже пронумерованы {count} независимых сообщений. Классифицируй каждое.\n"
+    "Ответ — только JSON-массив из {count} строк 'SPAM' или 'NOT_SPAM' в порядке "
+    "нумерации, без пояснений. Пример для 3 сообщений: [\"NOT_SPAM\", \"SPAM\", \"NOT_SPAM\"]\n"
+)
+
+MINIMAL_MAX_TOKENS = 4  # «SPAM» / «NOT» + кавычки, звёздочки и дробная токенизация
+# Оформление, которое модели ставят перед ответом: «"SPAM"», «**SPAM**»
+_FORMATTING = " \t\n\"'*«`"
+BATCH_TOKENS_PER_ITEM = 8
+
+
+@dataclass
+class Classification:
+    is_spam: bool
+    text: str  # ответ модели (для логов и кэша)
+    probability: Optional[float] = None  # P(SPAM), если бэкенд отдал logprobs
+
+
+def decisive_label(answer: str) -> Optional[bool]:
+    """True/False по началу ответа или None, если решающий токен ещё не пришёл."""
+    head = answer.lstrip(_FORMATTING).upper()
+    if len(head) < 2:
+        return None
+    return head.startswith("SP")
+
+
+def _token_label(token: str) -> Optional[bool]:
+    """К какому ответу ведёт первый токен: SPAM (True), NOT_SPAM (False) или ни к какому."""
+    head = token.strip(_FORMATTING).upper()
+    if not head:
+        return None
+    if head.startswith("SPAM") or "SPAM".startswith(head):
+        return True
+    if head.startswith("NOT") or "NOT_SPAM".startswith(head):
+        return False
+    return None
+
+
+def spam_probability(logprobs: Optional[dict]) -> Optional[float]:
+    """P(SPAM) по top_logprobs первого значимого токена, нормированная на два класса."""
+    for item in (logprobs or {}).get("content") or []:
+        if not item.get("token", "").strip(_FORMATTING):
+            continue  # пробел, кавычка или звёздочка перед ответом
+        candidates = item.get("top_logprobs")
+        if not candidates:
+            # Только выбранный токен: вторым классом считаем всю оставшуюся массу
+            label = _token_label(item["token"])
+            if label is None:
+                return None
+            probability = math.exp(item["logprob"])
+            return probability if label else 1.0 - probability
+        spam = ham = 0.0
+        for candidate in candidates:
+            label = _token_label(candidate.get("token", ""))
+            if label is None:
+                continue
+            if label:
+                spam += math.exp(candidate["logprob"])
+            else:
+                ham += math.exp(candidate["logprob"])
+        if spam + ham == 0:
+            return None
+        return spam / (spam + ham)
+    return None
+
+
+_JSON_ARRAY_RE = re.compile(r"\[.*?\]", re.DOTALL)
+_NUMBERED_LINE_RE = re.compile(r"^\s*(\d+)\s*[.):\-]\s*(NOT_SPAM|SPAM)\b", re.IGNORECASE | re.MULTILINE)
+
+
+def parse_batch_answer(answer: str, count: int) -> Optional[List[str]]:
+    """Разбирает ответ на пачку: JSON-массив или строки «N: SPAM». None — не разобрать."""
+    match = _JSON_ARRAY_RE.search(answer)
+    if match:
+        try:
+            items = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            items = None
+        if isinstance(items, list) and len(items) == count:
+            verdicts = [str(item).strip().upper() for item in items]
+            if all(v in ("SPAM", "NOT_SPAM") for v in verdicts):
+                return verdicts
+
+    numbered = {int(n): v.upper() for n, v in _NUMBERED_LINE_RE.findall(answer)}
+    if sorted(numbered) == list(range(1, count + 1)):
+        return [numbered[i] for i in range(1, count + 1)]
+    return None
+
+
+class BatchClassifier:
+    """Собирает одновременные запросы классификации в один запрос к LLM."""
+
+    def __init__(
+            self,
+            llm_factory: Callable[[], Any],
+            system_prompt: str,
+            window_ms: float = 50,
+            max_batch_size: int = 8,
+            max_wait_ms: float = 200,
+            minimal_decode: bool = True,
+            spam_threshold: float = 0.5,
+            max_message_chars: int = 1500,
+    ):
+        self.llm_factory = llm_factory  # модель создаётся при первом запросе
+        self.system_prompt = system_prompt
+        self.max_message_chars = max_message_chars
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.minimal_decode = minimal_decode
+        self.spam_threshold = spam_threshold
+        self._logprobs_supported: Optional[bool] = None  # выясняется по первому ответу
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._dispatches: set = set()  # ссылки на задачи, чтобы их не собрал GC
+
+        self.llm_calls = 0
+        self.batches = 0
+        self.batched_messages = 0
+        self.fallbacks = 0
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Публичный интерфейс
+    # -------------------------------------------------------------- #
+    async def classify(self, text: str, need_confidence: bool = False) -> Classification:
+        """
+        Вердикт модели для одного сообщения.
+        need_confidence — нужна вероятность (каскад эскалирует по неуверенности): ответ на пачку её не
+        даёт, поэтому, пока бэкенд может отдать logprobs, сообщение идёт отдельным запросом.
+        """
+        if self.max_batch_size == 1 or (need_confidence and self.minimal_decode and self._logprobs_supported is not False):
+            return await self._classify_single(text)
+
+        self._ensure_collector()
+        future = asyncio.get_running_loop().create_future()
+        # Запрос пачки делает другая задача: вызовы LLM засчитываются сюда по её завершении
+        await self._queue.put((text, future, current_llm_calls()))
+        return await future
+
+    async def close(self) -> None:
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Сбор пачек
+    # -------------------------------------------------------------- #
+    def _ensure_collector(self) -> None:
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            # Пустой контекст: иначе сборщик и все пачки унаследуют контекст первого сообщения
+            self._collector = contextvars.Context().run(asyncio.create_task, self._collect())
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[str, asyncio.Future, Optional[List[int]]]] = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = min(self.window, deadline - loop.time())
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future, Optional[List[int]]]]) -> None:
+        texts = [text for text, _, _ in batch]
+        try:
+            with count_llm_calls() as calls:
+                if len(batch) == 1:
+                    answers = [await self._classify_single(texts[0])]
+                else:
+                    answers = await self._classify_batch(texts)
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            # Каждому сообщению пачки — все вызовы, которых оно дождалось (в том числе повторы по одному)
+            for _, _, counter in batch:
+                if counter is not None:
+                    counter[0] += calls[0]
+
+        for (_, future, _), answer in zip(batch, answers):
+            if not future.done():
+                future.set_result(answer)
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Запросы к LLM
+    # -------------------------------------------------------------- #
+    def _messages(self, user_prompt: str) -> list:
+        from langchain.schema.messages import HumanMessage, SystemMessage
+
+        return [SystemMessage(content=self.system_prompt), HumanMessage(content=user_prompt)]
+
+    def _message_line(self, text: str) -> str:
+        return f"«{cap_message(text, self.max_message_chars)}»"
+
+    async def warm_up(self, keep_alive_prompt: str = "Привет") -> None:
+        """Загружает модель и системный промпт в KV-кэш на всех эндпоинтах до первого сообщения."""
+        started = time.perf_counter()
+        results = await self.llm_factory().ainvoke_each(
+            self._messages(f"{SINGLE_ANSWER_FORMAT}Сообщение: {self._message_line(keep_alive_prompt)}"),
+            max_tokens=1,
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.warning(f"⚠️ Прогрев LLM: {len(errors)} из {len(results)} эндпоинтов недоступны: {errors[0]}")
+        logger.info(f"🔥 Модель прогрета за {time.perf_counter() - started:.2f} с "
+                    f"(оценка системного промпта из {len(self.system_prompt)} символов)")
+
+    async def _invoke(self, prompt: str, kind: str, **kwargs):
+        logger.debug(f"Отправка запроса к LLM: {prompt[:100]}...")
+        self.llm_calls += 1
+        started = time.perf_counter()
+        try:
+            answer = await self.llm_factory().ainvoke(self._messages(prompt), **kwargs)
+        except Exception:
+            metrics.LLM_ERRORS.inc(kind=kind)
+            raise
+        duration = time.perf_counter() - started
+        metrics.record_llm_answer(answer, duration, kind=kind)
+        usage = getattr(answer, "usage_metadata", None) or {}
+        logger.info(f"🧮 LLM {kind}: {duration * 1000:.0f} мс, токены "
+                    f"{usage.get('input_tokens', '?')}/{usage.get('output_tokens', '?')}")
+        return answer
+
+    async def _stream_until_decisive(self, prompt: str) -> str:
+        """Потоковый ответ, обрываемый на первом решающем токене."""
+        self.llm_calls += 1
+        chunks = 0
+
+        def done(answer: str) -> bool:
+            nonlocal chunks
+            chunks += 1
+            return decisive_label(answer) is not None
+
+        started = time.perf_counter()
+        try:
+            answer = await self.llm_factory().astream_until(
+                self._messages(prompt), done, max_tokens=MINIMAL_MAX_TOKENS, stop=["\n"]
+            )
+        except Exception:
+            metrics.LLM_ERRORS.inc(kind="stream")
+            raise
+        duration = time.perf_counter() - started
+        metrics.record_llm_answer(None, duration, kind="stream")
+        metrics.LLM_TOKENS.inc(chunks, type="completion")
+        logger.info(f"🧮 LLM stream: {duration * 1000:.0f} мс, прочитано {chunks} чанк(ов)")
+        return answer
+
+    async def _classify_full(self, prompt: str) -> Classification:
+        answer = await self._invoke(prompt, kind="single")
+        return Classification(answer.content.strip().upper().startswith("SPAM"), answer.content)
+
+    async def _classify_single(self, text: str) -> Classification:
+        prompt = f"{SINGLE_ANSWER_FORMAT}Сообщение: {self._message_line(text)}"
+        if not self.minimal_decode:
+            return await self._classify_full(prompt)
+
+        if self._logprobs_supported is False:
+            answer_text = await self._stream_until_decisive(prompt)
+            label = decisive_label(answer_text)
+        else:
+            answer = await self._invoke(
+                prompt, kind="single",
+                max_tokens=MINIMAL_MAX_TOKENS, stop=["\n"], logprobs=True, top_logprobs=5,
+            )
+            answer_text = answer.content
+            logprobs = (getattr(answer, "response_metadata", None) or {}).get("logprobs")
+            if logprobs is None:
+                if self._logprobs_supported is None:
+                    self._logprobs_supported = False
+                    logger.info("ℹ️ Бэкенд не отдаёт logprobs, дальше — потоковый режим с ранней остановкой")
+            else:
+                self._logprobs_supported = True
+                probability = spam_probability(logprobs)
+                if probability is not None:
+                    return Classification(probability >= self.spam_threshold, answer_text, probability)
+            label = decisive_label(answer_text)
+
+        if label is None:
+            # Оборванный ответ без решающего токена: «не спам» по умолчанию пропустил бы спам
+            logger.info(f"ℹ️ Короткий ответ не разобран ({answer_text!r}), повторяем без ограничения токенов")
+            return await self._classify_full(prompt)
+        return Classification(label, answer_text)
+
+    async def _classify_batch(self, texts: List[str]) -> List[str]:
+        numbered = "\n".join(f"{i}. {self._message_line(text)}" for i, text in enumerate(texts, start=1))
+        answer_format = BATCH_ANSWER_FORMAT.format(count=len(texts))
+        prompt = f"{answer_format}Сообщения:\n{numbered}"
+
+        started = time.perf_counter()
+        limits = {"max_tokens": BATCH_TOKENS_PER_ITEM * len(texts) + 8} if self.minimal_decode else {}
+        answer = await self._invoke(prompt, kind="batch", **limits)
+        verdicts = parse_batch_answer(answer.content, len(texts))
+
+        if verdicts is None:
+            self.fallbacks += 1
+            logger.warning(f"⚠️ Не удалось разобрать ответ на пачку из {len(texts)} сообщений, "
+                           f"классифицируем по одному: {answer.content[:100]!r}")
+            return list(await asyncio.gather(*(self._classify_single(t) for t in texts)))
+
+        self.batches += 1
+        self.batched_messages += len(texts)
+        logger.info(f"📦 Пачка из {len(texts)} сообщений классифицирована "
+                    f"за {time.perf_counter() - started:.2f} с")
+        return [Classification(verdict == "SPAM", verdict) for verdict in verdicts]
@@ -0,0 +1,327 @@
+"""
+Офлайн-бенчмарк пайплайна антиспама.
+
+Прогоняет размеченный корпус через graph_executor (LangGraph) или через
+Runner.run (OpenAI Agents SDK) с поддельным Telegram Message и локальным
+stub-сервером LLM. Результат — JSON с пропускной способностью, перцентилями
+задержек (в том числе по узлам графа), числом вызовов LLM и precision/recall,
+чтобы сравнивать прогоны до и после изменений.
+
+Примеры:
+    python benchmark.py --pipeline langgraph --concurrency 8 --llm-latency-ms 300
+    python benchmark.py --pipeline agents --output bench_agents.json
+    python benchmark.py --env LLM_BATCH_MAX_SIZE=1 --env VERDICT_CACHE_SIZE=0
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from stub_llm_server import StubLLMServer
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Поддельные Telegram-объекты
+# ------------------------------------------------------------------ #
+class FakeBot:
+    """Записывает вызовы Bot API вместо обращения к Telegram."""
+
+    def __init__(self, api_latency_ms: float = 0):
+        self.api_latency = api_latency_ms / 1000
+        self.calls: List[tuple] = []  # (method, kwargs)
+        self.deleted: set = set()  # (chat_id, message_id)
+
+    async def _record(self, method: str, **kwargs):
+        self.calls.append((method, kwargs))
+        if method == "delete_message":
+            self.deleted.add((kwargs["chat_id"], kwargs["message_id"]))
+        elif method == "delete_messages":
+            self.deleted.update((kwargs["chat_id"], i) for i in kwargs["message_ids"])
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        return True
+
+    def __getattr__(self, method: str):
+        # forward_message, delete_message, send_message, ... — всё записывается
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            return await self._record(method, **kwargs)
+
+        return call
+
+
+class FakeMessage:
+    """Минимальная замена aiogram.types.Message для replay-прогона."""
+
+    def __init__(self, bot: FakeBot, message_id: int, chat_id: int, user_id: int, text: str):
+        self.bot = bot
+        self.message_id = message_id
+        self.chat = SimpleNamespace(id=chat_id, type="supergroup")
+        self.from_user = SimpleNamespace(
+            id=user_id,
+            username=f"user{user_id}",
+            full_name=f"User {user_id}",
+            is_bot=False,
+        )
+        self.text = text
+        self.content_type = "text"
+        self.new_chat_members = None
+        self.date = datetime.now()
+
+    @property
+    def deleted(self) -> bool:
+        return (self.chat.id, self.message_id) in self.bot.deleted
+
+    async def delete(self):
+        return await self.bot._record("delete_message", chat_id=self.chat.id, message_id=self.message_id)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Статистика
+# ------------------------------------------------------------------ #
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по методу ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(values: List[float]) -> dict:
+    ms = [v * 1000 for v in values]
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        "p50": round(percentile(ms, 50), 3),
+        "p95": round(percentile(ms, 95), 3),
+        "p99": round(percentile(ms, 99), 3),
+    }
+
+
+def quality_summary(pairs: List[tuple]) -> dict:
+    """pairs — список (ожидаемый is_spam, полученный is_spam)."""
+    tp = sum(1 for want, got in pairs if want and got)
+    fp = sum(1 for want, got in pairs if not want and got)
+    fn = sum(1 for want, got in pairs if want and not got)
+    tn = sum(1 for want, got in pairs if not want and not got)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+    }
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Прогон одного сообщения
+# ------------------------------------------------------------------ #
+async def run_langgraph(message: FakeMessage, node_timings: Dict[str, List[float]]) -> Optional[bool]:
+    import spam_agent_langgraph as pipeline
+
+    verdict = None
+    last = time.perf_counter()
+    async for update in pipeline.get_graph_executor().astream(
+            pipeline.build_initial_state(message), stream_mode="updates"
+    ):
+        now = time.perf_counter()
+        for node, values in update.items():
+            node_timings[node].append(now - last)
+            if isinstance(values, dict) and "is_spam" in values:
+                verdict = values["is_spam"]
+        last = now
+    return verdict if verdict is not None else message.deleted
+
+
+async def run_agents(message: FakeMessage, node_timings: Dict[str, List[float]]) -> Optional[bool]:
+    import spam_agent as pipeline
+
+    started = time.perf_counter()
+    await pipeline.agent_check_spam(message)
+    node_timings["Runner.run"].append(time.perf_counter() - started)
+    return message.deleted
+
+
+PIPELINES = {
+    "langgraph": run_langgraph,
+    "agents": run_agents,
+}
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Бенчмарк целиком
+# ------------------------------------------------------------------ #
+def load_corpus(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def configure_environment(base_urls: List[str], overrides: List[str]) -> None:
+    """Настраивает агента на stub-серверы до импорта модулей пайплайна."""
+    workdir = tempfile.mkdtemp(prefix="nospam-bench-")
+    os.environ["OPENAI_BASE_URL"] = base_urls[0]
+    os.environ["LLM_ENDPOINTS"] = ",".join(base_urls)
+    os.environ.setdefault("LOCAL_LLM", "stub")
+    os.environ.setdefault("TARGET_GROUP_ID", "-1000000000000")
+    os.environ["SPAM_DB_PATH"] = os.path.join(workdir, "spam_log.sqlite3")
+    os.environ["VERDICT_CACHE_PATH"] = ""
+    os.environ["REPUTATION_PATH"] = ""
+    os.environ["PENDING_DB_PATH"] = ""
+    for item in overrides:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    try:
+        from agents import set_tracing_disabled
+        set_tracing_disabled(True)  # без выгрузки трейсов в OpenAI
+    except ImportError:
+        pass
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    corpus = load_corpus(args.corpus) * args.repeat
+    labels = {item["text"].strip(): item["label"] for item in corpus}
+
+    servers = [
+        StubLLMServer(
+            labels=labels,
+            latency_ms=args.llm_latency_ms,
+            jitter_ms=args.llm_jitter_ms,
+            error_rate=args.llm_error_rate,
+            logprobs=not args.llm_no_logprobs,
+            prompt_ms_per_kchar=args.llm_prompt_ms_per_kchar,
+        )
+        for _ in range(args.llm_endpoints)
+    ]
+    for server in servers:
+        await server.start()
+    configure_environment([server.base_url for server in servers], args.env)
+
+    run_one = PIPELINES[args.pipeline]
+    bot = FakeBot(api_latency_ms=args.api_latency_ms)
+    node_timings: Dict[str, List[float]] = defaultdict(list)
+    latencies: List[float] = []
+    pairs: List[tuple] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    # Импорт пайплайна (и компиляция графа) не входит в замер
+    await run_one(FakeMessage(bot, 0, 1, 1, "warm-up"), defaultdict(list))
+    for server in servers:
+        server.calls = server.prompt_chars = server.completion_tokens = server.cached_prompt_chars = server.total_prompt_chars = 0
+        server.prompt_eval_seconds = 0.0
+    bot.calls.clear()
+
+    async def replay(index: int, item: dict) -> None:
+        nonlocal errors
+        message = FakeMessage(
+            bot,
+            message_id=index + 1,
+            chat_id=-(index % args.chats) - 1,
+            user_id=1000 + index % args.users,
+            text=item["text"],
+        )
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                verdict = await run_one(message, node_timings)
+            except Exception as exc:
+                errors += 1
+                logger.error(f"Ошибка на сообщении {index}: {exc}")
+                return
+            latencies.append(time.perf_counter() - started)
+            pairs.append((item["label"] == "SPAM", bool(verdict)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(replay(i, item) for i, item in enumerate(corpus)))
+    duration = time.perf_counter() - started
+    for server in servers:
+        await server.stop()
+    llm_calls = sum(server.calls for server in servers)
+
+    return {
+        "pipeline": args.pipeline,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "corpus": args.corpus,
+            "repeat": args.repeat,
+            "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_jitter_ms": args.llm_jitter_ms,
+            "llm_error_rate": args.llm_error_rate,
+            "llm_endpoints": args.llm_endpoints,
+            "llm_logprobs": not args.llm_no_logprobs,
+            "llm_prompt_ms_per_kchar": args.llm_prompt_ms_per_kchar,
+            "api_latency_ms": args.api_latency_ms,
+            "env": args.env,
+        },
+        "messages": len(corpus),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_msg_s": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "nodes": {node: latency_summary(values) for node, values in sorted(node_timings.items())},
+        "llm_calls": llm_calls,
+        "llm_calls_per_endpoint": [server.calls for server in servers],
+        "llm_calls_per_message": round(llm_calls / len(corpus), 3) if corpus else 0.0,
+        "llm_prompt_chars": sum(server.prompt_chars for server in servers),
+        "llm_completion_tokens": sum(server.completion_tokens for server in servers),
+        "llm_prompt_cache_ratio": round(
+            sum(s.cached_prompt_chars for s in servers) / max(1, sum(s.total_prompt_chars for s in servers)), 4
+        ),
+        "llm_prompt_eval_s": round(sum(server.prompt_eval_seconds for server in servers), 3),
+        "bot_api_calls": dict(Counter(method for method, _ in bot.calls)),
+        "quality": quality_summary(pairs),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay-бенчмарк антиспам-пайплайна")
+    parser.add_argument("--pipeline", choices=sorted(PIPELINES), default="langgraph")
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "benchmark_corpus.jsonl"))
+    parser.add_argument("--repeat", type=int, default=1, help="сколько раз повторить корпус")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chats", type=int, default=4, help="по скольким чатам раскладывать сообщения")
+    parser.add_argument("--users", type=int, default=20, help="сколько разных отправителей")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-no-logprobs", action="store_true",
+                        help="stub без logprobs (проверка потокового режима)")
+    parser.add_argument("--llm-prompt-ms-per-kchar", type=float, default=0.0,
+                        help="имитация оценки промпта вне KV-кэша, мс на 1000 символов")
+    parser.add_argument("--llm-endpoints", type=int, default=1, help="сколько stub-серверов LLM поднять")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="задержка поддельного Bot API")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределить переменную окружения агента")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    report = asyncio.run(run_benchmark(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
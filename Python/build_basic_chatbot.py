@@ -1,11 +1,11 @@
 # https://langchain-ai.github.io/langgraph/tutorials/get-started/1-build-basic-chatbot/
-from dotenv import load_dotenv
+import argparse
+import os
 from typing import Annotated
-from langchain_openai import ChatOpenAI
 
+from dotenv import load_dotenv
 from typing_extensions import TypedDict
 
-from langgraph.graph import StateGraph, START
 from langgraph.graph.message import add_messages
 
 
@@ -19,67 +19,87 @@ class State(TypedDict):
     messages: Annotated[list, add_messages]
 
 
-graph_builder = StateGraph(State)
+def build_graph():
+    # Тяжёлые импорты и создание клиента — только при запуске, а не при импорте модуля
+    from langchain_openai import ChatOpenAI
+    from langgraph.graph import StateGraph, START
 
-import os
-from langchain.chat_models import init_chat_model
+    os.environ["OPENAI_API_KEY"] = "No Need"
+    load_dotenv()
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "http://localhost:11434/v1")
+    LOCAL_LLM       = os.getenv("LOCAL_LLM")
+
+    llm = ChatOpenAI(
+        model_name=LOCAL_LLM,
+        base_url   =OPENAI_BASE_URL,
+        streaming  =False,
+        temperature=0.0,
+    )
 
-os.environ["OPENAI_API_KEY"] = "No Need"
-load_dotenv()
-OPENAI_BASE_URL = "http://localhost:11434/v1"
-LOCAL_LLM       = os.getenv("LOCAL_LLM")
+    def chatbot(state: State):
+        return {"messages": [llm.invoke(state["messages"])]}
 
-llm = ChatOpenAI(
-    model_name=LOCAL_LLM,
-    base_url   =OPENAI_BASE_URL,
-    streaming  =False,
-    temperature=0.0,
-)
+    graph_builder = StateGraph(State)
 
-def chatbot(state: State):
-    return {"messages": [llm.invoke(state["messages"])]}
+    # The first argument is the unique node name
+    # The second argument is the function or object that will be called whenever
+    # the node is used.
+    # Первый аргумент — уникальное имя узла
+    # Второй аргумент — функция или объект, который будет вызываться всякий раз,
+    # когда используется узел.
+    graph_builder.add_node("chatbot", chatbot)
 
+    graph_builder.add_edge(START, "chatbot")
 
-# The first argument is the unique node name
-# The second argument is the function or object that will be called whenever
-# the node is used.
-# Первый аргумент — уникальное имя узла
-# Второй аргумент — функция или объект, который будет вызываться всякий раз,
-# когда используется узел.
-graph_builder.add_node("chatbot", chatbot)
+    return graph_builder.compile()
 
-graph_builder.add_edge(START, "chatbot")
 
-graph = graph_builder.compile()
+def draw_graph(graph, path: str = "../graph_image.png") -> None:
+    try:
 
-try:
+        # Сохраняем картинку в файл
+        graph_image = graph.get_graph().draw_mermaid_png()
+        with open(path, "wb") as png:
+            png.write(graph_image)
 
-    # Сохраняем картинку в файл
-    graph_image = graph.get_graph().draw_mermaid_png()
-    with open("../graph_image.png", "wb") as png:
-        png.write(graph_image)
+    except Exception:
+        # This requires some extra dependencies and is optional
+        # Это требует некоторых дополнительных зависимостей и не является обязательным
+        pass
 
-except Exception:
-    # This requires some extra dependencies and is optional
-    # Это требует некоторых дополнительных зависимостей и не является обязательным
-    pass
 
-def stream_graph_updates(user_input: str):
+def stream_graph_updates(graph, user_input: str):
     for event in graph.stream({"messages": [{"role": "user", "content": user_input}]}):
         for value in event.values():
             print("Assistant:", value["messages"][-1].content)
 
 
-while True:
-    try:
-        user_input = input("User: ")
-        if user_input.lower() in ["quit", "exit", "q"]:
-            print("Goodbye!")
+def chat(graph):
+    while True:
+        try:
+            user_input = input("User: ")
+            if user_input.lower() in ["quit", "exit", "q"]:
+                print("Goodbye!")
+                break
+            stream_graph_updates(graph, user_input)
+        except:
+            # fallback if input() is not available
+            user_input = "Что ты знаешь о LangGraph?"
+            print("User: " + user_input)
+            stream_graph_updates(graph, user_input)
             break
-        stream_graph_updates(user_input)
-    except:
-        # fallback if input() is not available
-        user_input = "Что ты знаешь о LangGraph?"
-        print("User: " + user_input)
-        stream_graph_updates(user_input)
-        break
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Простой чат-бот на LangGraph")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("chat", help="диалог в консоли (по умолчанию)")
+    draw = subparsers.add_parser("draw-graph", help="сохранить mermaid-картинку графа")
+    draw.add_argument("--output", default="../graph_image.png")
+    args = parser.parse_args()
+
+    graph = build_graph()
+    if args.command == "draw-graph":
+        draw_graph(graph, args.output)
+    else:
+        chat(graph)
@@ -0,0 +1,83 @@
+"""
+Каскад моделей для LLM-классификации.
+
+Сообщение сначала классифицирует самая маленькая модель каскада. К следующей
+(более крупной) модели оно уходит, только если ответ неуверенный (вероятность
+спама между low и high) или сообщение подходит под критерии эскалации:
+длинный текст, ссылки, денежные символы. Список моделей задаётся по умолчанию
+и может быть переопределён для отдельных чатов.
+
+Формат файла LLM_CASCADE_CONFIG:
+    {"default": ["qwen2.5:0.5b", "llama3:8b"], "chats": {"-1001234567890": ["llama3:8b"]}}
+"""
+
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_LINK_RE = re.compile(r"https?://|www\.|t\.me/|@[A-Za-z0-9_]{5,}", re.IGNORECASE)
+_MONEY_RE = re.compile(r"[$€₽]|\b(usd|usdt|руб|доллар)", re.IGNORECASE)
+
+
+class CascadeConfig:
+    def __init__(
+            self,
+            default_models: List[str],
+            chat_models: Optional[Dict[int, List[str]]] = None,
+            low: float = 0.2,
+            high: float = 0.8,
+            max_length: int = 500,
+            criteria: tuple = ("length", "links", "money"),
+    ):
+        if not default_models:
+            raise ValueError("каскад должен содержать хотя бы одну модель")
+        self.default_models = default_models
+        self.chat_models = chat_models or {}
+        self.low = low
+        self.high = high
+        self.max_length = max_length
+        self.criteria = set(criteria)
+
+    @classmethod
+    def from_env(cls, fallback_model: str) -> "CascadeConfig":
+        default_models = [m.strip() for m in os.getenv("LLM_CASCADE", "").split(",") if m.strip()]
+        chat_models: Dict[int, List[str]] = {}
+
+        path = os.getenv("LLM_CASCADE_CONFIG")
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            default_models = data.get("default") or default_models
+            chat_models = {int(chat_id): models for chat_id, models in data.get("chats", {}).items()}
+
+        config = cls(
+            default_models or [fallback_model],
+            chat_models,
+            low=float(os.getenv("LLM_CASCADE_LOW", "0.2")),
+            high=float(os.getenv("LLM_CASCADE_HIGH", "0.8")),
+            max_length=int(os.getenv("LLM_CASCADE_MAX_LENGTH", "500")),
+            criteria=tuple(c.strip() for c in os.getenv("LLM_CASCADE_CRITERIA", "length,links,money").split(",")
+                           if c.strip()),
+        )
+        logger.info(f"🪜 Каскад моделей: {' → '.join(config.default_models)}"
+                    f"{f', особые настройки для {len(chat_models)} чатов' if chat_models else ''}")
+        return config
+
+    def models_for(self, chat_id: int) -> List[str]:
+        return self.chat_models.get(chat_id) or self.default_models
+
+    def escalation_reason(self, text: str, probability: Optional[float]) -> Optional[str]:
+        """Почему ответ текущего уровня недостаточен (None — вердикт окончательный)."""
+        if probability is not None and self.low < probability < self.high:
+            return f"low_confidence p={probability:.2f}"
+        if "length" in self.criteria and len(text) > self.max_length:
+            return "length"
+        if "links" in self.criteria and _LINK_RE.search(text):
+            return "links"
+        if "money" in self.criteria and _MONEY_RE.search(text):
+            return "money"
+        return None
@@ -0,0 +1,232 @@
+"""
+Реестр бэкендов классификации и теневой режим.
+
+Раньше агент выбирался правкой импорта в main.py, и скорость двух реализаций
+никто не сравнивал. Бэкенд — объект с двумя методами:
+- handle(message)   — полная обработка с действиями (сохранение, пересылка,
+  удаление), вызывается для основного бэкенда;
+- classify(message) — только вердикт, без действий; так работает теневой.
+
+Основной бэкенд задаёт CLASSIFIER_BACKEND. Если задан CLASSIFIER_SHADOW_BACKEND,
+доля CLASSIFIER_SHADOW_RATE сообщений параллельно уходит в теневой бэкенд.
+Его вердикт ни на что не влияет, а только сравнивается с основным. По каждому
+бэкенду пишутся задержка, число вызовов LLM и вердикты, по паре — доля
+совпадений.
+
+Новый бэкенд регистрируется декоратором:
+
+    @register_backend("my_backend")
+    def _my_backend() -> ClassifierBackend: ...
+"""
+
+import abc
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Set
+
+from aiogram import types
+
+import metrics
+from llm_pool import count_llm_calls
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Verdict:
+    is_spam: bool
+    source: str  # кто вынес вердикт внутри бэкенда (llm, cache, ml, ...)
+    latency: float = 0.0
+    llm_calls: int = 0
+
+
+class ClassifierBackend(abc.ABC):
+    """Общий контракт бэкендов классификации."""
+
+    name = ""
+    supports_resume = False  # умеет продолжать сообщение из долговечной очереди (см. pending_store.py)
+
+    @abc.abstractmethod
+    async def handle(self, message: types.Message, **kwargs) -> Verdict:
+        """Полная обработка сообщения с действиями модерации."""
+
+    @abc.abstractmethod
+    async def classify(self, message: types.Message) -> Verdict:
+        """Только вердикт: без действий и без изменения общего состояния бэкенда."""
+
+
+# Источники вердикта, при которых основной бэкенд сообщение не классифицировал: доверенный отправитель,
+# отложено при перегрузке, копия рейда. Сравнивать с ними теневой вердикт бессмысленно.
+UNCLASSIFIED_SOURCES = {"reputation", "deferred", "raid"}
+
+_BACKENDS: Dict[str, Callable[[], ClassifierBackend]] = {}
+_instances: Dict[str, ClassifierBackend] = {}
+
+
+def register_backend(name: str):
+    def decorator(factory: Callable[[], ClassifierBackend]):
+        _BACKENDS[name] = factory
+        return factory
+
+    return decorator
+
+
+def available_backends() -> list:
+    return sorted(_BACKENDS)
+
+
+def get_backend(name: str) -> ClassifierBackend:
+    """Экземпляр бэкенда (создаётся при первом обращении: импорт SDK только нужных бэкендов)."""
+    if name not in _BACKENDS:
+        raise ValueError(f"неизвестный бэкенд классификации {name!r}, доступны: {', '.join(available_backends())}")
+    if name not in _instances:
+        backend = _instances[name] = _BACKENDS[name]()
+        backend.name = name
+    return _instances[name]
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Встроенные бэкенды
+# ------------------------------------------------------------------ #
+class LangGraphBackend(ClassifierBackend):
+    supports_resume = True
+
+    def __init__(self):
+        import spam_agent_langgraph
+
+        self.pipeline = spam_agent_langgraph
+
+    @staticmethod
+    def _verdict(state: dict) -> Verdict:
+        return Verdict(bool(state.get("is_spam")), state.get("verdict_source", "unknown"))
+
+    async def handle(self, message: types.Message, **kwargs) -> Verdict:
+        return self._verdict(await self.pipeline.agent_check_spam(message, **kwargs))
+
+    async def classify(self, message: types.Message) -> Verdict:
+        return self._verdict(await self.pipeline.classify_message(message))
+
+
+class AgentsSDKBackend(ClassifierBackend):
+    def __init__(self):
+        import spam_agent
+
+        self.pipeline = spam_agent
+
+    def _verdict(self, result) -> Verdict:
+        if result is None:
+            return Verdict(False, "reputation")
+        return Verdict(self.pipeline.is_spam_output(result), "agents")
+
+    async def handle(self, message: types.Message, **kwargs) -> Verdict:
+        return self._verdict(await self.pipeline.agent_check_spam(message))
+
+    async def classify(self, message: types.Message) -> Verdict:
+        return self._verdict(await self.pipeline.agent_check_spam(message, dry_run=True))
+
+
+register_backend("langgraph")(LangGraphBackend)
+register_backend("agents")(AgentsSDKBackend)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Основной бэкенд + теневой
+# ------------------------------------------------------------------ #
+async def _measured(backend: ClassifierBackend, mode: str, call) -> Verdict:
+    started = time.perf_counter()
+    with count_llm_calls() as calls:
+        verdict = await call
+    verdict.latency = time.perf_counter() - started
+    verdict.llm_calls = calls[0]
+    metrics.BACKEND_DURATION.observe(verdict.latency, backend=backend.name, mode=mode)
+    metrics.BACKEND_LLM_CALLS.inc(verdict.llm_calls, backend=backend.name, mode=mode)
+    metrics.BACKEND_VERDICTS.inc(backend=backend.name, mode=mode, verdict="SPAM" if verdict.is_spam else "NOT_SPAM")
+    return verdict
+
+
+class ClassifierRouter:
+    """Обработчик очереди классификации: основной бэкенд действует, теневой только сравнивается."""
+
+    def __init__(
+            self,
+            primary: ClassifierBackend,
+            shadow: Optional[ClassifierBackend] = None,
+            shadow_rate: float = 0.1,
+            max_shadow_in_flight: int = 4,
+    ):
+        self.primary = primary
+        self.shadow = shadow if shadow is not None and shadow is not primary else None
+        self.shadow_rate = shadow_rate
+        self.max_shadow_in_flight = max_shadow_in_flight
+        self._shadow_tasks: Set[asyncio.Task] = set()
+
+        self.shadowed = 0
+        self.agreed = 0
+        self.shadow_skipped = 0
+        self.shadow_unclassified = 0
+
+    async def __call__(self, message: types.Message, **kwargs) -> Verdict:
+        verdict = await _measured(self.primary, "primary", self.primary.handle(message, **kwargs))
+        if self.shadow is not None and random.random() < self.shadow_rate:
+            if verdict.source in UNCLASSIFIED_SOURCES:
+                self.shadow_unclassified += 1
+                metrics.SHADOW_COMPARISONS.inc(primary=self.primary.name, shadow=self.shadow.name,
+                                               outcome="unclassified")
+            elif len(self._shadow_tasks) >= self.max_shadow_in_flight:
+                # Теневой бэкенд не должен отнимать ресурсы у основного
+                self.shadow_skipped += 1
+                metrics.SHADOW_COMPARISONS.inc(primary=self.primary.name, shadow=self.shadow.name,
+                                               outcome="skipped")
+            else:
+                task = asyncio.create_task(self._run_shadow(message, verdict))
+                self._shadow_tasks.add(task)
+                task.add_done_callback(self._shadow_tasks.discard)
+        return verdict
+
+    async def _run_shadow(self, message: types.Message, primary: Verdict) -> None:
+        try:
+            verdict = await _measured(self.shadow, "shadow", self.shadow.classify(message))
+        except Exception as exc:
+            logger.warning(f"⚠️ Теневой бэкенд {self.shadow.name} упал: {exc}")
+            metrics.SHADOW_COMPARISONS.inc(primary=self.primary.name, shadow=self.shadow.name, outcome="error")
+            return
+
+        agree = verdict.is_spam == primary.is_spam
+        self.shadowed += 1
+        self.agreed += agree
+        metrics.SHADOW_COMPARISONS.inc(primary=self.primary.name, shadow=self.shadow.name,
+                                       outcome="agree" if agree else "disagree")
+        if not agree:
+            logger.info(
+                f"🌓 Расхождение бэкендов на {message.chat.id}/{message.message_id}: "
+                f"{self.primary.name}={'SPAM' if primary.is_spam else 'NOT_SPAM'} ({primary.source}, "
+                f"{primary.latency * 1000:.0f} мс), {self.shadow.name}={'SPAM' if verdict.is_spam else 'NOT_SPAM'} "
+                f"({verdict.latency * 1000:.0f} мс)"
+            )
+
+    async def close(self) -> None:
+        """Дожидается теневых проверок, уже запущенных к моменту остановки."""
+        if self._shadow_tasks:
+            await asyncio.gather(*self._shadow_tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "primary": self.primary.name,
+            "shadow": self.shadow.name if self.shadow else None,
+            "shadowed": self.shadowed,
+            "agreement": self.agreed / self.shadowed if self.shadowed else None,
+            "shadow_skipped": self.shadow_skipped,
+            "shadow_unclassified": self.shadow_unclassified,
+        }
+
+
+def build_router(primary: str, shadow: str = "", shadow_rate: float = 0.1) -> ClassifierRouter:
+    router = ClassifierRouter(get_backend(primary), get_backend(shadow) if shadow else None, shadow_rate)
+    if router.shadow is not None:
+        logger.info(f"🌓 Бэкенд классификации: {primary}, теневой: {shadow} ({shadow_rate:.0%} сообщений)")
+    else:
+        logger.info(f"Бэкенд классификации: {primary}")
+    return router
@@ -0,0 +1,207 @@
+"""
+Локальная замена Telegram для нагрузочного теста режима вебхука.
+
+- генератор шлёт на вебхук поддельные обновления с сообщениями из корпуса,
+  разложенными по чатам и пользователям, с заданной частотой;
+- поддельный Bot API (TELEGRAM_API_URL=http://127.0.0.1:8081) отвечает на
+  forward/delete/sendMessage, чтобы воркеры не ходили в настоящий Telegram.
+
+Пример (три терминала):
+    python stub_llm_server.py --labels benchmark_corpus.jsonl
+    python fake_telegram.py api --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 OPENAI_BASE_URL=http://127.0.0.1:11435/v1 \\
+        python main.py webhook --workers 4
+    python fake_telegram.py send --rate 200 --count 5000 --chats 50
+Задержка «обновление → вердикт» и нагрузка процессов — на /metrics бота.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from collections import Counter
+from typing import List, Optional
+
+from aiohttp import ClientSession, web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Генератор обновлений
+# ------------------------------------------------------------------ #
+class UpdateGenerator:
+    """Поддельные обновления Telegram с текстом из корпуса."""
+
+    def __init__(self, texts: List[str], chats: int = 20, users: int = 200, seed: int = 0):
+        self.texts = texts
+        self.chats = chats
+        self.users = users
+        self._random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def next_update(self) -> dict:
+        chat_id = -1001000000000 - self._random.randrange(self.chats)
+        user_id = 100000 + self._random.randrange(self.users)
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"Load test {chat_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "User", "last_name": str(user_id),
+                         "username": f"user{user_id}"},
+                "text": self._random.choice(self.texts),
+            },
+        }
+
+
+async def send_updates(
+        url: str,
+        generator: UpdateGenerator,
+        count: int,
+        rate: float,
+        concurrency: int = 32,
+        secret: str = "",
+) -> dict:
+    """Шлёт count обновлений с частотой rate в секунду; возвращает статистику ответов вебхука."""
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {SECRET_HEADER: secret} if secret else {}
+
+    async with ClientSession() as session:
+        async def post(update: dict) -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.post(url, json=update, headers=headers) as response:
+                        statuses[response.status] += 1
+                except Exception as exc:
+                    statuses[type(exc).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        tasks = []
+        for i in range(count):
+            # Равномерный поток: i-е обновление уходит не раньше i / rate секунд от старта
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(generator.next_update())))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "sent": count,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "webhook_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else 0.0,
+        "webhook_p99_ms": round(latencies[int(0.99 * (len(latencies) - 1))] * 1000, 2) if latencies else 0.0,
+    }
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Поддельный Bot API
+# ------------------------------------------------------------------ #
+class FakeBotAPI:
+    """Отвечает на методы Bot API минимально правдоподобными результатами."""
+
+    def __init__(self, latency_ms: float = 0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency_ms / 1000
+        self.host = host
+        self.port = port
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    def _result(self, method: str, params: dict):
+        if method == "forwardmessages":
+            return [{"message_id": next(self._message_ids)} for _ in json.loads(params.get("message_ids", "[]"))]
+        if method in ("forwardmessage", "sendmessage"):
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "supergroup"},
+                "text": params.get("text", ""),
+            }
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "NoSpam", "username": "nospam_bot"}
+        return True
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def load_texts(corpus_path: str) -> List[str]:
+    with open(corpus_path, encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+async def _serve_api(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(latency_ms=args.latency_ms, host=args.host, port=args.port)
+    await api.start()
+    print(f"Поддельный Bot API слушает http://{api.host}:{api.port}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"Вызовы Bot API: {dict(api.calls)}")
+    finally:
+        await api.stop()
+
+
+async def _send(args: argparse.Namespace) -> None:
+    generator = UpdateGenerator(load_texts(args.corpus), chats=args.chats, users=args.users, seed=args.seed)
+    report = await send_updates(args.url, generator, args.count, args.rate, args.concurrency, args.secret)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Поддельный Telegram для нагрузочного теста вебхука")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    send = subparsers.add_parser("send", help="слать поддельные обновления на вебхук")
+    send.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    send.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    send.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "benchmark_corpus.jsonl"))
+    send.add_argument("--count", type=int, default=1000)
+    send.add_argument("--rate", type=float, default=100, help="обновлений в секунду")
+    send.add_argument("--concurrency", type=int, default=32)
+    send.add_argument("--chats", type=int, default=20)
+    send.add_argument("--users", type=int, default=200)
+    send.add_argument("--seed", type=int, default=0)
+
+    api = subparsers.add_parser("api", help="поднять поддельный Bot API")
+    api.add_argument("--host", default="127.0.0.1")
+    api.add_argument("--port", type=int, default=8081)
+    api.add_argument("--latency-ms", type=float, default=0)
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(_send(args) if args.command == "send" else _serve_api(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,383 @@
+"""
+Пул OpenAI-совместимых LLM-эндпоинтов.
+
+Оба агента раньше ходили в один `http://localhost:11434/v1` без таймаута, и
+одна медленная генерация задерживала всё, что стояло за ней. Пул раскладывает
+запросы по списку эндпоинтов (LLM_ENDPOINTS):
+- выбирается здоровый эндпоинт с наименьшим числом запросов в работе;
+- у каждого запроса есть дедлайн;
+- если ответ не пришёл за p95 последних запросов к этому эндпоинту, тот же
+  запрос параллельно отправляется на второй эндпоинт (hedging), побеждает
+  первый успешный ответ;
+- при ошибке запрос повторяется на другом эндпоинте, пока не истёк дедлайн;
+- попытка, не ответившая к дедлайну или проигравшая hedging дольше p95
+  своего эндпоинта, считается таймаутом — зависший сервер выводится из
+  ротации так же, как отвечающий ошибками;
+- фоновая проверка /models возвращает упавшие эндпоинты в ротацию.
+
+Пул не зависит от конкретного SDK: вызывающий передаёт функцию
+`endpoint -> awaitable`, а клиенты (ChatOpenAI, AsyncOpenAI) кэшируются на
+эндпоинте через `endpoint.client(name, factory)`.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Счётчик вызовов LLM для текущей задачи (см. count_llm_calls)
+_llm_calls: ContextVar[Optional[List[int]]] = ContextVar("llm_calls", default=None)
+
+
+@contextmanager
+def count_llm_calls():
+    """
+    Считает вызовы пула внутри блока: `with count_llm_calls() as calls: ...; calls[0]`.
+    Вызовы, сделанные в других задачах (пачка микро-батча), туда не попадают сами:
+    их добавляет тот, кто делает вызов за вызывающего (см. current_llm_calls).
+    """
+    calls = [0]
+    token = _llm_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _llm_calls.reset(token)
+
+
+def current_llm_calls() -> Optional[List[int]]:
+    """Счётчик внешнего count_llm_calls() или None, если вызовы сейчас не считаются."""
+    return _llm_calls.get()
+
+
+class LLMEndpoint:
+    """Один OpenAI-совместимый сервер и его статистика."""
+
+    def __init__(self, base_url: str, latency_window: int = 200):
+        self.base_url = base_url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_errors = 0
+        self._latencies: deque = deque(maxlen=latency_window)
+        self._clients: Dict[str, Any] = {}
+
+    def client(self, name: str, factory: Callable[[str], Any]) -> Any:
+        """Клиент SDK для этого эндпоинта (создаётся один раз)."""
+        if name not in self._clients:
+            self._clients[name] = factory(self.base_url)
+        return self._clients[name]
+
+    def observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    def p95(self, min_samples: int) -> Optional[float]:
+        if len(self._latencies) < min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def mean_latency(self) -> float:
+        return sum(self._latencies) / len(self._latencies) if self._latencies else 0.0
+
+
+class LLMPool:
+    """Least-outstanding балансировка, дедлайны, hedging и health-check."""
+
+    def __init__(
+            self,
+            base_urls: List[str],
+            timeout: float = 30.0,
+            hedge: bool = True,
+            hedge_min_samples: int = 20,
+            max_errors: int = 3,
+            health_interval: float = 15.0,
+    ):
+        if not base_urls:
+            raise ValueError("нужен хотя бы один LLM-эндпоинт")
+        self.endpoints = [LLMEndpoint(url) for url in base_urls]
+        self.timeout = timeout
+        self.hedge = hedge and len(self.endpoints) > 1
+        self.hedge_min_samples = hedge_min_samples
+        self.max_errors = max_errors
+        self.health_interval = health_interval
+        self._health_task: Optional[asyncio.Task] = None
+
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Выбор эндпоинта
+    # -------------------------------------------------------------- #
+    def pick(self, exclude: List[LLMEndpoint] = ()) -> Optional[LLMEndpoint]:
+        candidates = [e for e in self.endpoints if e not in exclude]
+        healthy = [e for e in candidates if e.healthy] or candidates
+        if not healthy:
+            return None
+        return min(healthy, key=lambda e: (e.outstanding, e.mean_latency()))
+
+    def _record_failure(self, endpoint: LLMEndpoint, outcome: str) -> None:
+        """Ошибка или таймаут: после max_errors подряд эндпоинт выводится из ротации."""
+        endpoint.consecutive_errors += 1
+        metrics.LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.base_url, outcome=outcome)
+        if endpoint.consecutive_errors >= self.max_errors and endpoint.healthy:
+            endpoint.healthy = False
+            logger.warning(f"🚑 LLM-эндпоинт {endpoint.base_url} выведен из ротации")
+
+    @contextmanager
+    def track(self, endpoint: LLMEndpoint):
+        """Учёт запроса к эндпоинту: запросы в работе, задержка, ошибки (и для потоков вне call())."""
+        endpoint.outstanding += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self._record_failure(endpoint, "error")
+            raise
+        finally:
+            endpoint.outstanding -= 1
+        endpoint.consecutive_errors = 0
+        endpoint.observe(time.perf_counter() - started)
+        metrics.LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.base_url, outcome="ok")
+
+    async def _attempt(self, endpoint: LLMEndpoint, call: Callable[[LLMEndpoint], Awaitable[Any]]) -> Any:
+        with self.track(endpoint):
+            return await call(endpoint)
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Вызов с дедлайном, hedging и переключением
+    # -------------------------------------------------------------- #
+    async def call(self, call: Callable[[LLMEndpoint], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """Выполняет call(endpoint) на лучшем эндпоинте; результат первого успешного ответа."""
+        self._ensure_health_checks()
+        calls = _llm_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        tried: List[LLMEndpoint] = []
+        running: Dict[asyncio.Task, LLMEndpoint] = {}
+        started: Dict[asyncio.Task, float] = {}
+        last_error: Optional[BaseException] = None
+        cancelled = False
+
+        def launch() -> bool:
+            endpoint = self.pick(exclude=tried)
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            task = asyncio.ensure_future(self._attempt(endpoint, call))
+            running[task] = endpoint
+            started[task] = time.monotonic()
+            return True
+
+        launch()
+        try:
+            while running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"LLM не ответила за {timeout or self.timeout:.1f} с")
+
+                # Пока запрос один, ждём не дольше p95 его эндпоинта, затем дублируем
+                wait_for = remaining
+                hedge_after = None
+                if self.hedge and len(running) == 1 and len(tried) < len(self.endpoints):
+                    hedge_after = tried[-1].p95(self.hedge_min_samples)
+                    if hedge_after is not None:
+                        wait_for = min(remaining, hedge_after)
+
+                done, _ = await asyncio.wait(running, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_after is not None and launch():
+                        self.hedged += 1
+                        metrics.LLM_HEDGES.inc()
+                        logger.debug(f"🪃 Hedged-запрос: ответа нет дольше p95 ({hedge_after:.2f} с)")
+                    continue
+
+                for task in done:
+                    endpoint = running.pop(task)
+                    if task.exception() is None:
+                        if endpoint is not tried[0]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"⚠️ Ошибка LLM-эндпоинта {endpoint.base_url}: {last_error}")
+
+                # Все запущенные попытки упали — пробуем следующий эндпоинт
+                if not running and not launch():
+                    break
+            raise last_error or RuntimeError("нет доступных LLM-эндпоинтов")
+        except asyncio.CancelledError:
+            cancelled = True  # отменил вызывающий: эндпоинты не виноваты
+            raise
+        finally:
+            now = time.monotonic()
+            for task, endpoint in running.items():
+                task.cancel()
+                if cancelled:
+                    continue
+                # Попытка не ответила к дедлайну или дольше p95 своего эндпоинта — это таймаут
+                elapsed = now - started[task]
+                p95 = endpoint.p95(self.hedge_min_samples)
+                if now >= deadline or (p95 is not None and elapsed > p95):
+                    endpoint.observe(elapsed)
+                    self._record_failure(endpoint, "timeout")
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Проверка здоровья
+    # -------------------------------------------------------------- #
+    def _ensure_health_checks(self) -> None:
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        import httpx
+
+        async with httpx.AsyncClient(timeout=min(5.0, self.health_interval)) as client:
+            while True:
+                await asyncio.sleep(self.health_interval)
+                for endpoint in self.endpoints:
+                    try:
+                        response = await client.get(f"{endpoint.base_url}/models")
+                        healthy = response.status_code < 500
+                    except Exception:
+                        healthy = False
+                    if healthy != endpoint.healthy:
+                        logger.info(f"🩺 LLM-эндпоинт {endpoint.base_url}: "
+                                    f"{'доступен' if healthy else 'недоступен'}")
+                    endpoint.healthy = healthy
+                    if healthy:
+                        endpoint.consecutive_errors = 0
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    def stats(self) -> dict:
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "endpoints": [
+                {
+                    "base_url": e.base_url,
+                    "healthy": e.healthy,
+                    "outstanding": e.outstanding,
+                    "p95_s": e.p95(1),
+                }
+                for e in self.endpoints
+            ],
+        }
+
+
+class PooledChatModel:
+    """
+    Обёртка с интерфейсом `ainvoke` (как у ChatOpenAI) и потоковым `astream_until`, которая отправляет
+    каждый вызов через пул. factory(base_url) создаёт модель для эндпоинта.
+    """
+
+    def __init__(self, pool: LLMPool, factory: Callable[[str], Any], name: str = "chat"):
+        self.pool = pool
+        self.factory = factory
+        self.name = name
+
+    async def ainvoke(self, messages, **kwargs):
+        return await self.pool.call(
+            lambda endpoint: endpoint.client(self.name, self.factory).ainvoke(messages, **kwargs)
+        )
+
+    async def ainvoke_each(self, messages, **kwargs) -> list:
+        """Один и тот же запрос на все эндпоинты (прогрев); ошибки возвращаются в списке."""
+        return await asyncio.gather(
+            *(endpoint.client(self.name, self.factory).ainvoke(messages, **kwargs)
+              for endpoint in self.pool.endpoints),
+            return_exceptions=True,
+        )
+
+    async def astream_until(self, messages, done: Callable[[str], bool], **kwargs) -> str:
+        """Читает потоковый ответ, пока done(текст) не вернёт True; остаток генерации отменяется."""
+
+        async def consume(endpoint: LLMEndpoint) -> str:
+            answer = ""
+            async for chunk in endpoint.client(self.name, self.factory).astream(messages, **kwargs):
+                answer += chunk.content or ""
+                if done(answer):
+                    break  # закрытие потока обрывает соединение, и сервер прекращает генерацию
+            return answer
+
+        return await self.pool.call(consume)
+
+
+def _extra_body_transport(inner, extra_body: dict):
+    """
+    Транспорт httpx, дописывающий поля в JSON-тело каждого POST (например keep_alive для Ollama).
+    Нужен там, где SDK не даёт передать extra_body: openai-agents вызывает
+    chat.completions.create сам, а в его ModelSettings такого поля нет.
+    """
+    import json
+
+    import httpx
+
+    class ExtraBodyTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            if request.method == "POST" and request.headers.get("content-type", "").startswith("application/json"):
+                body = json.loads(await request.aread() or b"{}")
+                if isinstance(body, dict):
+                    headers = request.headers.copy()
+                    del headers["content-length"]  # пересчитается по новому телу
+                    request = httpx.Request(
+                        request.method,
+                        request.url,
+                        headers=headers,
+                        json={**extra_body, **body},  # явные поля запроса важнее
+                        extensions=request.extensions,
+                    )
+            return await inner.handle_async_request(request)
+
+        async def aclose(self) -> None:
+            await inner.aclose()
+
+    return ExtraBodyTransport()
+
+
+def make_http_client(extra_body: Optional[dict] = None):
+    """httpx-клиент с ограниченным пулом keep-alive соединений к LLM."""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "32")),
+        max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "16")),
+    )
+    timeout = httpx.Timeout(float(os.getenv("LLM_REQUEST_TIMEOUT", "30")), connect=5.0)
+    if not extra_body:
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+    # С собственным транспортом limits клиента не применяются — задаём их транспорту
+    transport = _extra_body_transport(httpx.AsyncHTTPTransport(limits=limits), extra_body)
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Пул по умолчанию (создаётся при первом обращении, после load_dotenv)
+# ------------------------------------------------------------------ #
+_pool: Optional[LLMPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_pool() -> LLMPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            endpoints = os.getenv("LLM_ENDPOINTS") or os.getenv("OPENAI_BASE_URL", "http://localhost:11434/v1")
+            _pool = LLMPool(
+                [url.strip() for url in endpoints.split(",") if url.strip()],
+                timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", "30")),
+                hedge=os.getenv("LLM_HEDGE", "1") != "0",
+                health_interval=float(os.getenv("LLM_HEALTH_INTERVAL", "15")),
+            )
+        return _pool
@@ -1,38 +1,314 @@
+import time
+_PROCESS_STARTED = time.perf_counter()  # для замера стоимости импортов
+_PROCESS_STARTED_AT = time.time()
+
+import argparse
 import asyncio
 import logging
 import os
+from functools import partial
+from typing import Optional
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv
-# from spam_agent import agent_check_spam
-from spam_agent_langgraph import agent_check_spam
+import spam_agent_langgraph
+from classifier_backends import ClassifierRouter, build_router
+from work_queue import ClassificationQueue
+from spam_storage import get_spam_store
+from moderation import get_moderator
+from reputation import get_reputation_store
+from pending_store import BACKLOG, QUEUED, get_pending_store
+from flood_detector import FloodVerdict
+import metrics
+import webhook_server
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+CLASSIFIER_WORKERS = int(os.getenv('CLASSIFIER_WORKERS', '4'))
+# Бэкенд классификации: langgraph или agents; теневой получает долю сообщений без права действовать
+CLASSIFIER_BACKEND = os.getenv('CLASSIFIER_BACKEND', 'langgraph')
+CLASSIFIER_SHADOW_BACKEND = os.getenv('CLASSIFIER_SHADOW_BACKEND', '')
+CLASSIFIER_SHADOW_RATE = float(os.getenv('CLASSIFIER_SHADOW_RATE', '0.1'))
+QUEUE_HIGH_WATER = int(os.getenv('QUEUE_HIGH_WATER', '200'))
+QUEUE_STATS_INTERVAL = float(os.getenv('QUEUE_STATS_INTERVAL', '60'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # 0 — без HTTP-эндпоинта
+# Режим вебхука: процессы-воркеры получают порты метрик METRICS_PORT+1, METRICS_PORT+2, ...
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес для setWebhook (пусто — не регистрировать)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', '30'))
+# Сообщения старше запуска бота на столько секунд (пришли, пока он не работал) разбираются пачкой
+PENDING_BACKLOG_AGE = float(os.getenv('PENDING_BACKLOG_AGE', '5'))
+PENDING_DRAIN_BATCH = int(os.getenv('PENDING_DRAIN_BATCH', '32'))
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # локальный Bot API server или fake_telegram.py
 
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+logger.info(f"⏱️ Импорт модулей занял {time.perf_counter() - _PROCESS_STARTED:.3f} с")
+
+# Бот, бэкенд классификации и очередь создаются при запуске (build_pipeline), а не при импорте:
+# draw-graph работает без TELEGRAM_BOT_TOKEN
+bot: Optional[Bot] = None
+classifier: Optional[ClassifierRouter] = None
+classification_queue: Optional[ClassificationQueue] = None
+
+
+def create_bot() -> Bot:
+    global bot
+    if bot is None:
+        bot = Bot(
+            token=TELEGRAM_BOT_TOKEN,
+            session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+        )
+    return bot
+
+
+def build_pipeline() -> None:
+    global classifier, classification_queue
+    create_bot()
+    if classification_queue is not None:
+        return
+    if not spam_agent_langgraph.TARGET_GROUP_ID:
+        logger.warning("⚠️ TARGET_GROUP_ID не задан — пересылка спама в группу модерации работать не будет")
+    classifier = build_router(CLASSIFIER_BACKEND, CLASSIFIER_SHADOW_BACKEND, CLASSIFIER_SHADOW_RATE)
+    classification_queue = ClassificationQueue(
+        classifier,
+        workers=CLASSIFIER_WORKERS,
+        high_water=QUEUE_HIGH_WATER,
+        stats_interval=QUEUE_STATS_INTERVAL,
+    )
+    # Глубина очереди — второй сигнал перегрузки (наряду с задержкой LLM)
+    spam_agent_langgraph.overload_controller.queue_depth = lambda: classification_queue.stats()["depth"]
+    # Отложенные сообщения перепроверяются через очередь: не параллельно с новыми сообщениями того же чата
+    spam_agent_langgraph.overload_controller.recheck = partial(classification_queue.put, recheck=True)
+
+
+backlog_ready = asyncio.Event()  # в долговечной очереди появился backlog
+
+metrics.REGISTRY.gauge("nospam_pending_backlog", "Сообщений в backlog долговечной очереди",
+                       lambda: get_pending_store().count(BACKLOG) if get_pending_store() else 0)
+metrics.REGISTRY.gauge("nospam_queue_depth", "Сообщений в очереди классификации",
+                       lambda: classification_queue.stats()["depth"])
+metrics.REGISTRY.gauge("nospam_queue_in_flight", "Сообщений в работе у воркеров",
+                       lambda: classification_queue.stats()["in_flight"])
+metrics.REGISTRY.gauge("nospam_worker_utilisation", "Доля времени, когда воркеры заняты",
+                       lambda: classification_queue.stats()["utilisation"])
 
 @dp.message()
 async def handle_message(message: types.Message):
+    if message.new_chat_members:
+        classification_queue.mark_new_members(
+            message.chat.id, [user.id for user in message.new_chat_members]
+        )
+        for user in message.new_chat_members:
+            get_reputation_store().mark_joined(message.chat.id, user.id)
+
     if not message.text:
         logger.info(f"Получено сообщение без текста (тип: {message.content_type})")
         return  # Пропускаем обработку
 
     logger.info(f"Проверка сообщения: {message.text[:50]}...")
-    await agent_check_spam(message)
+    store = get_pending_store() if classifier.primary.supports_resume else None
+    if store is None:
+        await classification_queue.put(message)
+        return
+
+    # Запись до подтверждения обновления: после перезапуска сообщение не потеряется
+    risk = spam_agent_langgraph.ingest_risk(message.text)
+    stale = message.date.timestamp() < _PROCESS_STARTED_AT - PENDING_BACKLOG_AGE
+    await asyncio.to_thread(
+        store.record, message.chat.id, message.message_id,
+        message.model_dump_json(exclude_none=True), risk, BACKLOG if stale else QUEUED,
+    )
+    if stale:
+        backlog_ready.set()  # пришло, пока бот не работал: разбор пачкой по риску
+    else:
+        await classification_queue.put(message)
+
+
+async def drain_backlog(store):
+    """Разбирает backlog пачками (сначала высокий риск, затем новые) и пишет пропускную способность."""
+
+    async def drain_one(entry):
+        message = types.Message.model_validate_json(entry.message_json).as_(bot)
+        try:
+            await classifier(message, resume=entry)
+        except Exception as exc:
+            logger.exception(f"Ошибка при разборе backlog {entry.chat_id}/{entry.message_id}: {exc}")
+        finally:
+            if classification_queue.on_processed is not None:
+                classification_queue.on_processed(message)
+
+    while True:
+        await backlog_ready.wait()
+        backlog_ready.clear()
+        started = time.perf_counter()
+        drained = 0
+        while batch := await asyncio.to_thread(store.claim_backlog, PENDING_DRAIN_BATCH):
+            await asyncio.gather(*(drain_one(entry) for entry in batch))
+            drained += len(batch)
+            metrics.BACKLOG_DRAINED.inc(len(batch))
+        if drained:
+            elapsed = time.perf_counter() - started
+            logger.info(f"📦 Backlog разобран: {drained} сообщений за {elapsed:.1f} с "
+                        f"({drained / elapsed if elapsed else 0:.1f} сообщ/с)")
+
+
+async def start_services(metrics_port: int = METRICS_PORT):
+    build_pipeline()
+    # Граф собирается в отдельном потоке параллельно с подключением к Telegram;
+    # сообщения, пришедшие раньше, дождутся его в agent_check_spam
+    if 'langgraph' in (CLASSIFIER_BACKEND, CLASSIFIER_SHADOW_BACKEND):
+        graph_warm_up = asyncio.create_task(spam_agent_langgraph.warm_up())
+    else:
+        graph_warm_up = asyncio.create_task(asyncio.sleep(0))
+    get_spam_store()  # схема SQLite создаётся до первого спама, а не внутри хэндлера
+    await classification_queue.start()
+    metrics_runner = await metrics.start_metrics_server(METRICS_HOST, metrics_port) if metrics_port else None
+
+    drainer = None
+    store = get_pending_store() if classifier.primary.supports_resume else None
+    if store is not None:
+        # Недоразобранное в прошлом запуске (в том числе отложенное при перегрузке) — в backlog
+        requeued = await asyncio.to_thread(store.requeue_all)
+        if store.count(BACKLOG):
+            logger.info(f"📦 В долговечной очереди с прошлого запуска: {store.count(BACKLOG)} сообщений"
+                        f" (возвращено в backlog: {requeued})")
+            backlog_ready.set()
+        drainer = asyncio.create_task(drain_backlog(store))
+    return graph_warm_up, metrics_runner, drainer
+
+
+async def stop_services(graph_warm_up, metrics_runner, drainer):
+    graph_warm_up.cancel()
+    if drainer is not None:
+        drainer.cancel()  # недоразобранное останется в очереди до следующего запуска
+    await classification_queue.stop()
+    await classifier.close()  # теневые проверки, уже запущенные к остановке
+    await get_moderator().close()  # досылаем накопленные пересылки и удаления
+    await bot.session.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
 
 
 async def main():
     logger.info("Запуск бота...")
-    await dp.start_polling(bot)
+    services = await start_services()
+    logger.info(f"⏱️ До запуска поллинга прошло {time.perf_counter() - _PROCESS_STARTED:.3f} с")
+    try:
+        # Хэндлер не запускается отдельной задачей: если очередь выше high-water,
+        # put() ждёт и поллинг притормаживает вместо бесконечного роста очереди
+        await dp.start_polling(bot, handle_as_tasks=False)
+    finally:
+        await stop_services(*services)
+
+
+def worker_state_path(path: str, index: int) -> str:
+    """pending.sqlite3 -> pending.worker0.sqlite3"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{index}{ext}"
+
+
+async def run_webhook_worker(index: int, updates, events):
+    """Процесс-воркер режима вебхука: обновления своих чатов → та же очередь и граф, что при поллинге."""
+    # У каждого процесса свои файлы состояния: в общий файл процессы писали бы наперегонки, и каждое
+    # сохранение затирало бы записи чатов других процессов
+    for name, default in (('PENDING_DB_PATH', 'pending.sqlite3'), ('REPUTATION_PATH', 'reputation.json')):
+        path = os.getenv(name, default)
+        if path:
+            os.environ[name] = worker_state_path(path, index)
+    cache = spam_agent_langgraph.verdict_cache
+    if cache.path:  # кэш создаётся при импорте графа, поэтому путь меняется на месте
+        cache.path = worker_state_path(cache.path, index)
+        cache.load()
+    services = await start_services(METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    received = {}  # (chat_id, message_id) -> время приёма вебхуком
+
+    def report_verdict(message: types.Message) -> None:
+        received_at = received.pop((message.chat.id, message.message_id), None)
+        if received_at is not None:
+            events.put((index, time.time() - received_at))
+
+    classification_queue.on_processed = report_verdict
+    # Рейды по всем чатам считает родитель; здесь только его вердикты
+    spam_agent_langgraph.parent_flood_verdicts = {}
+
+    async def handle_update(update: dict, received_at: float, flood: dict = None) -> None:
+        message = update.get("message") or {}
+        if message.get("text"):
+            key = (message["chat"]["id"], message["message_id"])
+            received[key] = received_at
+            if flood is not None:
+                spam_agent_langgraph.parent_flood_verdicts[key] = FloodVerdict.from_dict(flood, bot)
+        try:
+            # Как при поллинге: хэндлер ждёт место в очереди, и процесс не берёт новые обновления
+            await dp.feed_raw_update(bot, update)
+        finally:
+            if not message.get("text"):
+                events.put((index, None))  # обновление разобрано, вердикта не будет
+
+    try:
+        await webhook_server.consume_updates(updates, handle_update)
+    finally:
+        await stop_services(*services)
+
+
+async def main_webhook(workers: int):
+    logger.info(f"Запуск бота в режиме вебхука ({workers} процессов)...")
+    create_bot()
+    metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+    async def register_webhook():
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None)
+            logger.info(f"Вебхук зарегистрирован: {WEBHOOK_URL}")
+        await bot.session.close()  # родитель в Bot API больше не ходит
+
+    try:
+        await webhook_server.serve(
+            run_webhook_worker,
+            workers=workers,
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT,
+            on_started=register_webhook,
+            # Детектор рейдов до шардирования, иначе рейд по чатам разных процессов не виден
+            flood_detector=spam_agent_langgraph.flood_detector if CLASSIFIER_BACKEND == 'langgraph' else None,
+        )
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Антиспам-бот для Telegram")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="запустить бота с поллингом (по умолчанию)")
+    webhook = subparsers.add_parser("webhook", help="принимать обновления вебхуком в нескольких процессах")
+    webhook.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    draw = subparsers.add_parser("draw-graph", help="сохранить mermaid-картинку графа")
+    draw.add_argument("--output", default="../graph_image.png")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
+    if args.command == "draw-graph":
+        raise SystemExit(0 if spam_agent_langgraph.draw_graph(args.output) else 1)
+
     try:
-        asyncio.run(main())
+        asyncio.run(main_webhook(args.workers) if args.command == "webhook" else main())
     except KeyboardInterrupt:
         logger.info("Получен сигнал на завершение работы")
     finally:
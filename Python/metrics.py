@@ -0,0 +1,329 @@
+"""
+Метрики антиспам-пайплайна в формате Prometheus.
+
+Минимальный реестр счётчиков, гистограмм и gauge без внешних зависимостей,
+HTTP-эндпоинт /metrics на aiohttp и декоратор для замера узлов графа.
+Для медленных сообщений есть опциональный сэмплирующий профилировщик.
+"""
+
+import abc
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Типы метрик
+# ------------------------------------------------------------------ #
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{str(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    @abc.abstractmethod
+    def _samples(self) -> Iterable[str]:
+        """Строки сэмплов без HELP/TYPE."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [counts по бакетам..., sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> Iterable[str]:
+        for key, data in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, data):
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {data[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {data[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}"
+
+
+class Gauge(_Metric):
+    """Gauge, значение которого вычисляется функцией в момент чтения /metrics."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable[[], float]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> Iterable[str]:
+        if self.callback is not None:
+            try:
+                yield f"{self.name} {float(self.callback())}"
+            except Exception as exc:
+                logger.debug(f"Gauge {self.name} недоступен: {exc}")
+            return
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics[metric.name] = metric
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        """Регистрирует (или перерегистрирует) gauge с функцией-источником."""
+        return Gauge(name, documentation, callback=callback)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ------------------------------------------------------------------ #
+# ⬇️ Метрики пайплайна
+# ------------------------------------------------------------------ #
+NODE_DURATION = Histogram("nospam_node_duration_seconds", "Время выполнения узла графа", ["node"])
+NODE_ERRORS = Counter("nospam_node_errors_total", "Исключения в узлах графа", ["node"])
+MESSAGE_DURATION = Histogram("nospam_message_duration_seconds", "Полное время проверки сообщения")
+VERDICTS = Counter("nospam_verdicts_total", "Вердикты классификатора", ["verdict", "source"])
+TELEGRAM_DURATION = Histogram("nospam_telegram_api_duration_seconds", "Время вызовов Bot API", ["method"])
+TELEGRAM_ERRORS = Counter("nospam_telegram_api_errors_total", "Ошибки вызовов Bot API", ["method"])
+LLM_DURATION = Histogram("nospam_llm_request_duration_seconds", "Время запроса к LLM", ["kind"])
+LLM_REQUESTS = Counter("nospam_llm_requests_total", "Запросы к LLM", ["kind"])
+LLM_ERRORS = Counter("nospam_llm_errors_total", "Ошибки запросов к LLM", ["kind"])
+LLM_TOKENS = Counter("nospam_llm_tokens_total", "Токены LLM", ["type"])
+LLM_ENDPOINT_REQUESTS = Counter("nospam_llm_endpoint_requests_total", "Запросы к LLM-эндпоинтам",
+                                ["endpoint", "outcome"])
+CASCADE_DURATION = Histogram("nospam_cascade_tier_duration_seconds", "Время классификации уровнем каскада",
+                             ["tier", "model"])
+CASCADE_OUTCOMES = Counter("nospam_cascade_tier_total", "Итог уровня каскада: final / escalated",
+                           ["tier", "model", "outcome"])
+LLM_HEDGES = Counter("nospam_llm_hedged_requests_total", "Запросы, продублированные на второй эндпоинт")
+MODERATION_BATCH_SIZE = Histogram("nospam_moderation_batch_size", "Сообщений в одном вызове Bot API",
+                                  ["action"], buckets=(1, 2, 5, 10, 20, 50, 100))
+QUEUE_LAG = Histogram("nospam_queue_lag_seconds", "Время ожидания сообщения в очереди")
+VERDICT_CACHE_HITS = Counter("nospam_verdict_cache_hits_total", "Попадания в кэш вердиктов")
+VERDICT_CACHE_MISSES = Counter("nospam_verdict_cache_misses_total", "Промахи кэша вердиктов")
+NEAR_DUPLICATE_LOOKUP = Histogram("nospam_near_duplicate_lookup_seconds", "Время поиска в индексе почти-дубликатов")
+WEBHOOK_UPDATES = Counter("nospam_webhook_updates_total", "Обновления, принятые вебхуком", ["worker"])
+UPDATE_TO_VERDICT = Histogram("nospam_update_to_verdict_seconds", "От приёма обновления вебхуком до вердикта",
+                              ["worker"])
+WORKER_IN_FLIGHT = Gauge("nospam_webhook_worker_in_flight", "Обновлений в работе у процесса-воркера", ["worker"])
+OVERLOAD_TRANSITIONS = Counter("nospam_overload_transitions_total", "Переходы между уровнями деградации",
+                               ["from_level", "to_level"])
+SHED_MESSAGES = Counter("nospam_shed_messages_total", "Сообщения, обработанные в обход LLM из-за перегрузки",
+                        ["action"])
+BACKLOG_DRAINED = Counter("nospam_backlog_drained_total", "Сообщения, разобранные из backlog долговечной очереди")
+BACKEND_DURATION = Histogram("nospam_backend_duration_seconds", "Время проверки сообщения бэкендом классификации",
+                             ["backend", "mode"])
+BACKEND_LLM_CALLS = Counter("nospam_backend_llm_calls_total", "Вызовы LLM бэкендом классификации",
+                            ["backend", "mode"])
+BACKEND_VERDICTS = Counter("nospam_backend_verdicts_total", "Вердикты бэкендов классификации",
+                           ["backend", "mode", "verdict"])
+SHADOW_COMPARISONS = Counter("nospam_shadow_comparisons_total", "Сравнения основного и теневого бэкенда",
+                             ["primary", "shadow", "outcome"])
+RAID_TRIGGERS = Counter("nospam_raid_triggers_total", "Срабатывания детектора рейдов", ["reason"])
+
+
+def timed_node(name: str):
+    """Декоратор узла графа: гистограмма времени и счётчик ошибок (кроме теневых проверок с dry_run)."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            state = args[0] if args else None
+            if isinstance(state, dict) and state.get("dry_run"):
+                return await func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                NODE_ERRORS.inc(node=name)
+                raise
+            finally:
+                NODE_DURATION.observe(time.perf_counter() - started, node=name)
+
+        return wrapper
+
+    return decorator
+
+
+@asynccontextmanager
+async def telegram_call(method: str):
+    """Замер вызова Bot API: `async with telegram_call("forwardMessage"): ...`"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        TELEGRAM_ERRORS.inc(method=method)
+        raise
+    finally:
+        TELEGRAM_DURATION.observe(time.perf_counter() - started, method=method)
+
+
+def record_llm_answer(answer, duration: float, kind: str = "single") -> None:
+    """Учитывает ответ LangChain-модели: длительность и токены из usage_metadata."""
+    LLM_REQUESTS.inc(kind=kind)
+    LLM_DURATION.observe(duration, kind=kind)
+    usage = getattr(answer, "usage_metadata", None) or {}
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), type="prompt")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), type="completion")
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Сэмплирующий профилировщик медленных сообщений
+# ------------------------------------------------------------------ #
+class SlowMessageProfiler:
+    """
+    Фоновый поток раз в interval снимает стек потока event loop. Если проверка
+    сообщения заняла больше threshold, в лог попадают самые частые стеки за время
+    её выполнения. Стеки общие для всех задач loop, поэтому профиль показывает,
+    чем был занят процесс, пока сообщение обрабатывалось.
+    """
+
+    def __init__(self, threshold_ms: float, interval_ms: float = 10, max_samples: int = 20_000, top: int = 5):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.top = top
+        self._samples: deque = deque(maxlen=max_samples)  # (timestamp, stack)
+        self._thread_id: Optional[int] = None
+        self._in_flight = 0
+        self._sampler: Optional[threading.Thread] = None
+
+    def _sample_loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if not self._in_flight:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = tuple(
+                f"{fs.filename.rsplit('/', 1)[-1]}:{fs.name}:{fs.lineno}"
+                for fs in traceback.extract_stack(frame, limit=8)
+            )
+            self._samples.append((time.perf_counter(), stack))
+
+    @contextmanager
+    def track(self, label: str):
+        if self._sampler is None:
+            self._thread_id = threading.get_ident()
+            self._sampler = threading.Thread(target=self._sample_loop, name="slow-message-profiler", daemon=True)
+            self._sampler.start()
+
+        started = time.perf_counter()
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            duration = time.perf_counter() - started
+            if duration >= self.threshold:
+                self._report(label, started, duration)
+
+    def _report(self, label: str, started: float, duration: float) -> None:
+        stacks = _Counter(stack for ts, stack in list(self._samples) if ts >= started)
+        total = sum(stacks.values())
+        lines = [f"🐢 Медленное сообщение {label}: {duration:.2f} с, сэмплов {total}"]
+        for stack, count in stacks.most_common(self.top):
+            lines.append(f"  {count / total:.0%}  " + " ← ".join(reversed(stack)))
+        logger.warning("\n".join(lines))
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ HTTP-эндпоинт
+# ------------------------------------------------------------------ #
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9108):
+    """Поднимает /metrics на aiohttp; возвращает AppRunner для остановки."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return runner
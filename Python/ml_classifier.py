@@ -0,0 +1,353 @@
+"""
+Лёгкий локальный классификатор спама (без внешних сервисов).
+
+Хэширование символьных n-грамм нормализованного текста + логистическая регрессия,
+обучаемая онлайн-SGD. Спам берётся из хранилища spam_storage, «не спам» — из
+набора, подтверждённого модераторами (JSONL с полем text). Модель версионируется
+(models/spam_clf-vN.json + указатель CURRENT) и подхватывается ботом на лету.
+
+Команды:
+    python ml_classifier.py train [--full]          # дообучить (или обучить заново)
+    python ml_classifier.py eval --corpus benchmark_corpus.jsonl
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from spam_storage import UNTRUSTED_SPAM_SOURCES
+from verdict_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = 1 << 18
+NGRAM_RANGE = (3, 5)
+CURRENT_POINTER = "CURRENT"
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Признаки
+# ------------------------------------------------------------------ #
+def extract_features(text: str) -> Dict[int, float]:
+    """Хэшированные символьные n-граммы и слова, нормированные по L2."""
+    normalized = f" {normalize_text(text)} "
+    counts: Dict[int, float] = {}
+    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+        for i in range(len(normalized) - n + 1):
+            index = zlib.crc32(normalized[i:i + n].encode("utf-8")) % N_FEATURES
+            counts[index] = counts.get(index, 0.0) + 1.0
+    for word in normalized.split():
+        index = zlib.crc32(b"w:" + word.encode("utf-8")) % N_FEATURES
+        counts[index] = counts.get(index, 0.0) + 1.0
+
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {i: v / norm for i, v in counts.items()}
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Модель
+# ------------------------------------------------------------------ #
+class SpamModel:
+    """Логистическая регрессия над хэшированными признаками (разреженные веса)."""
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, bias: float = 0.0, meta: Optional[dict] = None):
+        self.weights: Dict[int, float] = weights or {}
+        self.bias = bias
+        self.meta = meta or {"version": 0}
+
+    @property
+    def version(self) -> int:
+        return self.meta.get("version", 0)
+
+    def predict_proba(self, text: str) -> float:
+        """Вероятность спама."""
+        features = extract_features(text)
+        z = self.bias + sum(self.weights.get(i, 0.0) * v for i, v in features.items())
+        return 1.0 / (1.0 + math.exp(-max(min(z, 30.0), -30.0)))
+
+    def partial_fit(
+            self,
+            samples: List[Tuple[str, int]],
+            epochs: int = 3,
+            learning_rate: float = 0.5,
+            l2: float = 1e-6,
+    ) -> None:
+        """Онлайн-SGD с весами классов, чтобы редкий класс не терялся."""
+        if not samples:
+            return
+        positives = sum(label for _, label in samples)
+        negatives = len(samples) - positives
+        class_weight = {
+            1: len(samples) / (2 * positives) if positives else 1.0,
+            0: len(samples) / (2 * negatives) if negatives else 1.0,
+        }
+        vectors = [(extract_features(text), label) for text, label in samples]
+
+        for _ in range(epochs):
+            random.shuffle(vectors)
+            for features, label in vectors:
+                z = self.bias + sum(self.weights.get(i, 0.0) * v for i, v in features.items())
+                p = 1.0 / (1.0 + math.exp(-max(min(z, 30.0), -30.0)))
+                gradient = (p - label) * class_weight[label]
+                for i, v in features.items():
+                    w = self.weights.get(i, 0.0)
+                    self.weights[i] = w - learning_rate * (gradient * v + l2 * w)
+                self.bias -= learning_rate * gradient
+
+    # -------------------------------------------------------------- #
+    def save(self, model_dir: str) -> str:
+        """Сохраняет новую версию и атомарно переключает на неё CURRENT."""
+        os.makedirs(model_dir, exist_ok=True)
+        filename = f"spam_clf-v{self.version}.json"
+        path = os.path.join(model_dir, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": self.meta,
+                "bias": self.bias,
+                "weights": {str(i): round(w, 6) for i, w in self.weights.items() if abs(w) > 1e-6},
+            }, f)
+
+        pointer_tmp = os.path.join(model_dir, CURRENT_POINTER + ".tmp")
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            f.write(filename)
+        os.replace(pointer_tmp, os.path.join(model_dir, CURRENT_POINTER))
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "SpamModel":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        weights = {int(i): w for i, w in data["weights"].items()}
+        return cls(weights, data["bias"], data["meta"])
+
+    @classmethod
+    def load_current(cls, model_dir: str) -> Optional["SpamModel"]:
+        pointer = os.path.join(model_dir, CURRENT_POINTER)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, encoding="utf-8") as f:
+            filename = f.read().strip()
+        return cls.load(os.path.join(model_dir, filename))
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Классификатор для графа: пороги уверенности и горячая перезагрузка
+# ------------------------------------------------------------------ #
+class MLClassifier:
+    def __init__(
+            self,
+            model_dir: str = "models",
+            spam_threshold: float = 0.97,
+            ham_threshold: float = 0.03,
+            reload_interval: float = 30.0,
+    ):
+        self.model_dir = model_dir
+        self.spam_threshold = spam_threshold
+        self.ham_threshold = ham_threshold
+        self.reload_interval = reload_interval
+
+        self.model: Optional[SpamModel] = None
+        self._pointer_mtime = 0.0
+        self._checked_at = 0.0
+        self.maybe_reload(force=True)
+
+    def maybe_reload(self, force: bool = False) -> None:
+        """Подхватывает новую версию модели, если сменился указатель CURRENT."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+
+        pointer = os.path.join(self.model_dir, CURRENT_POINTER)
+        try:
+            mtime = os.path.getmtime(pointer)
+        except OSError:
+            return
+        if mtime == self._pointer_mtime:
+            return
+        try:
+            self.model = SpamModel.load_current(self.model_dir)
+            self._pointer_mtime = mtime
+            logger.info(f"🧠 Загружена ML-модель v{self.model.version}")
+        except Exception as e:
+            logger.error(f"Не удалось загрузить ML-модель: {e}")
+
+    def classify(self, text: str) -> Tuple[Optional[bool], Optional[float]]:
+        """(is_spam или None, если не уверен; вероятность спама или None без модели)."""
+        self.maybe_reload()
+        if self.model is None:
+            return None, None
+        probability = self.model.predict_proba(text)
+        if probability >= self.spam_threshold:
+            return True, probability
+        if probability <= self.ham_threshold:
+            return False, probability
+        return None, probability
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Данные для обучения
+# ------------------------------------------------------------------ #
+def load_ham_set(path: str) -> List[str]:
+    """Подтверждённые модераторами «не спам» сообщения (JSONL: {"text": ...})."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    return [json.loads(line)["text"] for line in lines]
+
+
+# Сколько примеров каждого класса минимум видит шаг дообучения (новые + повтор старых)
+REPLAY_MIN_PER_CLASS = 256
+
+
+def load_spam(after_id: int = 0) -> Tuple[List[str], int]:
+    """Спам из хранилища; записи с недоверенным источником вердикта (UNTRUSTED_SPAM_SOURCES) не используются."""
+    from spam_storage import get_spam_store
+
+    texts, last_id = [], after_id
+    for record in get_spam_store().iter_spam(after_id=after_id):
+        last_id = record["id"]
+        if record.get("verdict_source") not in UNTRUSTED_SPAM_SOURCES and record.get("message"):
+            texts.append(record["message"])
+    return texts, last_id
+
+
+def _replay(history: List[str], new: List[str], target: int, rng: random.Random) -> List[str]:
+    """Новые примеры класса плюс случайные старые, чтобы класс набрал target примеров."""
+    need = max(0, target - len(new))
+    return new + rng.sample(history, min(need, len(history)))
+
+
+def train(model_dir: str, ham_path: str, full: bool = False, epochs: int = 3) -> Optional[SpamModel]:
+    """
+    Дообучает текущую версию на новых данных (или обучает с нуля при full).
+    Шаг дообучения сбалансирован: каждый класс добирается случайными старыми примерами до размера
+    большего из новых (но не меньше REPLAY_MIN_PER_CLASS). Обычно приходит только новый спам, и
+    тогда повторяется набор «не спама». Иначе одноклассовые шаги сдвигают
+    bias, и со временем уверенным спамом становится всё подряд. Версия, обученная на одном
+    классе, не публикуется: возвращается None.
+    """
+    previous = None if full else SpamModel.load_current(model_dir)
+    meta = dict(previous.meta) if previous else {"last_spam_id": 0, "ham_lines": 0, "n_spam": 0, "n_ham": 0}
+
+    all_spam, last_spam_id = load_spam()
+    all_ham = load_ham_set(ham_path)
+    if previous:
+        spam, _ = load_spam(after_id=meta.get("last_spam_id", 0))
+        ham = all_ham[meta.get("ham_lines", 0):]
+        old_spam, old_ham = all_spam[:len(all_spam) - len(spam)], all_ham[:len(all_ham) - len(ham)]
+    else:
+        spam, ham, old_spam, old_ham = all_spam, all_ham, [], []
+
+    if not spam and not ham:
+        logger.info("Новых данных нет, модель не изменилась")
+        return previous
+
+    rng = random.Random(len(all_spam) * 1_000_003 + len(all_ham))
+    target = max(len(spam), len(ham), REPLAY_MIN_PER_CLASS)
+    train_spam = _replay(old_spam, spam, target, rng)
+    train_ham = _replay(old_ham, ham, target, rng)
+    if not train_spam or not train_ham:
+        logger.error(
+            f"Модель не опубликована: нужны примеры обоих классов (спам: {len(train_spam)}, "
+            f"не спам: {len(train_ham)} в {ham_path})"
+        )
+        return None
+    samples = [(t, 1) for t in train_spam] + [(t, 0) for t in train_ham]
+
+    model = SpamModel(
+        dict(previous.weights) if previous else {},
+        previous.bias if previous else 0.0,
+        meta,
+    )
+    model.partial_fit(samples, epochs=epochs)
+    model.meta.update({
+        "version": _latest_version(model_dir) + 1,
+        "parent_version": previous.version if previous else None,
+        "trained_at": datetime.now().isoformat(timespec="seconds"),
+        "last_spam_id": last_spam_id,
+        "ham_lines": len(all_ham),
+        "n_spam": meta.get("n_spam", 0) + len(spam),
+        "n_ham": meta.get("n_ham", 0) + len(ham),
+    })
+    path = model.save(model_dir)
+    logger.info(
+        f"Модель v{model.version} сохранена в {path}: +{len(spam)} спам, +{len(ham)} не спам "
+        f"(повтор старых: {len(train_spam) - len(spam)} спам, {len(train_ham) - len(ham)} не спам)"
+    )
+    return model
+
+
+def _latest_version(model_dir: str) -> int:
+    versions = [0]
+    if os.path.isdir(model_dir):
+        for name in os.listdir(model_dir):
+            if name.startswith("spam_clf-v") and name.endswith(".json"):
+                versions.append(int(name[len("spam_clf-v"):-len(".json")]))
+    return max(versions)
+
+
+def evaluate(model: SpamModel, corpus: Iterable[dict], spam_threshold: float, ham_threshold: float) -> dict:
+    from benchmark import latency_summary, quality_summary
+
+    pairs, latencies, decided = [], [], 0
+    for item in corpus:
+        started = time.perf_counter()
+        probability = model.predict_proba(item["text"])
+        latencies.append(time.perf_counter() - started)
+        if probability >= spam_threshold or probability <= ham_threshold:
+            decided += 1
+        pairs.append((item["label"] == "SPAM", probability >= 0.5))
+    return {
+        "version": model.version,
+        "messages": len(pairs),
+        "confident_share": round(decided / len(pairs), 4) if pairs else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "quality@0.5": quality_summary(pairs),
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Локальный ML-классификатор спама")
+    parser.add_argument("--model-dir", default=os.getenv("ML_MODEL_DIR", "models"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_cmd = subparsers.add_parser("train", help="дообучить модель на новых данных")
+    train_cmd.add_argument("--ham", default=os.getenv("ML_HAM_SET_PATH", "ham_confirmed.jsonl"))
+    train_cmd.add_argument("--full", action="store_true", help="обучить с нуля на всех данных")
+    train_cmd.add_argument("--epochs", type=int, default=3)
+
+    eval_cmd = subparsers.add_parser("eval", help="офлайн-оценка текущей (или указанной) версии")
+    eval_cmd.add_argument("--corpus", default="benchmark_corpus.jsonl")
+    eval_cmd.add_argument("--model", help="путь к файлу версии (по умолчанию CURRENT)")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "train":
+        if train(args.model_dir, args.ham, full=args.full, epochs=args.epochs) is None:
+            raise SystemExit(1)
+    else:
+        model = SpamModel.load(args.model) if args.model else SpamModel.load_current(args.model_dir)
+        if model is None:
+            raise SystemExit("Модель не найдена: сначала выполните train")
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [json.loads(line) for line in f if line.strip()]
+        report = evaluate(
+            model,
+            corpus,
+            float(os.getenv("ML_SPAM_THRESHOLD", "0.97")),
+            float(os.getenv("ML_HAM_THRESHOLD", "0.03")),
+        )
+        print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,302 @@
+"""
+Агрегатор модерационных действий Bot API.
+
+Во время рейда один пользователь присылает десятки сообщений подряд, и каждое
+из них пересылается модераторам и удаляется отдельным запросом. Агрегатор
+собирает пересылки и удаления из одного чата за короткое окно и отправляет их
+одним `forwardMessages` / `deleteMessages` (до 100 сообщений за вызов).
+Частота запросов ограничена token bucket'ами (общим и на чат), а ответ
+Telegram 429 с retry_after приостанавливает отправку на указанное время.
+
+Лимит на отправку в чат модераторов мал (~20 сообщений в минуту), а удаление
+ждёт пересылки: переслать удалённое сообщение нельзя. Чтобы спам не висел в
+чате, пока лимит восстанавливается, пересылка с текстом отчёта при исчерпанном
+лимите сразу завершается, а отчёт уходит в сводку — одно sendMessage на все
+накопившиеся сообщения, как только лимит позволит.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_IDS_PER_CALL = 100  # ограничение Bot API для forwardMessages / deleteMessages
+MAX_TEXT_LENGTH = 4096  # ограничение Bot API на длину sendMessage
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Ограничение частоты
+# ------------------------------------------------------------------ #
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены seconds секунд (ответ 429 с retry_after)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def try_acquire(self) -> bool:
+        """Взять токен, если он есть прямо сейчас (без ожидания)."""
+        now = time.monotonic()
+        if now < self._paused_until or self._lock.locked():
+            return False  # пауза после 429 или токены уже ждут другие
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Агрегатор
+# ------------------------------------------------------------------ #
+# (действие, бот, чат-источник, чат-получатель)
+_Key = Tuple[str, int, int, Optional[int]]
+# (message_id, future, текст отчёта вместо пересылки)
+_Item = Tuple[int, asyncio.Future, str]
+
+
+class ModerationAggregator:
+    """Склеивает пересылки и удаления из одного чата в bulk-вызовы Bot API."""
+
+    def __init__(
+            self,
+            window_ms: float = 100,
+            rate_per_second: float = 25,
+            chat_rate_per_minute: float = 20,
+            max_retries: int = 3,
+    ):
+        self.window = window_ms / 1000
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(rate_per_second)
+        self.chat_rate = chat_rate_per_minute / 60
+        # Лимит Telegram на отправку в группу: запас в несколько запросов, дальше — по chat_rate
+        self._chat_buckets: Dict[int, TokenBucket] = defaultdict(
+            lambda: TokenBucket(self.chat_rate, capacity=5)
+        )
+
+        self._bots: Dict[int, object] = {}
+        self._pending: Dict[_Key, List[_Item]] = {}
+        self._reports: Dict[Tuple[int, int], List[str]] = {}  # (бот, чат модераторов) -> отчёты для сводки
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.requested = 0
+        self.api_calls = 0
+        self.reported = 0
+
+    # -------------------------------------------------------------- #
+    async def forward(self, bot, from_chat_id: int, message_id: int, target_chat_id: int, report: str = "") -> None:
+        """
+        Переслать сообщение; возвращается после выполнения bulk-вызова.
+        report — текст для сводки: если лимит чата модераторов исчерпан, пересылки не будет,
+        отчёт уйдёт позже, а вызов возвращается сразу (сообщение можно удалять).
+        """
+        await self._submit(("forward", id(bot), from_chat_id, target_chat_id), bot, message_id, report)
+
+    async def delete(self, bot, chat_id: int, message_id: int) -> None:
+        """Удалить сообщение; возвращается после выполнения bulk-вызова."""
+        await self._submit(("delete", id(bot), chat_id, None), bot, message_id)
+
+    async def _submit(self, key: _Key, bot, message_id: int, report: str = "") -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._bots[key[1]] = bot
+        self.requested += 1
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = []
+            self._spawn(self._flush_later(key))
+        pending.append((message_id, future, report))
+        if len(pending) >= MAX_IDS_PER_CALL:
+            self._spawn(self._send(key, self._pending.pop(key)))
+
+        await future
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, key: _Key) -> None:
+        await asyncio.sleep(self.window)
+        batch = self._pending.pop(key, None)
+        if batch:
+            await self._send(key, batch)
+
+    # -------------------------------------------------------------- #
+    async def _send(self, key: _Key, batch: List[_Item]) -> None:
+        action, bot_id, chat_id, target_chat_id = key
+        bot = self._bots[bot_id]
+        chat_token = False
+        if action == "forward":
+            chat_token = self._chat_buckets[target_chat_id].try_acquire()
+            if not chat_token:
+                # Лимит чата модераторов исчерпан: сообщения с отчётом не ждут его восстановления
+                reported = [item for item in batch if item[2]]
+                if reported:
+                    self._queue_reports(bot, target_chat_id, [report for _, _, report in reported])
+                    for _, future, _ in reported:
+                        if not future.done():
+                            future.set_result(None)
+                    batch = [item for item in batch if not item[2]]
+                    if not batch:
+                        return
+
+        message_ids = sorted({message_id for message_id, _, _ in batch})  # Bot API требует возрастание
+        metrics.MODERATION_BATCH_SIZE.observe(len(message_ids), action=action)
+
+        try:
+            await self._call_with_retry(action, bot, chat_id, target_chat_id, message_ids, chat_token)
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def _queue_reports(self, bot, target_chat_id: int, reports: List[str]) -> None:
+        key = (id(bot), target_chat_id)
+        pending = self._reports.get(key)
+        if pending is None:
+            pending = self._reports[key] = []
+            self._spawn(self._send_reports(key))
+        pending.extend(reports)
+        self.reported += len(reports)
+        logger.info(f"⏳ Лимит пересылок в чат {target_chat_id} исчерпан: {len(reports)} сообщ. уйдут сводкой")
+
+    async def _send_reports(self, key: Tuple[int, int]) -> None:
+        """Сводка вместо пересылок: ждёт лимит чата, собирая отчёты, пришедшие за это время."""
+        bot_id, target_chat_id = key
+        bot = self._bots[bot_id]
+        await self._chat_buckets[target_chat_id].acquire()
+        reports = self._reports.pop(key)
+
+        header = f"🚫 Удалено без пересылки (лимит Telegram на чат модераторов): {len(reports)}\n\n"
+        chunks, text = [], header
+        for report in reports:
+            report = report[:MAX_TEXT_LENGTH - len(header) - 2]
+            if len(text) + len(report) + 2 > MAX_TEXT_LENGTH:
+                chunks.append(text)
+                text = ""
+            text += report + "\n\n"
+        chunks.append(text)
+
+        for i, chunk in enumerate(chunks):
+            try:
+                # Токен чата для первой части уже взят выше
+                await self._call_with_retry("report", bot, None, target_chat_id, chunk.strip(), chat_token=i == 0)
+            except Exception as exc:
+                logger.warning(f"⚠️ Не удалось отправить сводку модераторам: {exc}")
+
+    async def _call_with_retry(self, action, bot, chat_id, target_chat_id, payload, chat_token: bool = False) -> None:
+        # Пересылка и сводка — это отправка в чат модераторов, на них действует лимит группы
+        chat_bucket = self._chat_buckets[target_chat_id] if action in ("forward", "report") else None
+        for attempt in range(self.max_retries + 1):
+            await self.global_bucket.acquire()
+            if chat_bucket is not None and not (chat_token and attempt == 0):
+                await chat_bucket.acquire()
+            try:
+                self.api_calls += 1
+                await self._call(action, bot, chat_id, target_chat_id, payload)
+                return
+            except TelegramRetryAfter as exc:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"⏳ Telegram просит подождать {exc.retry_after} с ({action}, чат {chat_id or target_chat_id})")
+                self.global_bucket.pause(exc.retry_after)
+                if chat_bucket is not None:
+                    chat_bucket.pause(exc.retry_after)
+
+    @staticmethod
+    async def _call(action, bot, chat_id, target_chat_id, payload) -> None:
+        if action == "report":
+            async with metrics.telegram_call("sendMessage"):
+                await bot.send_message(chat_id=target_chat_id, text=payload)
+        elif action == "forward":
+            if len(payload) == 1:
+                async with metrics.telegram_call("forwardMessage"):
+                    await bot.forward_message(
+                        chat_id=target_chat_id, from_chat_id=chat_id, message_id=payload[0]
+                    )
+            else:
+                async with metrics.telegram_call("forwardMessages"):
+                    await bot.forward_messages(
+                        chat_id=target_chat_id, from_chat_id=chat_id, message_ids=payload
+                    )
+        elif len(payload) == 1:
+            async with metrics.telegram_call("deleteMessage"):
+                await bot.delete_message(chat_id=chat_id, message_id=payload[0])
+        else:
+            async with metrics.telegram_call("deleteMessages"):
+                await bot.delete_messages(chat_id=chat_id, message_ids=payload)
+
+    # -------------------------------------------------------------- #
+    async def close(self) -> None:
+        """Отправляет всё накопленное и дожидается выполнения."""
+        for key in list(self._pending):
+            batch = self._pending.pop(key, None)
+            if batch:
+                self._spawn(self._send(key, batch))
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "requested": self.requested,
+            "api_calls": self.api_calls,
+            "pending": sum(len(batch) for batch in self._pending.values()),
+            "reported": self.reported,
+        }
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Агрегатор по умолчанию (создаётся при первом обращении, после load_dotenv)
+# ------------------------------------------------------------------ #
+_moderator: Optional[ModerationAggregator] = None
+_moderator_lock = threading.Lock()
+
+
+def get_moderator() -> ModerationAggregator:
+    global _moderator
+    with _moderator_lock:
+        if _moderator is None:
+            _moderator = ModerationAggregator(
+                window_ms=float(os.getenv("MODERATION_WINDOW_MS", "100")),
+                rate_per_second=float(os.getenv("TELEGRAM_RATE_PER_SECOND", "25")),
+                chat_rate_per_minute=float(os.getenv("TELEGRAM_CHAT_RATE_PER_MINUTE", "20")),
+            )
+        return _moderator
@@ -0,0 +1,196 @@
+"""
+Индекс почти-дубликатов известного спама.
+
+Спамеры слегка меняют текст («Доход 110$/день» → «Доход 120$ в день»), и точный
+кэш вердиктов такие сообщения пропускает. Индекс хранит MinHash-сигнатуры
+символьных шинглов нормализованного текста и ищет кандидатов через LSH
+(сигнатура режется на полосы, совпадение любой полосы даёт кандидата).
+Сходство кандидата оценивается по доле совпавших позиций сигнатуры.
+
+Индекс ограничен по числу записей (LRU), пополняется при сохранении нового
+спама и при старте заполняется из spam_storage. В индекс попадает только спам
+с доверенным вердиктом (LLM, кэш, репутация): почти-дубликат ошибки ML,
+предфильтра или рейда тоже удалялся бы без проверки.
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from spam_storage import UNTRUSTED_SPAM_SOURCES
+from verdict_cache import normalize_text, text_fingerprint
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Числа заменяются одним символом, пунктуация — пробелом: «110$/день» ≈ «120$ в день»
+_DIGITS_RE = re.compile(r"\d+")
+_PUNCT_RE = re.compile(r"[^\w\s$€₽%]+")
+_SPACES_RE = re.compile(r"\s+")
+
+Signature = Tuple[int, ...]
+
+
+def canonical_text(text: str) -> str:
+    text = _DIGITS_RE.sub("0", normalize_text(text))
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+class NearDuplicateIndex:
+    """MinHash LSH по символьным шинглам с LRU-ограничением размера."""
+
+    def __init__(
+            self,
+            threshold: float = 0.7,
+            num_perm: int = 64,
+            bands: int = 16,
+            shingle_size: int = 4,
+            max_entries: int = 50_000,
+            min_length: int = 20,
+            seed: int = 1,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.min_length = min_length  # короткие тексты дают слишком мало шинглов
+
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+        self._signatures: "OrderedDict[str, Signature]" = OrderedDict()
+        self._buckets: List[Dict[Signature, Set[str]]] = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.matches = 0
+        self.evictions = 0
+        self.lookup_time = 0.0
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Сигнатуры
+    # -------------------------------------------------------------- #
+    def _shingles(self, canonical: str) -> Set[int]:
+        k = self.shingle_size
+        return {
+            zlib.crc32(canonical[i:i + k].encode("utf-8"))
+            for i in range(max(1, len(canonical) - k + 1))
+        }
+
+    def signature(self, text: str) -> Optional[Signature]:
+        canonical = canonical_text(text)
+        if len(canonical) < self.min_length:
+            return None
+        shingles = self._shingles(canonical)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in shingles)
+            for a, b in self._perms
+        )
+
+    def _bands_of(self, signature: Signature) -> Iterable[Tuple[int, Signature]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    @staticmethod
+    def similarity(left: Signature, right: Signature) -> float:
+        """Оценка коэффициента Жаккара по доле совпавших позиций сигнатуры."""
+        return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Изменение индекса
+    # -------------------------------------------------------------- #
+    def _remove(self, key: str) -> None:
+        signature = self._signatures.pop(key)
+        for band, chunk in self._bands_of(signature):
+            bucket = self._buckets[band].get(chunk)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][chunk]
+
+    def add(self, text: str) -> bool:
+        """Добавляет спам-текст; False, если текст слишком короткий."""
+        key = text_fingerprint(text)
+        signature = self.signature(text)
+        if not key or signature is None:
+            return False
+        with self._lock:
+            if key in self._signatures:
+                self._signatures.move_to_end(key)
+                return True
+            self._signatures[key] = signature
+            for band, chunk in self._bands_of(signature):
+                self._buckets[band].setdefault(chunk, set()).add(key)
+            while len(self._signatures) > self.max_entries:
+                self._remove(next(iter(self._signatures)))
+                self.evictions += 1
+        return True
+
+    def load_from_store(self, store) -> int:
+        """Заполняет индекс спамом из SpamStore (последние записи вытесняют старые)."""
+        started = time.perf_counter()
+        added = sum(
+            1 for record in store.iter_spam()
+            if record.get("verdict_source") not in UNTRUSTED_SPAM_SOURCES and self.add(record.get("message") or "")
+        )
+        logger.info(f"🧬 Индекс почти-дубликатов: {added} записей за {time.perf_counter() - started:.2f} с")
+        return added
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Поиск
+    # -------------------------------------------------------------- #
+    def query(self, text: str, record: bool = True) -> Optional[float]:
+        """
+        Максимальное сходство с известным спамом, если оно не ниже порога.
+        record=False — только чтение: без статистики и без продления жизни записи в LRU.
+        """
+        started = time.perf_counter()
+        try:
+            signature = self.signature(text)
+            if signature is None:
+                return None
+            best, best_key = 0.0, None
+            with self._lock:
+                candidates = set()
+                for band, chunk in self._bands_of(signature):
+                    candidates |= self._buckets[band].get(chunk, set())
+                for key in candidates:
+                    score = self.similarity(signature, self._signatures[key])
+                    if score > best:
+                        best, best_key = score, key
+                if best_key is None or best < self.threshold:
+                    return None
+                if record:
+                    self._signatures.move_to_end(best_key)
+            if record:
+                self.matches += 1
+            return best
+        finally:
+            if record:
+                self.lookups += 1
+                self.lookup_time += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._signatures),
+            "buckets": sum(len(b) for b in self._buckets),
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "evictions": self.evictions,
+            "lookup_avg_ms": round(self.lookup_time / self.lookups * 1000, 3) if self.lookups else 0.0,
+        }
@@ -0,0 +1,169 @@
+"""
+Контроль перегрузки: деградация, когда LLM не укладывается в SLO.
+
+Когда Ollama замедляется, каждое сообщение всё равно ждёт LLM, очередь растёт
+без ограничений, и спам минутами висит в чате. Контроллер сравнивает p95
+задержки LLM за последнюю минуту и глубину очереди с целевыми значениями
+(SLO) и выбирает уровень:
+
+- NORMAL   — полная классификация;
+- DEGRADED — давление выше SLO: доверенные пользователи не проверяются вовсе,
+  уверенные оценки ML и предфильтра с ослабленными порогами заменяют LLM,
+  каскад не эскалирует к крупной модели;
+- SHEDDING — давление выше SLO в shed_factor раз: вдобавок сообщения низкого
+  риска временно пропускаются и откладываются на перепроверку.
+
+Вниз уровень опускается только после cooldown секунд давления ниже
+recover_ratio от порога (гистерезис). Отложенные сообщения перепроверяются
+полным пайплайном, когда контроллер возвращается в NORMAL: recheck ставит их
+в очередь классификации, и порядок сообщений внутри чата сохраняется.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+NORMAL, DEGRADED, SHEDDING = 0, 1, 2
+LEVEL_NAMES = {NORMAL: "normal", DEGRADED: "degraded", SHEDDING: "shedding"}
+
+
+class OverloadController:
+    def __init__(
+            self,
+            latency_slo_ms: float = 3000,
+            depth_slo: int = 100,
+            shed_factor: float = 2.0,
+            recover_ratio: float = 0.7,
+            cooldown_seconds: float = 15.0,
+            window_seconds: float = 60.0,
+            min_samples: int = 5,
+            max_deferred: int = 5000,
+            defer_max_age: float = 600.0,
+    ):
+        self.latency_slo = latency_slo_ms / 1000
+        self.depth_slo = depth_slo
+        self.shed_factor = shed_factor
+        self.recover_ratio = recover_ratio
+        self.cooldown = cooldown_seconds
+        self.window = window_seconds
+        self.min_samples = min_samples
+        self.defer_max_age = defer_max_age
+
+        # Источник глубины очереди и функция перепроверки — постановка в очередь классификации (задаёт main.py)
+        self.queue_depth: Callable[[], int] = lambda: 0
+        self.recheck: Optional[Callable[[Any], Awaitable[Any]]] = None
+
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=1000)  # (когда, секунды)
+        self._deferred: Deque[Tuple[float, Any]] = deque(maxlen=max_deferred)
+        self._level = NORMAL
+        self._calm_since: Optional[float] = None
+        self._evaluated_at = 0.0
+        self._recheck_task: Optional[asyncio.Task] = None
+
+        self.transitions = 0
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Сигналы
+    # -------------------------------------------------------------- #
+    def observe_llm(self, seconds: float) -> None:
+        """Длительность классификации LLM (в том числе неудачной)."""
+        self._latencies.append((time.monotonic(), seconds))
+
+    def latency_p95(self, now: Optional[float] = None) -> Optional[float]:
+        now = now or time.monotonic()
+        recent = sorted(s for ts, s in self._latencies if now - ts <= self.window)
+        if len(recent) < self.min_samples:
+            return None
+        return recent[int(0.95 * (len(recent) - 1))]
+
+    def pressure(self, now: Optional[float] = None) -> float:
+        """Отношение к SLO худшего из сигналов: 1.0 — ровно на границе."""
+        p95 = self.latency_p95(now)
+        latency_pressure = p95 / self.latency_slo if p95 is not None and self.latency_slo > 0 else 0.0
+        depth_pressure = self.queue_depth() / self.depth_slo if self.depth_slo > 0 else 0.0
+        return max(latency_pressure, depth_pressure)
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Уровень деградации
+    # -------------------------------------------------------------- #
+    @property
+    def level(self) -> int:
+        now = time.monotonic()
+        if now - self._evaluated_at >= 1.0:  # пересчёт не чаще раза в секунду
+            self._evaluated_at = now
+            self._evaluate(now)
+        return self._level
+
+    def _evaluate(self, now: float) -> None:
+        pressure = self.pressure(now)
+        target = SHEDDING if pressure > self.shed_factor else DEGRADED if pressure > 1.0 else NORMAL
+        if target > self._level:
+            self._calm_since = None
+            self._set_level(target, pressure)
+            return
+        if self._level == NORMAL:
+            return
+
+        # Вниз — на один уровень и только после cooldown спокойного давления
+        threshold = self.shed_factor if self._level == SHEDDING else 1.0
+        if pressure >= threshold * self.recover_ratio:
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.cooldown:
+            self._calm_since = None
+            self._set_level(self._level - 1, pressure)
+
+    def _set_level(self, level: int, pressure: float) -> None:
+        previous, self._level = self._level, level
+        self.transitions += 1
+        metrics.OVERLOAD_TRANSITIONS.inc(from_level=LEVEL_NAMES[previous], to_level=LEVEL_NAMES[level])
+        p95 = self.latency_p95()
+        log = logger.warning if level > previous else logger.info
+        log(f"🚦 Перегрузка: {LEVEL_NAMES[previous]} → {LEVEL_NAMES[level]} "
+            f"(давление {pressure:.2f}, p95 LLM {f'{p95:.2f} с' if p95 is not None else '—'}, "
+            f"очередь {self.queue_depth()})")
+        if level == NORMAL and self._deferred:
+            self._start_recheck()
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Отложенные сообщения
+    # -------------------------------------------------------------- #
+    def defer(self, message: Any) -> None:
+        if len(self._deferred) == self._deferred.maxlen:
+            metrics.SHED_MESSAGES.inc(action="dropped")  # самое старое вытесняется без перепроверки
+        self._deferred.append((time.monotonic(), message))
+        metrics.SHED_MESSAGES.inc(action="deferred")
+
+    def _start_recheck(self) -> None:
+        if self.recheck is None or (self._recheck_task is not None and not self._recheck_task.done()):
+            return
+        self._recheck_task = asyncio.create_task(self._recheck_deferred())
+
+    async def _recheck_deferred(self) -> None:
+        logger.info(f"🔁 Перепроверка отложенных сообщений: {len(self._deferred)}")
+        while self._deferred and self.level == NORMAL:
+            deferred_at, message = self._deferred.popleft()
+            if time.monotonic() - deferred_at > self.defer_max_age:
+                metrics.SHED_MESSAGES.inc(action="expired")
+                continue
+            try:
+                await self.recheck(message)
+                metrics.SHED_MESSAGES.inc(action="rechecked")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось перепроверить отложенное сообщение: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "level": LEVEL_NAMES[self._level],
+            "pressure": self.pressure(),
+            "latency_p95_s": self.latency_p95(),
+            "deferred": len(self._deferred),
+            "transitions": self.transitions,
+        }
@@ -0,0 +1,176 @@
+"""
+Долговечная очередь сообщений, ожидающих проверки.
+
+Раньше сообщение, которое проверялось в момент перезапуска, терялось. Теперь
+каждое сообщение с текстом записывается в SQLite при приёме, вместе с оценкой
+риска и исходным JSON. По мере прохождения графа в запись добавляются вердикт
+и выполненные узлы с побочными эффектами (save_spam, forward_message, ...),
+поэтому после перезапуска сохранение и пересылка не повторяются. После
+проверки запись удаляется.
+
+Состояния записи:
+- queued   — сообщение передано в очередь классификации этого процесса;
+- deferred — отложено контроллером перегрузки до перепроверки;
+- backlog  — ждёт разбора пачкой (остатки прошлого запуска и сообщения,
+  пришедшие, пока бот не работал); разбирается по убыванию риска, а при
+  равном риске — сначала новые.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED, DEFERRED, BACKLOG, DRAINING = "queued", "deferred", "backlog", "draining"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    chat_id        INTEGER NOT NULL,
+    message_id     INTEGER NOT NULL,
+    received_at    REAL    NOT NULL,
+    risk           REAL    NOT NULL DEFAULT 0,
+    state          TEXT    NOT NULL,
+    message_json   TEXT    NOT NULL,
+    is_spam        INTEGER,
+    verdict_source TEXT,
+    done_nodes     TEXT    NOT NULL DEFAULT '[]',
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS pending_backlog ON pending (state, risk DESC, received_at DESC);
+"""
+
+
+@dataclass
+class PendingEntry:
+    chat_id: int
+    message_id: int
+    received_at: float
+    risk: float
+    message_json: str
+    is_spam: Optional[bool] = None
+    verdict_source: Optional[str] = None
+    done_nodes: List[str] = field(default_factory=list)
+
+
+class PendingStore:
+    """SQLite-очередь с прогрессом по узлам графа."""
+
+    def __init__(self, path: str = "pending.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        self.recorded = 0
+        self.completed = 0
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Жизненный цикл записи
+    # -------------------------------------------------------------- #
+    def record(self, chat_id: int, message_id: int, message_json: str, risk: float, state: str = QUEUED) -> None:
+        """Запись при приёме; повторная доставка того же сообщения прогресс не сбрасывает."""
+        self._execute(
+            "INSERT OR IGNORE INTO pending (chat_id, message_id, received_at, risk, state, message_json) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, message_id, time.time(), risk, state, message_json),
+        )
+        self.recorded += 1
+
+    def mark_node(self, chat_id: int, message_id: int, node: str, is_spam: bool, verdict_source: str) -> None:
+        """Узел с побочным эффектом выполнен; вместе с ним сохраняется вердикт."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT done_nodes FROM pending WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+            ).fetchone()
+            if row is None:
+                return
+            done = json.loads(row["done_nodes"])
+            if node not in done:
+                done.append(node)
+            self._conn.execute(
+                "UPDATE pending SET done_nodes = ?, is_spam = ?, verdict_source = ? "
+                "WHERE chat_id = ? AND message_id = ?",
+                (json.dumps(done), int(is_spam), verdict_source, chat_id, message_id),
+            )
+
+    def set_state(self, chat_id: int, message_id: int, state: str) -> None:
+        self._execute("UPDATE pending SET state = ? WHERE chat_id = ? AND message_id = ?",
+                      (state, chat_id, message_id))
+
+    def complete(self, chat_id: int, message_id: int) -> None:
+        self._execute("DELETE FROM pending WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+        self.completed += 1
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Разбор накопившегося
+    # -------------------------------------------------------------- #
+    def requeue_all(self) -> int:
+        """При старте: всё, что не дошло до конца в прошлом запуске, уходит в backlog."""
+        cursor = self._execute("UPDATE pending SET state = ? WHERE state != ?", (BACKLOG, BACKLOG))
+        return cursor.rowcount
+
+    def claim_backlog(self, limit: int) -> List[PendingEntry]:
+        """Следующая пачка backlog: сначала высокий риск, при равном риске — новые."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM pending WHERE state = ? ORDER BY risk DESC, received_at DESC LIMIT ?",
+                (BACKLOG, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE pending SET state = ? WHERE chat_id = ? AND message_id = ?",
+                [(DRAINING, r["chat_id"], r["message_id"]) for r in rows],
+            )
+        return [
+            PendingEntry(
+                chat_id=r["chat_id"],
+                message_id=r["message_id"],
+                received_at=r["received_at"],
+                risk=r["risk"],
+                message_json=r["message_json"],
+                is_spam=None if r["is_spam"] is None else bool(r["is_spam"]),
+                verdict_source=r["verdict_source"],
+                done_nodes=json.loads(r["done_nodes"]),
+            )
+            for r in rows
+        ]
+
+    def count(self, state: Optional[str] = None) -> int:
+        if state is None:
+            return self._execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+        return self._execute("SELECT COUNT(*) FROM pending WHERE state = ?", (state,)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Очередь по умолчанию (создаётся при первом обращении, после load_dotenv)
+# ------------------------------------------------------------------ #
+_store: Optional[PendingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_pending_store() -> Optional[PendingStore]:
+    """None, если PENDING_DB_PATH пуст (очередь только в памяти, как раньше)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            path = os.getenv("PENDING_DB_PATH", "pending.sqlite3")
+            if not path:
+                return None
+            _store = PendingStore(path)
+        return _store
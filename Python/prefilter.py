@@ -0,0 +1,161 @@
+"""
+Правиловый предфильтр перед LLM.
+
+Механические правила из промпта detect_spam («сумма + призыв написать в ЛС» → SPAM,
+технические термины → NOT_SPAM) собраны в одно регулярное выражение с именованными
+группами. Очевидный спам и очевидные рабочие сообщения получают вердикт сразу,
+в LLM уходят только неоднозначные случаи.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+from verdict_cache import normalize_text
+
+# ------------------------------------------------------------------ #
+# ⬇️ Словари признаков
+# ------------------------------------------------------------------ #
+# Ключевые слова задаются «как есть» и при компиляции проходят ту же
+# нормализацию, что и текст сообщения (регистр, двойники букв и т.п.).
+KEYWORDS = {
+    "money": [
+        "доход", "прибыл", "заработ", "зарабат", "выплат", "долларов", "рублей",
+    ],
+    "contact": [
+        "лс", "в личку", "в личные", "пиши", "пишите", "напиши", "напишите",
+        "жду в личк", "обсудим в", "за деталями", "пишите да", "напиши плюс", "ставь +",
+    ],
+    "guarantee": [
+        "без вложений", "без опыта", "всё просто", "все просто", "без стрессов",
+        "без сложностей", "требуются люди", "нужны люди", "без начальников",
+    ],
+    "remote": [
+        "удалёнк", "удаленк", "смартфон", "телефон +", "с телефона",
+    ],
+    "promo": [
+        "розыгрыш", "взлом", "партнёрств", "партнерств", "направление с доходом",
+    ],
+    "manipulation": [
+        "срочно!", "немедленно смените пароль", "уникальная возможность", "только сегодня",
+    ],
+    "tech": [
+        "q4_k_m", "q5_k_m", "q8_0", "q8", "gguf", "квантов", "vllm", "whisper", "ollama",
+        "llama", "langchain", "langgraph", "fine-tuning", "файнтюн", "дообуч", "нейросет",
+        "векторн", "эмбеддинг", "embedding", "chatgpt", "gpt", "cuda", "gpu", "трансформер",
+        "трек-номер", "inference", "инференс", "токенизатор", "датасет",
+    ],
+}
+
+# Регулярные выражения записываются уже в нормализованном алфавите
+PATTERNS = {
+    "money": [
+        r"\d[\d\s.,]*\s*(?:\$|₽|€|руб|usd|usdt|долл)",
+        r"[$₽€]\s*\d",
+        r"\d+\s*%\s*прибыл",
+    ],
+    "guarantee": [
+        r"только\s+\d+\s+человек",
+    ],
+}
+
+SPAM_CATEGORIES = ("money", "contact", "guarantee", "remote", "promo", "manipulation")
+HAM_CATEGORIES = ("tech",)
+
+_WORD_CHARS = r"\w"
+
+
+def _keyword_regex(keyword: str) -> str:
+    """Ключевое слово → regex; короткие слова ('лс', 'q8') ищутся целиком."""
+    escaped = re.escape(normalize_text(keyword))
+    if len(keyword) <= 3:
+        return rf"(?<!{_WORD_CHARS}){escaped}(?!{_WORD_CHARS})"
+    return rf"(?<!{_WORD_CHARS}){escaped}"
+
+
+def _compile_matcher() -> "re.Pattern[str]":
+    alternatives = []
+    for category in (*SPAM_CATEGORIES, *HAM_CATEGORIES):
+        parts = sorted({_keyword_regex(k) for k in KEYWORDS.get(category, [])})
+        parts += PATTERNS.get(category, [])
+        # Длинные альтернативы первыми, чтобы «пишите» не обрезалось до «пиши»
+        parts.sort(key=len, reverse=True)
+        alternatives.append(f"(?P<{category}>{'|'.join(parts)})")
+    return re.compile("|".join(alternatives))
+
+
+MATCHER = _compile_matcher()
+_DIGIT_RE = re.compile(r"\d")
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Оценка сообщения
+# ------------------------------------------------------------------ #
+@dataclass
+class PrefilterResult:
+    """Итог предфильтра: is_spam=None означает «решает LLM»."""
+
+    is_spam: Optional[bool]
+    spam_score: int
+    ham_score: int
+    markers: set = field(default_factory=set)
+
+
+SPAM_THRESHOLD = 3
+HAM_THRESHOLD = 2
+SHORT_MESSAGE_CHARS = 15
+
+
+def score_message(text: str) -> PrefilterResult:
+    normalized = normalize_text(text)
+    markers = {m.lastgroup for m in MATCHER.finditer(normalized)}
+
+    spam_score = 0
+    if "money" in markers and "contact" in markers:
+        spam_score += 3  # автоматическое правило №1
+    if "promo" in markers and _DIGIT_RE.search(normalized):
+        spam_score += 3  # автоматическое правило №2
+    if "money" in markers and markers & {"guarantee", "remote"}:
+        spam_score += 2
+    spam_score += sum(1 for c in ("guarantee", "remote", "manipulation") if c in markers)
+
+    ham_score = 2 * len(markers & set(HAM_CATEGORIES))
+
+    is_spam: Optional[bool] = None
+    spam_markers = markers & set(SPAM_CATEGORIES)
+    if ham_score:
+        # Технические термины перевешивают спам-маркеры: уверенный NOT_SPAM
+        # только если нет денег и призывов, иначе решает LLM
+        if ham_score >= HAM_THRESHOLD and not markers & {"money", "contact", "promo"}:
+            is_spam = False
+    elif spam_score >= SPAM_THRESHOLD:
+        is_spam = True
+    elif not spam_markers and len(normalized) <= SHORT_MESSAGE_CHARS:
+        is_spam = False  # короткие реплики без признаков («GPUStack»)
+
+    return PrefilterResult(is_spam, spam_score, ham_score, markers)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Статистика пропуска LLM
+# ------------------------------------------------------------------ #
+@dataclass
+class PrefilterStats:
+    checked: int = 0
+    spam: int = 0
+    ham: int = 0
+
+    def record(self, result: PrefilterResult) -> None:
+        self.checked += 1
+        if result.is_spam is True:
+            self.spam += 1
+        elif result.is_spam is False:
+            self.ham += 1
+
+    @property
+    def skip_ratio(self) -> float:
+        """Доля сообщений, которым не понадобился LLM."""
+        return (self.spam + self.ham) / self.checked if self.checked else 0.0
+
+
+stats = PrefilterStats()
@@ -0,0 +1,49 @@
+"""
+Загрузка системного промпта классификатора из версионируемого файла.
+
+Правила лежат в `prompts/spam_rules.vN.md` и редактируются без правки кода.
+Версия берётся из имени файла, а короткий хэш содержимого пишется в лог,
+чтобы по логам было видно, с каким промптом работал бот.
+"""
+
+import hashlib
+import logging
+import os
+import re
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts", "spam_rules.v1.md")
+
+_VERSION_RE = re.compile(r"\.(v\d+)\.[^.]+$")
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    text: str
+    version: str
+    digest: str
+    path: str
+
+
+def load_prompt(path: str = DEFAULT_PROMPT_PATH) -> PromptTemplate:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    match = _VERSION_RE.search(os.path.basename(path))
+    template = PromptTemplate(
+        text=text,
+        version=match.group(1) if match else "unversioned",
+        digest=hashlib.sha1(text.encode("utf-8")).hexdigest()[:8],
+        path=path,
+    )
+    logger.info(f"📜 Промпт {os.path.basename(path)}: версия {template.version}, "
+                f"{len(text)} символов, sha1 {template.digest}")
+    return template
+
+
+def cap_message(text: str, max_chars: int) -> str:
+    """Обрезает текст сообщения до max_chars символов (0 — без ограничения)."""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…"
@@ -0,0 +1,190 @@
+"""
+Репутация отправителей по (chat_id, user_id).
+
+Завсегдатаи групп пишут сотни технических сообщений в день, и каждое из них
+проходит через LLM. Хранилище репутации помнит, сколько чистых сообщений
+пользователь написал в чате, когда впервые появился (и когда вступил), и
+последние вердикты. Доверенные пользователи проверяются выборочно (с
+вероятностью sample_rate), новые и впервые пишущие — всегда.
+
+Записи компактные (список из пяти чисел), лишние вытесняются по LRU,
+состояние периодически сохраняется на диск.
+"""
+
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Поля записи: [clean_count, spam_count, first_seen, joined_at, recent_bits]
+CLEAN, SPAM, FIRST_SEEN, JOINED_AT, RECENT = range(5)
+RECENT_VERDICTS = 16  # сколько последних вердиктов хранится в битовой маске (1 — спам)
+_RECENT_MASK = (1 << RECENT_VERDICTS) - 1
+
+Key = Tuple[int, int]  # (chat_id, user_id)
+
+
+class ReputationStore:
+    """LRU-хранилище репутации с выборочной проверкой доверенных пользователей."""
+
+    def __init__(
+            self,
+            min_clean_messages: int = 20,
+            min_age_seconds: float = 3 * 24 * 3600,
+            sample_rate: float = 0.05,
+            fresh_account_id: int = 0,
+            max_entries: int = 200_000,
+            path: Optional[str] = None,
+            persist_interval: float = 300.0,
+    ):
+        self.min_clean_messages = min_clean_messages
+        self.min_age_seconds = min_age_seconds
+        self.sample_rate = sample_rate
+        # Telegram выдаёт id по возрастанию: id выше порога — признак свежего аккаунта (0 — не учитывать)
+        self.fresh_account_id = fresh_account_id
+        self.max_entries = max_entries
+        self.path = path
+        self.persist_interval = persist_interval
+
+        self._entries: "OrderedDict[Key, List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.time()
+
+        self.checked = 0
+        self.skipped = 0
+        self.evictions = 0
+
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    # -------------------------------------------------------------- #
+    def _entry(self, key: Key, now: float) -> List[int]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [0, 0, int(now), 0, 0]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._entries.move_to_end(key)
+        return entry
+
+    def is_trusted(self, chat_id: int, user_id: int) -> bool:
+        if self.fresh_account_id and user_id >= self.fresh_account_id:
+            return False
+        entry = self._entries.get((chat_id, user_id))
+        if entry is None:
+            return False
+        now = time.time()
+        return (
+                entry[CLEAN] >= self.min_clean_messages
+                and now - entry[FIRST_SEEN] >= self.min_age_seconds
+                and now - entry[JOINED_AT] >= self.min_age_seconds
+                and not entry[RECENT] & _RECENT_MASK
+        )
+
+    def should_check(self, chat_id: int, user_id: int, sample_rate: Optional[float] = None) -> bool:
+        """False — сообщение доверенного пользователя можно не классифицировать."""
+        rate = self.sample_rate if sample_rate is None else sample_rate
+        if self.is_trusted(chat_id, user_id) and random.random() >= rate:
+            self.skipped += 1
+            return False
+        self.checked += 1
+        return True
+
+    def mark_joined(self, chat_id: int, user_id: int) -> None:
+        """Вступление в чат: доверие отсчитывается заново."""
+        now = time.time()
+        with self._lock:
+            entry = self._entry((chat_id, user_id), now)
+            entry[JOINED_AT] = int(now)
+            self._dirty = True
+
+    def record(self, chat_id: int, user_id: int, is_spam: bool) -> None:
+        """Учитывает вердикт классификатора (не пропуск по репутации)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entry((chat_id, user_id), now)
+            entry[RECENT] = ((entry[RECENT] << 1) | int(is_spam)) & _RECENT_MASK
+            if is_spam:
+                entry[SPAM] += 1
+                entry[CLEAN] = 0  # после спама доверие зарабатывается заново
+            else:
+                entry[CLEAN] += 1
+            self._dirty = True
+
+        if self.path and now - self._saved_at >= self.persist_interval:
+            self._saved_at = now
+            threading.Thread(target=self.save, name="reputation-save", daemon=True).start()
+
+    def stats(self) -> dict:
+        decisions = self.checked + self.skipped
+        return {
+            "entries": len(self._entries),
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "evictions": self.evictions,
+            "skip_ratio": self.skipped / decisions if decisions else 0.0,
+        }
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Сохранение на диск
+    # -------------------------------------------------------------- #
+    def save(self) -> None:
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            rows = [[chat_id, user_id, *entry] for (chat_id, user_id), entry in self._entries.items()]
+            self._dirty = False
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, self.path)
+            logger.debug(f"Репутация сохранена: {len(rows)} записей")
+        except Exception as e:
+            logger.error(f"Не удалось сохранить репутацию: {e}")
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить репутацию: {e}")
+            return
+        for chat_id, user_id, *entry in rows[-self.max_entries:]:
+            self._entries[(chat_id, user_id)] = entry
+        logger.info(f"Репутация загружена: {len(self._entries)} записей")
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Хранилище по умолчанию (создаётся при первом обращении, после load_dotenv)
+# ------------------------------------------------------------------ #
+_store: Optional[ReputationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_reputation_store() -> ReputationStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReputationStore(
+                min_clean_messages=int(os.getenv("REPUTATION_MIN_CLEAN", "20")),
+                min_age_seconds=float(os.getenv("REPUTATION_MIN_AGE_HOURS", "72")) * 3600,
+                sample_rate=float(os.getenv("REPUTATION_SAMPLE_RATE", "0.05")),
+                fresh_account_id=int(os.getenv("REPUTATION_FRESH_ACCOUNT_ID", "0")),
+                max_entries=int(os.getenv("REPUTATION_MAX_ENTRIES", "200000")),
+                path=os.getenv("REPUTATION_PATH", "reputation.json") or None,
+            )
+        return _store
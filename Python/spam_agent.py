@@ -1,6 +1,7 @@
 from agents import (
     Agent,
     Runner,
+    Model,
     OpenAIChatCompletionsModel,
     AsyncOpenAI,
     function_tool,
@@ -10,11 +11,17 @@ from agents import (
 import os
 import logging
 from dataclasses import dataclass
+from functools import lru_cache
 
 from aiogram import types
 from dotenv import load_dotenv
 
 from spam_storage import save_spam_message
+from moderation import get_moderator
+from llm_pool import get_llm_pool, make_http_client
+from prompt_loader import DEFAULT_PROMPT_PATH, cap_message, load_prompt
+from reputation import get_reputation_store
+import metrics
 
 # ---------------------------------------------------------------------------
 # 📦  Environment & logging setup
@@ -26,11 +33,46 @@ logger = logging.getLogger(__name__)
 
 LOCAL_LLM = os.getenv("LOCAL_LLM") or "llama3:latest"
 TARGET_GROUP_ID = os.getenv("TARGET_GROUP_ID")
+SPAM_PROMPT_PATH = os.getenv("SPAM_PROMPT_PATH") or DEFAULT_PROMPT_PATH
+LLM_MAX_MESSAGE_CHARS = int(os.getenv("LLM_MAX_MESSAGE_CHARS", "1500"))
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+
+
+def _endpoint_model(base_url: str) -> OpenAIChatCompletionsModel:
+    return OpenAIChatCompletionsModel(
+        model=LOCAL_LLM,
+        openai_client=AsyncOpenAI(
+            base_url=base_url,
+            max_retries=0,
+            # ModelSettings в openai-agents 0.0.9 не принимает extra_body, keep_alive дописывает транспорт
+            http_client=make_http_client(extra_body={"keep_alive": LLM_KEEP_ALIVE} if LLM_KEEP_ALIVE else None),
+        ),
+    )
+
+
+class PooledModel(Model):
+    """Модель Agents SDK, которая отправляет каждый шаг агента через общий пул LLM."""
+
+    def __init__(self):
+        self.pool = get_llm_pool()
+
+    async def get_response(self, *args, **kwargs):
+        return await self.pool.call(
+            lambda endpoint: endpoint.client("agents", _endpoint_model).get_response(*args, **kwargs)
+        )
+
+    async def stream_response(self, *args, **kwargs):
+        # Поток нельзя продублировать, поэтому без hedging: просто наименее загруженный эндпоинт
+        endpoint = self.pool.pick()
+        with self.pool.track(endpoint):  # иначе pick() не видит эти запросы, а ошибки не выводят эндпоинт
+            async for event in endpoint.client("agents", _endpoint_model).stream_response(*args, **kwargs):
+                yield event
 
-model = OpenAIChatCompletionsModel(
-    model=LOCAL_LLM,
-    openai_client=AsyncOpenAI(base_url="http://localhost:11434/v1"),
-)
+
+@lru_cache(maxsize=None)
+def get_model() -> PooledModel:
+    """HTTP-клиенты и модель создаются при первом сообщении, а не при импорте."""
+    return PooledModel()
 
 # ---------------------------------------------------------------------------
 # 🏷️  Context dataclass
@@ -45,6 +87,7 @@ class TaskContext:
     target_group_id: str
     message_text: str
     message: types.Message
+    dry_run: bool = False  # только вердикт: process_spam ничего не делает
 
 
 # ---------------------------------------------------------------------------
@@ -57,7 +100,7 @@ async def _delete_user_messages(wrapper: RunContextWrapper[TaskContext]) -> bool
     ctx = wrapper.context
     print(f'delete_user_messages .... ctx.message.message_id={ctx.message.message_id}')
     try:
-        await ctx.message.delete()
+        await get_moderator().delete(ctx.message.bot, ctx.message.chat.id, ctx.message.message_id)
         logger.info("Сообщение %s удалено", ctx.message.message_id)
         return True
     except Exception as exc:
@@ -70,10 +113,10 @@ async def _forward_message(wrapper: RunContextWrapper[TaskContext]):
     ctx = wrapper.context
     print(f'forward_message ....ctx.message.message_id={ctx.message.message_id}')
     try:
-        await ctx.message.bot.forward_message(
-            chat_id=ctx.target_group_id,
-            from_chat_id=ctx.message.chat.id,
-            message_id=ctx.message.message_id,
+        # При исчерпанном лимите чата модераторов вместо пересылки уходит отчёт (см. moderation.py)
+        await get_moderator().forward(
+            ctx.message.bot, ctx.message.chat.id, ctx.message.message_id, ctx.target_group_id,
+            report=f"{ctx.sender_full_name} ({ctx.message.chat.id}/{ctx.message.message_id}):\n{ctx.message_text[:500]}",
         )
         logger.info("Сообщение %s переслано модераторам", ctx.message.message_id)
         return {"status": "success"}
@@ -91,6 +134,8 @@ async def _forward_message(wrapper: RunContextWrapper[TaskContext]):
 async def process_spam(wrapper: RunContextWrapper[TaskContext]):
     """Полный цикл обработки спама (forward ➜ delete)."""
     print(f'process_spam ....')
+    if wrapper.context.dry_run:
+        return {"status": "skipped"}
 
     await _forward_message(wrapper)
     await _delete_user_messages(wrapper)
@@ -102,11 +147,9 @@ async def process_spam(wrapper: RunContextWrapper[TaskContext]):
 # 📜  Агент и его инструкции
 # ---------------------------------------------------------------------------
 
-instructions = """
-Ты — высокоточная система детекции спама для Telegram. Анализируй входные сообщения на предмет спама.
-
-### Критерии СПАМА (отвечать «SPAM»):
-… (оставьте существующие пункты без изменений) …
+# Правила — общий с LangGraph-агентом шаблон из prompts/, ниже — указания для агента
+AGENT_INSTRUCTIONS = """
+Анализируй входные сообщения на предмет спама.
 
 ### Дополнительные указания
 1. Любое сочетание «конкретная сумма + призыв к действию» → СПАМ.
@@ -124,33 +167,63 @@ instructions = """
   NOT_SPAM
 """
 
-agent = Agent(
-    name="AntiSpamAgent",
-    instructions=instructions,
-    tools=[process_spam],  # ⬅️  Агент видит только один инструмент
-    model=model,
-)
+
+@lru_cache(maxsize=None)
+def get_instructions() -> str:
+    return load_prompt(SPAM_PROMPT_PATH).text + "\n" + AGENT_INSTRUCTIONS
+
+
+@lru_cache(maxsize=None)
+def get_agent() -> Agent:
+    return Agent(
+        name="AntiSpamAgent",
+        instructions=get_instructions(),
+        tools=[process_spam],  # ⬅️  Агент видит только один инструмент
+        model=get_model(),
+    )
 
 # ---------------------------------------------------------------------------
 # 🚀  Entry‑point for application code
 # ---------------------------------------------------------------------------
 
 
-async def agent_check_spam(message: types.Message):
-    """Вызывается из aiogram‑хэндлера для проверки сообщения на спам."""
+def is_spam_output(result) -> bool:
+    return str(result.final_output).strip().upper().startswith("SPAM")
+
+
+async def agent_check_spam(message: types.Message, dry_run: bool = False):
+    """
+    Вызывается из aiogram‑хэндлера для проверки сообщения на спам.
+    dry_run=True — только вердикт, без действий и репутации (теневой режим).
+    """
+
+    reputation = get_reputation_store()
+    if not dry_run and message.from_user and not reputation.should_check(message.chat.id, message.from_user.id):
+        logger.info("Доверенный отправитель %s, проверка пропущена", message.from_user.id)
+        metrics.VERDICTS.inc(verdict="NOT_SPAM", source="reputation")
+        return None
 
     task_context = TaskContext(
         sender_full_name=message.from_user.full_name,
         target_group_id=TARGET_GROUP_ID,
         message_text=message.text or "",
         message=message,
+        dry_run=dry_run,
     )
 
     convo: list[TResponseInputItem] = [
-        {"role": "user", "content": message.text or ""}
+        {"role": "user", "content": cap_message(message.text or "", LLM_MAX_MESSAGE_CHARS)}
     ]
 
-    result = await Runner.run(agent, convo, context=task_context)
+    if dry_run:
+        return await Runner.run(get_agent(), convo, context=task_context)
+
+    with metrics.MESSAGE_DURATION.time():
+        result = await Runner.run(get_agent(), convo, context=task_context)
     logger.info("Agent output: %s", result.final_output)
+    is_spam = is_spam_output(result)
+    metrics.VERDICTS.inc(verdict="SPAM" if is_spam else "NOT_SPAM", source="agents")
+    if message.from_user:
+        reputation.record(message.chat.id, message.from_user.id, is_spam)
 
     return result
@@ -1,22 +1,40 @@
 """
 Anti-Spam agent implemented with LangGraph.
-Guarantees the sequence:
-save_spam() ➜ forward_message() ➜ delete_user_messages()
+Spam branch: save_spam() runs in parallel with
+forward_message() ➜ delete_user_messages() (forward always precedes delete;
+if the moderators' chat is rate-limited, the forward becomes a text report and
+the delete does not wait for it, see moderation.py)
 """
 
 import os
+import time
+import asyncio
 import logging
-from typing import TypedDict
+import threading
+from functools import lru_cache, partial
+from typing import Dict, List, Optional, Tuple, TypedDict
 
 from dotenv import load_dotenv
 from aiogram import types
 
-from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
-from langchain.schema.messages import HumanMessage
-from langchain.tools import tool
-
-from spam_storage import save_spam_message  # ваша БД-функция
+# LangGraph / LangChain импортируются лениво (см. get_graph_executor): их импорт
+# занимает секунды, а бот должен выйти на поллинг сразу после старта.
+from spam_storage import UNTRUSTED_SPAM_SOURCES, save_spam_message, get_spam_store  # ваша БД-функция
+from verdict_cache import VerdictCache
+from batch_classifier import BatchClassifier
+from cascade import CascadeConfig
+import prefilter
+import metrics
+from prompt_loader import DEFAULT_PROMPT_PATH, load_prompt
+from moderation import get_moderator
+from llm_pool import PooledChatModel, get_llm_pool, make_http_client
+from reputation import get_reputation_store
+from ml_classifier import MLClassifier
+from near_duplicate import NearDuplicateIndex
+from flood_detector import FloodDetector, FloodVerdict, RaidTrigger, countable_sender
+from overload import DEGRADED, SHEDDING, OverloadController
+from pending_store import DEFERRED, PendingEntry, get_pending_store
+from work_queue import verdict_ready
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
@@ -26,17 +44,180 @@ logger = logging.getLogger(__name__)
 # ------------------------------------------------------------------ #
 os.environ["OPENAI_API_KEY"] = "No Need"
 load_dotenv()
-OPENAI_BASE_URL = "http://localhost:11434/v1"
-LOCAL_LLM = os.getenv("LOCAL_LLM")
-TARGET_GROUP_ID = int(os.getenv("TARGET_GROUP_ID"))
-
-llm = ChatOpenAI(
-    model_name=LOCAL_LLM,
-    base_url=OPENAI_BASE_URL,
-    streaming=False,
-    temperature=0.0,
+LOCAL_LLM = os.getenv("LOCAL_LLM") or "llama3:latest"
+# Пустой — только для draw-graph и бенчмарков; боту нужен реальный id (см. main.build_pipeline)
+TARGET_GROUP_ID = int(os.getenv("TARGET_GROUP_ID") or 0)
+
+# Кэш вердиктов по нормализованному тексту (VERDICT_CACHE_PATH пустой — без диска)
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "10000"))
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", "3600"))
+VERDICT_CACHE_MAX_BYTES = int(os.getenv("VERDICT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+VERDICT_CACHE_PATH = os.getenv("VERDICT_CACHE_PATH") or None
+
+# Микро-батчинг запросов к LLM (LLM_BATCH_MAX_SIZE=1 — без батчинга)
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "50"))
+LLM_BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "8"))
+LLM_BATCH_MAX_WAIT_MS = float(os.getenv("LLM_BATCH_MAX_WAIT_MS", "200"))
+
+# Системный промпт, лимит длины сообщения в запросе и удержание модели в памяти Ollama
+SPAM_PROMPT_PATH = os.getenv("SPAM_PROMPT_PATH") or DEFAULT_PROMPT_PATH
+LLM_MAX_MESSAGE_CHARS = int(os.getenv("LLM_MAX_MESSAGE_CHARS", "1500"))
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+
+# Минимальное декодирование: пара токенов, logprobs или потоковая ранняя остановка (full — как раньше)
+LLM_DECODE_MODE = os.getenv("LLM_DECODE_MODE", "minimal")
+LLM_SPAM_THRESHOLD = float(os.getenv("LLM_SPAM_THRESHOLD", "0.5"))
+
+# Индекс почти-дубликатов известного спама (MinHash LSH)
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.7"))
+NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "50000"))
+NEAR_DUP_PERMUTATIONS = int(os.getenv("NEAR_DUP_PERMUTATIONS", "64"))
+NEAR_DUP_BANDS = int(os.getenv("NEAR_DUP_BANDS", "16"))
+NEAR_DUP_OFFLOAD_CHARS = int(os.getenv("NEAR_DUP_OFFLOAD_CHARS", "500"))  # MinHash длиннее — в пуле потоков
+
+# Локальный ML-классификатор (модель обучается командой `python ml_classifier.py train`)
+ML_MODEL_DIR = os.getenv("ML_MODEL_DIR", "models")
+ML_SPAM_THRESHOLD = float(os.getenv("ML_SPAM_THRESHOLD", "0.97"))
+ML_HAM_THRESHOLD = float(os.getenv("ML_HAM_THRESHOLD", "0.03"))
+ML_RELOAD_INTERVAL = float(os.getenv("ML_RELOAD_INTERVAL", "30"))
+
+# Детектор рейдов: один аккаунт или текст во многих чатах за окно RAID_WINDOW_SECONDS
+RAID_WINDOW_SECONDS = float(os.getenv("RAID_WINDOW_SECONDS", "30"))
+RAID_USER_CHATS = int(os.getenv("RAID_USER_CHATS", "3"))
+RAID_TEXT_CHATS = int(os.getenv("RAID_TEXT_CHATS", "3"))
+RAID_TEXT_REPEATS = int(os.getenv("RAID_TEXT_REPEATS", "5"))
+RAID_CHAT_MESSAGES = int(os.getenv("RAID_CHAT_MESSAGES", "40"))
+RAID_MODE_SECONDS = float(os.getenv("RAID_MODE_SECONDS", "300"))
+RAID_MODE_REPEATS = int(os.getenv("RAID_MODE_REPEATS", "2"))  # повторов текста в чате, удаляемых в режиме рейда
+RAID_EXPECTED_RATE = float(os.getenv("RAID_EXPECTED_RATE", "100"))  # пиковый поток, сообщ./с, — задаёт размер sketch
+
+# Деградация при перегрузке: SLO по p95 LLM и глубине очереди
+OVERLOAD_LATENCY_SLO_MS = float(os.getenv("OVERLOAD_LATENCY_SLO_MS", "3000"))
+OVERLOAD_QUEUE_SLO = int(os.getenv("OVERLOAD_QUEUE_SLO", "100"))
+OVERLOAD_SHED_FACTOR = float(os.getenv("OVERLOAD_SHED_FACTOR", "2"))
+OVERLOAD_COOLDOWN_SECONDS = float(os.getenv("OVERLOAD_COOLDOWN_SECONDS", "15"))
+OVERLOAD_SPAM_PROBABILITY = float(os.getenv("OVERLOAD_SPAM_PROBABILITY", "0.8"))
+OVERLOAD_HAM_PROBABILITY = float(os.getenv("OVERLOAD_HAM_PROBABILITY", "0.2"))
+OVERLOAD_DEFER_MAX_AGE = float(os.getenv("OVERLOAD_DEFER_MAX_AGE", "600"))
+
+# Сколько символов спама попадает в сводку модераторам, если пересылка упёрлась в лимит Telegram
+MODERATION_REPORT_CHARS = int(os.getenv("MODERATION_REPORT_CHARS", "500"))
+
+# Профилировщик сообщений, проверка которых дольше порога (0 — выключен)
+SLOW_MESSAGE_PROFILE_MS = float(os.getenv("SLOW_MESSAGE_PROFILE_MS", "0"))
+
+# Совпадает с langgraph.graph.END; объявлено здесь, чтобы не импортировать langgraph заранее
+END = "__end__"
+
+
+def _chat_model(base_url: str, model: Optional[str] = None):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model_name=model or LOCAL_LLM,
+        base_url=base_url,
+        streaming=False,
+        temperature=0.0,
+        max_retries=0,  # повторы и таймауты — на стороне пула
+        http_async_client=make_http_client(),
+        extra_body={"keep_alive": LLM_KEEP_ALIVE} if LLM_KEEP_ALIVE else None,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_llm(model: Optional[str] = None) -> PooledChatModel:
+    """ChatOpenAI поверх пула эндпоинтов LLM_ENDPOINTS (по умолчанию OPENAI_BASE_URL)."""
+    model = model or LOCAL_LLM
+    return PooledChatModel(get_llm_pool(), partial(_chat_model, model=model), name=f"chat:{model}")
+
+# ------------------------------------------------------------------ #
+# ⬇️ Правила классификации: статический системный промпт из prompts/
+# ------------------------------------------------------------------ #
+SPAM_PROMPT = load_prompt(SPAM_PROMPT_PATH)
+
+# Каскад моделей: LLM_CASCADE / LLM_CASCADE_CONFIG, по умолчанию одна модель LOCAL_LLM
+cascade_config = CascadeConfig.from_env(LOCAL_LLM)
+
+
+@lru_cache(maxsize=None)
+def get_classifier(model: str) -> BatchClassifier:
+    """Свой микро-батчер на каждую модель каскада."""
+    return BatchClassifier(
+        partial(get_llm, model),
+        SPAM_PROMPT.text,
+        window_ms=LLM_BATCH_WINDOW_MS,
+        max_batch_size=LLM_BATCH_MAX_SIZE,
+        max_wait_ms=LLM_BATCH_MAX_WAIT_MS,
+        minimal_decode=LLM_DECODE_MODE != "full",
+        spam_threshold=LLM_SPAM_THRESHOLD,
+        max_message_chars=LLM_MAX_MESSAGE_CHARS,
+    )
+
+
+verdict_cache = VerdictCache(
+    max_entries=VERDICT_CACHE_SIZE,
+    ttl_seconds=VERDICT_CACHE_TTL,
+    max_bytes=VERDICT_CACHE_MAX_BYTES,
+    path=VERDICT_CACHE_PATH,
+)
+
+near_duplicate_index = NearDuplicateIndex(
+    threshold=NEAR_DUP_THRESHOLD,
+    num_perm=NEAR_DUP_PERMUTATIONS,
+    bands=NEAR_DUP_BANDS,
+    max_entries=NEAR_DUP_MAX_ENTRIES,
+)
+
+ml_classifier = MLClassifier(
+    model_dir=ML_MODEL_DIR,
+    spam_threshold=ML_SPAM_THRESHOLD,
+    ham_threshold=ML_HAM_THRESHOLD,
+    reload_interval=ML_RELOAD_INTERVAL,
+)
+
+flood_detector = FloodDetector(
+    window_seconds=RAID_WINDOW_SECONDS,
+    user_chats=RAID_USER_CHATS,
+    text_chats=RAID_TEXT_CHATS,
+    text_repeats=RAID_TEXT_REPEATS,
+    chat_messages=RAID_CHAT_MESSAGES,
+    raid_seconds=RAID_MODE_SECONDS,
+    expected_rate=RAID_EXPECTED_RATE,
+    raid_mode_repeats=RAID_MODE_REPEATS,
+)
+# В режиме вебхука рейды по всем чатам считает родительский процесс, а процесс-воркер получает его
+# вердикты: (chat_id, message_id) -> FloodVerdict (см. main.run_webhook_worker). None — считать здесь.
+parent_flood_verdicts: Optional[Dict[Tuple[int, int], FloodVerdict]] = None
+
+overload_controller = OverloadController(
+    latency_slo_ms=OVERLOAD_LATENCY_SLO_MS,
+    depth_slo=OVERLOAD_QUEUE_SLO,
+    shed_factor=OVERLOAD_SHED_FACTOR,
+    cooldown_seconds=OVERLOAD_COOLDOWN_SECONDS,
+    defer_max_age=OVERLOAD_DEFER_MAX_AGE,
+)
+
+slow_message_profiler = (
+    metrics.SlowMessageProfiler(SLOW_MESSAGE_PROFILE_MS) if SLOW_MESSAGE_PROFILE_MS > 0 else None
 )
 
+metrics.REGISTRY.gauge("nospam_prefilter_skip_ratio", "Доля сообщений, решённых предфильтром без LLM",
+                       lambda: prefilter.stats.skip_ratio)
+metrics.REGISTRY.gauge("nospam_verdict_cache_entries", "Записей в кэше вердиктов",
+                       lambda: verdict_cache.stats()["entries"])
+metrics.REGISTRY.gauge("nospam_near_duplicate_entries", "Сигнатур спама в индексе почти-дубликатов",
+                       lambda: near_duplicate_index.stats()["entries"])
+metrics.REGISTRY.gauge("nospam_reputation_skip_ratio", "Доля сообщений доверенных пользователей без проверки",
+                       lambda: get_reputation_store().stats()["skip_ratio"])
+metrics.REGISTRY.gauge("nospam_raid_chats", "Чатов в режиме рейда",
+                       lambda: flood_detector.stats()["raid_chats"])
+metrics.REGISTRY.gauge("nospam_overload_level", "Уровень деградации: 0 — normal, 1 — degraded, 2 — shedding",
+                       lambda: overload_controller.level)
+metrics.REGISTRY.gauge("nospam_deferred_messages", "Сообщений, отложенных на перепроверку",
+                       lambda: overload_controller.stats()["deferred"])
+metrics.REGISTRY.gauge("nospam_ml_model_version", "Версия загруженной ML-модели (0 — модели нет)",
+                       lambda: ml_classifier.model.version if ml_classifier.model else 0)
+
 
 # ------------------------------------------------------------------ #
 # ⬇️ Описание состояния графа
@@ -48,198 +229,697 @@ class AgentState(TypedDict, total=False):
     target_group_id: int
     is_spam: bool
     classification_text: str  # ответ LLM (для логов)
+    # кто вынес вердикт: raid / prefilter / near_duplicate / ml / reputation / degraded / deferred / cache / llm
+    verdict_source: str
+    spam_probability: float  # оценка ML-модели или LLM (по logprobs), если она есть
+    cascade_tier: int  # уровень каскада моделей, вынесший последний вердикт LLM
+    escalation_reason: Optional[str]  # почему вердикт нужно перепроверить моделью крупнее
+    raid_trigger: RaidTrigger  # рейд обнаружен на этом сообщении: оповещение и удаление копий
+    recheck: bool  # повторная проверка сообщения, отложенного при перегрузке
+    resumed: bool  # сообщение из долговечной очереди после перезапуска
+    done_nodes: List[str]  # узлы с побочными эффектами, выполненные до перезапуска
+    dry_run: bool  # только вердикт, без действий (теневой режим, см. classifier_backends.py)
 
 
 # ------------------------------------------------------------------ #
 # ⬇️ Узлы-действия с логированием
 # ------------------------------------------------------------------ #
+def _node_done(state: AgentState, node: str) -> bool:
+    """Узел уже выполнен до перезапуска — побочный эффект не повторяем."""
+    if node in state.get("done_nodes", ()):
+        logger.info(f"⏭️ Узел {node} уже выполнен до перезапуска, пропускаем")
+        return True
+    return False
+
+
+async def _mark_node_done(state: AgentState, node: str) -> None:
+    store = get_pending_store()
+    if store is None:
+        return
+    msg: types.Message = state["message"]
+    await asyncio.to_thread(
+        store.mark_node, msg.chat.id, msg.message_id, node,
+        bool(state.get("is_spam")), state.get("verdict_source") or "unknown",
+    )
+
+
+@metrics.timed_node("flood_check")
+async def flood_check_node(state: AgentState) -> AgentState:
+    """Счётчики рейдов по всем чатам: сообщения рейда удаляются без классификации"""
+    logger.info("⏳ Выполнение узла flood_check...")
+    msg: types.Message = state["message"]
+    if state.get("dry_run"):
+        # Теневая проверка не трогает счётчики и не забирает вердикт родителя у основного бэкенда
+        logger.info("✅ Узел flood_check завершен (теневая проверка)")
+        return state
+    parent_verdict = None
+    if parent_flood_verdicts is not None:
+        parent_verdict = parent_flood_verdicts.pop((msg.chat.id, msg.message_id), None)
+    if state.get("recheck") or state.get("resumed"):
+        logger.info("✅ Узел flood_check завершен (сообщение уже учтено)")
+        return state
+
+    if parent_flood_verdicts is not None:
+        verdict = parent_verdict or FloodVerdict(False)
+    else:
+        # Анонимные админы, каналы и служебные аккаунты Telegram не считаются одним пользователем
+        user_id = countable_sender(msg.from_user.id if msg.from_user else None,
+                                   getattr(msg, "sender_chat", None) is not None)
+        verdict = flood_detector.observe(msg.chat.id, user_id, msg.message_id, msg.text or "", msg.bot)
+    if verdict.trigger is not None:
+        metrics.RAID_TRIGGERS.inc(reason=verdict.trigger.reason)
+        state["raid_trigger"] = verdict.trigger
+    if verdict.is_raid:
+        state["is_spam"] = True
+        state["classification_text"] = "RAID"
+        state["verdict_source"] = "raid"
+        logger.info(f"🚨 Сообщение рейда в чате {msg.chat.id}, удаляем без LLM")
+
+    logger.info("✅ Узел flood_check завершен")
+    return state
+
+
+@metrics.timed_node("raid_action")
+async def raid_action_node(state: AgentState) -> AgentState:
+    """Одно оповещение модераторам на рейд и массовое удаление копий вместо пересылки каждой"""
+    logger.info("⏳ Выполнение узла raid_action...")
+    msg: types.Message = state["message"]
+    trigger: Optional[RaidTrigger] = state.get("raid_trigger")
+    if _node_done(state, "raid_action"):
+        return {}
+    if state.get("is_spam"):
+        await verdict_ready()  # следующее сообщение чата проверяется, пока идут удаления
+
+    if trigger is not None:
+        chats = trigger.alert_chats
+        if chats is None:
+            chats = [chat_id for chat_id in sorted(trigger.chats) if flood_detector.should_alert(chat_id)]
+        if chats:
+            sample = (msg.text or "")[:200]
+            try:
+                await msg.bot.send_message(
+                    state["target_group_id"],
+                    f"🚨 Рейд ({trigger.reason}) в чатах {', '.join(map(str, chats))}.\n"
+                    f"Отправитель: {state['sender_full_name']}\n"
+                    f"Пример сообщения: {sample}\n"
+                    f"Копии удаляются автоматически в течение {RAID_MODE_SECONDS / 60:.0f} мин.",
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось отправить оповещение о рейде: {str(e)}")
+
+    removals = [(msg.bot, msg.chat.id, msg.message_id)] if state.get("is_spam") else []
+    if trigger is not None:
+        removals += [(bot, chat_id, message_id) for chat_id, message_id, bot in trigger.recent if bot is not None]
+    # Удаления из одного чата агрегатор склеивает в deleteMessages
+    results = await asyncio.gather(
+        *(get_moderator().delete(bot, chat_id, message_id) for bot, chat_id, message_id in removals),
+        return_exceptions=True,
+    )
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    if removals:
+        logger.info(f"🧹 Удалено сообщений рейда: {len(removals) - failed}/{len(removals)}")
+    if state.get("is_spam"):
+        await _mark_node_done(state, "raid_action")
+
+    logger.info("✅ Узел raid_action завершен")
+    return {}
+
+
+@metrics.timed_node("prefilter")
+async def prefilter_node(state: AgentState) -> AgentState:
+    """Правиловый предфильтр: очевидный SPAM / NOT_SPAM без обращения к LLM"""
+    logger.info("⏳ Выполнение узла prefilter...")
+
+    result = prefilter.score_message(state["message"].text or "")
+    if not state.get("dry_run"):
+        prefilter.stats.record(result)
+
+    if result.is_spam is not None:
+        state["is_spam"] = result.is_spam
+        state["classification_text"] = f"PREFILTER spam={result.spam_score} ham={result.ham_score}"
+        state["verdict_source"] = "prefilter"
+        logger.info(f"⚡ Предфильтр: {'SPAM' if result.is_spam else 'NOT_SPAM'} "
+                    f"(признаки: {', '.join(sorted(result.markers)) or '—'})")
+    else:
+        logger.info("🤔 Предфильтр не уверен, передаём LLM")
+
+    logger.info(f"📊 Доля сообщений без LLM: {prefilter.stats.skip_ratio:.1%} "
+                f"({prefilter.stats.spam + prefilter.stats.ham}/{prefilter.stats.checked})")
+    logger.info("✅ Узел prefilter завершен")
+    return state
+
+
+async def _off_loop_if_long(func, text: str):
+    """MinHash длинного текста — десятки тысяч операций: выполняем его вне event loop."""
+    if len(text) > NEAR_DUP_OFFLOAD_CHARS:
+        return await asyncio.to_thread(func, text)
+    return func(text)
+
+
+@metrics.timed_node("near_duplicate")
+async def near_duplicate_node(state: AgentState) -> AgentState:
+    """Слегка изменённый текст известного спама → сразу в ветку спама"""
+    logger.info("⏳ Выполнение узла near_duplicate...")
+
+    if state.get("dry_run"):
+        # Без статистики и без продления жизни найденной записи в LRU
+        similarity = await _off_loop_if_long(partial(near_duplicate_index.query, record=False),
+                                             state["message"].text or "")
+    else:
+        with metrics.NEAR_DUPLICATE_LOOKUP.time():
+            similarity = await _off_loop_if_long(near_duplicate_index.query, state["message"].text or "")
+
+    if similarity is not None:
+        state["is_spam"] = True
+        state["classification_text"] = f"NEAR_DUPLICATE similarity={similarity:.2f}"
+        state["verdict_source"] = "near_duplicate"
+        logger.info(f"⚡ Почти-дубликат известного спама (сходство {similarity:.2f})")
+
+    logger.info("✅ Узел near_duplicate завершен")
+    return state
+
+
+@metrics.timed_node("ml_classify")
+async def ml_classify_node(state: AgentState) -> AgentState:
+    """Локальная модель: уверенные случаи за доли миллисекунды, остальные — в LLM"""
+    logger.info("⏳ Выполнение узла ml_classify...")
+
+    is_spam, probability = ml_classifier.classify(state["message"].text or "")
+    if probability is not None:
+        state["spam_probability"] = probability
+
+    if is_spam is not None:
+        state["is_spam"] = is_spam
+        state["classification_text"] = f"ML v{ml_classifier.model.version} p={probability:.3f}"
+        state["verdict_source"] = "ml"
+        logger.info(f"⚡ ML-модель: {'SPAM' if is_spam else 'NOT_SPAM'} (p={probability:.3f})")
+    elif probability is not None:
+        logger.info(f"🤔 ML-модель не уверена (p={probability:.3f}), передаём LLM")
+
+    logger.info("✅ Узел ml_classify завершен")
+    return state
+
+
+@metrics.timed_node("reputation")
+async def reputation_node(state: AgentState) -> AgentState:
+    """Доверенный отправитель: LLM вызывается только для выборки его сообщений"""
+    logger.info("⏳ Выполнение узла reputation...")
+    msg: types.Message = state["message"]
+    if state.get("dry_run"):
+        # Теневой бэкенд проверяет всех: выборка доверенных изменила бы счётчики репутации
+        logger.info("✅ Узел reputation завершен (теневая проверка)")
+        return state
+
+    # При перегрузке доверенные пользователи не проверяются даже выборочно
+    degraded = overload_controller.level >= DEGRADED
+    sample_rate = 0.0 if degraded else None
+    if msg.from_user and not get_reputation_store().should_check(msg.chat.id, msg.from_user.id, sample_rate):
+        state["is_spam"] = False
+        state["classification_text"] = "TRUSTED_SENDER"
+        state["verdict_source"] = "reputation"
+        if degraded:
+            metrics.SHED_MESSAGES.inc(action="trusted_skip")
+        logger.info(f"⚡ Доверенный отправитель @{msg.from_user.username}, проверка пропущена")
+
+    logger.info("✅ Узел reputation завершен")
+    return state
+
+
+@metrics.timed_node("load_shed")
+async def load_shed_node(state: AgentState) -> AgentState:
+    """LLM не укладывается в SLO: дешёвый эвристический вердикт или отложенная перепроверка"""
+    logger.info("⏳ Выполнение узла load_shed...")
+    level = overload_controller.level
+    # Теневая проверка идёт как при нормальной нагрузке: ничего не откладывает и не влияет на метрики
+    if level < DEGRADED or state.get("recheck") or state.get("dry_run"):
+        logger.info("✅ Узел load_shed завершен")
+        return state
+
+    msg_text = state["message"].text or ""
+    probability = state.get("spam_probability")
+    is_spam = None
+    if probability is not None:
+        # Оценка ML с ослабленными порогами
+        if probability >= OVERLOAD_SPAM_PROBABILITY:
+            is_spam = True
+        elif probability <= OVERLOAD_HAM_PROBABILITY:
+            is_spam = False
+    else:
+        result = prefilter.score_message(msg_text)
+        if result.spam_score >= prefilter.SPAM_THRESHOLD - 1 and not result.ham_score:
+            is_spam = True
+
+    if is_spam is not None:
+        state["is_spam"] = is_spam
+        state["classification_text"] = f"DEGRADED p={probability}" if probability is not None else "DEGRADED prefilter"
+        state["verdict_source"] = "degraded"
+        metrics.SHED_MESSAGES.inc(action="heuristic")
+        logger.info(f"🚦 Перегрузка: эвристический вердикт {'SPAM' if is_spam else 'NOT_SPAM'}")
+    elif level >= SHEDDING and cascade_config.escalation_reason(msg_text, None) is None:
+        # Низкий риск (короткий текст без ссылок и денег): пропускаем сейчас, проверим после разгрузки
+        state["is_spam"] = False
+        state["classification_text"] = "DEFERRED"
+        state["verdict_source"] = "deferred"
+        overload_controller.defer(state["message"])
+        logger.info("🚦 Перегрузка: сообщение низкого риска отложено на перепроверку")
+
+    logger.info("✅ Узел load_shed завершен")
+    return state
+
+
+@metrics.timed_node("detect_spam")
 async def detect_spam(state: AgentState) -> AgentState:
     """LLM-классификация: SPAM / NOT_SPAM → is_spam bool"""
     logger.info("⏳ Выполнение узла detect_spam...")
 
     msg_text = state["message"].text or ""
-    system_prompt = (
-        "Ты — высокоточная система детекции спама для Telegram.\n"
-        "Отвечай только 'SPAM' или 'NOT_SPAM' без пояснений.\n"
-        """### Критерии SPAM (маркировать если есть ХОТЯ БЫ ОДИН признак):
-1. **Финансовые предложения + контакт:**
-   - Упоминание сумм ($, ₽, "доход", "прибыль") + призыв к действию ("пиши", "ЛС", "напиши", "жду в личку")
-   - *Примеры:*
-     ▸ "Доход 110$/день. Пишите в ЛС"
-     ▸ "Получай 70$ в день — напиши мне плюс"
-
-2. **Гарантии быстрой выгоды:**
-   - Фразы: "без вложений", "без опыта", "всё просто", "без стрессов", "только N человек", "требуются люди"
-   - *Примеры:*
-     ▸ "Только 5 человек — забирайте 80% прибыли"
-     ▸ "Без сложностей — 600$ в неделю"
-
-3. **Шаблонные структуры:**
-   - Приветствие + предложение + контакт:
-     ▸ "Доброго дня! Открыто направление с доходом 250$/день. Пишите да"
-     ▸ "Здравствуйте! Нужны люди для заработка 70$ — обсудим в ЛС"
-   - Упоминание "форматов" или "партнёрств":
-     ▸ "Партнёрство 80/20: ваши 80% без рутины"
-     ▸ "Рабочий формат: телефон + $15/час"
-
-4. **Скрытые маркеры:**
-   - Удалёнка + доход + устройство:
-     ▸ "Удалёнка без начальников. Телефон + $13/час"
-     ▸ "Смартфон = $15/час. Пиши за деталями"
-   - Манипуляции: "Срочно!", "Немедленно смените пароль", "Уникальная возможность"
-
-### Критерии NOT_SPAM (только при ОТСУТСТВИИ всех признаков выше):
-- **Технические обсуждения:**
-  ▸ Квантование моделей ("Q4_K_M", "Q8"), fine-tuning, ИИ-архитектуры
-  ▸ Вопросы про нейросети ("whisper на казахском", "vllm", "векторные базы")
-- **Рабочие вопросы:**
-  ▸ Встречи ("сегодня в 18:00"), документы, трек-номера
-- **Аналитика:**
-  ▸ Обсуждение ChatGPT, локальных моделей, проблем ИИ
-- **Личные диалоги:**
-  ▸ "Что думаете о...", "Был похожий случай...", гипотезы об эпохе ИИ
-
-### Автоматические правила:
-1. **Любое сочетание** "деньги ($/₽)" + "контакт (ЛС/пиши)" → SPAM
-2. **Любое упоминание** "розыгрыша", "взлома", "партнёрства" с цифрами → SPAM
-3. **Игнорировать:**
-   - Опечатки, длину текста, вежливые приветствия
-   - Обсуждение математики, университетов, если нет финансовых предложений
-
-### Примеры для привязки:
-- **SPAM:**
-  "Приветствую! Доход 600$/неделя. Напиши в ЛС → Без опыта!"
-  "Делюсь форматом: смартфон + $14/час. Жду в личку!"
-  "Заработай 250$/день. Пиши 'Да' → Только сегодня!"
-- **NOT_SPAM:**
-  "Как квантовать модель для Q8?"
-  "Почему ChatGPT стал угодливым?"
-  "Трек-номер AB123456 готов"
-=================================================="""
-        f"Сообщение: «{msg_text}»"
-    )
-
-    logger.debug(f"Отправка запроса к LLM: {system_prompt[:100]}...")
-    answer = await llm.ainvoke([HumanMessage(content=system_prompt)])
-    answer_content = answer.content
-
-    state["classification_text"] = answer_content
-    state["is_spam"] = answer_content.strip().upper().startswith("SPAM")
-
-    logger.info(f"🔍 Результат классификации: {'SPAM' if state['is_spam'] else 'NOT_SPAM'}")
+
+    # Теневая проверка кэшем не пользуется: иначе сравнивался бы вердикт основного бэкенда с ним самим
+    cached = None
+    if not state.get("dry_run"):
+        cached = verdict_cache.get(msg_text)
+        (metrics.VERDICT_CACHE_MISSES if cached is None else metrics.VERDICT_CACHE_HITS).inc()
+    if cached is not None:
+        state["is_spam"], state["classification_text"] = cached
+        state["verdict_source"] = "cache"
+        logger.info(f"⚡ Вердикт из кэша: {'SPAM' if state['is_spam'] else 'NOT_SPAM'} "
+                    f"(hits={verdict_cache.hits}, misses={verdict_cache.misses})")
+        logger.info("✅ Узел detect_spam завершен")
+        return state
+
+    await _classify_with_tier(state, tier=0)
     logger.info("✅ Узел detect_spam завершен")
     return state
 
 
-@tool("save_spam")
-async def save_spam_tool(
+@metrics.timed_node("escalate_model")
+async def escalate_model_node(state: AgentState) -> AgentState:
+    """Перепроверка следующей (более крупной) моделью каскада"""
+    logger.info("⏳ Выполнение узла escalate_model...")
+    await _classify_with_tier(state, tier=state["cascade_tier"] + 1)
+    logger.info("✅ Узел escalate_model завершен")
+    return state
+
+
+async def _classify_with_tier(state: AgentState, tier: int) -> None:
+    msg_text = state["message"].text or ""
+    models = cascade_config.models_for(state["message"].chat.id)
+    model = models[tier]
+    dry_run = state.get("dry_run")
+
+    # При перегрузке крупная модель не вызывается: вердикт текущего уровня окончательный.
+    # Теневая проверка идёт как при нормальной нагрузке.
+    has_next = tier + 1 < len(models)
+    suppressed = has_next and not dry_run and overload_controller.level >= DEGRADED
+    escalate = has_next and not suppressed
+
+    started = time.perf_counter()
+    try:
+        # Эскалация по неуверенности возможна — нужна вероятность, которой нет у ответа на пачку
+        result = await get_classifier(model).classify(msg_text, need_confidence=escalate)
+    finally:
+        # Ошибки и таймауты тоже сигнал перегрузки (задержки теневого бэкенда не в счёт)
+        if not dry_run:
+            overload_controller.observe_llm(time.perf_counter() - started)
+    if not dry_run:
+        metrics.CASCADE_DURATION.observe(time.perf_counter() - started, tier=str(tier), model=model)
+
+    state["classification_text"] = result.text
+    state["is_spam"] = result.is_spam
+    state["verdict_source"] = "llm"
+    state["cascade_tier"] = tier
+    if result.probability is not None:
+        state["spam_probability"] = result.probability
+
+    reason = cascade_config.escalation_reason(msg_text, result.probability) if has_next else None
+    # Эскалация нужна, но отменена перегрузкой: вердикт окончательный только для этого сообщения
+    provisional = suppressed and reason is not None
+    if provisional:
+        reason = None
+    state["escalation_reason"] = reason
+    if not dry_run:
+        metrics.CASCADE_OUTCOMES.inc(tier=str(tier), model=model, outcome="escalated" if reason else "final")
+
+    probability = f" (p={result.probability:.3f})" if result.probability is not None else ""
+    logger.info(f"🔍 Результат классификации [{model}]: {'SPAM' if state['is_spam'] else 'NOT_SPAM'}{probability}")
+    if reason:
+        logger.info(f"🪜 Эскалация к {models[tier + 1]}: {reason}")
+    elif provisional:
+        logger.info("🚦 Перегрузка: эскалация пропущена, вердикт не кэшируется")
+    elif not dry_run:
+        verdict_cache.put(msg_text, state["is_spam"], result.text)
+
+
+async def save_spam(
         sender_full_name: str,
         message_text: str,
+        sender_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        message_id: Optional[int] = None,
+        verdict_source: Optional[str] = None,
 ) -> dict:
     """Сохраняет спам-сообщение в базу"""
     logger.info("💾 Сохранение спама в БД...")
-    save_spam_message(sender_full_name, message_text)
+    # Запись уходит фоновому писателю и не блокирует event loop
+    save_spam_message(
+        sender_full_name,
+        message_text,
+        sender_id=sender_id,
+        chat_id=chat_id,
+        message_id=message_id,
+        verdict_source=verdict_source,
+    )
     return {"status": "saved"}
 
 
+_save_spam_tool = None  # LangChain-tool над save_spam, создаётся вместе с графом
+
+
+@metrics.timed_node("save_spam")
 async def save_spam_node(state: AgentState) -> AgentState:
     """Node-обёртка над tool"""
     logger.info("⏳ Выполнение узла save_spam...")
-    await save_spam_tool.ainvoke({
+    msg: types.Message = state["message"]
+    await verdict_ready()  # вердикт есть: чат свободен для следующего сообщения, пока идёт модерация
+    if _node_done(state, "save_spam"):
+        return {}
+    await _save_spam_tool.ainvoke({
         "sender_full_name": state["sender_full_name"],
-        "message_text": state["message"].text or ""
+        "message_text": msg.text or "",
+        "sender_id": msg.from_user.id if msg.from_user else None,
+        "chat_id": msg.chat.id,
+        "message_id": msg.message_id,
+        "verdict_source": state.get("verdict_source"),
     })
+    if state.get("verdict_source") not in UNTRUSTED_SPAM_SOURCES:
+        await _off_loop_if_long(near_duplicate_index.add, msg.text or "")
+    await _mark_node_done(state, "save_spam")
     logger.info("✅ Узел save_spam завершен")
-    return state
+    # Узел работает параллельно с пересылкой, поэтому возвращает только изменения (их нет)
+    return {}
 
 
+@metrics.timed_node("forward_message")
 async def forward_message_node(state: AgentState) -> AgentState:
     logger.info("⏳ Выполнение узла forward_message...")
     msg: types.Message = state["message"]
+    await verdict_ready()
+    if _node_done(state, "forward_message"):
+        return {}
 
     logger.debug(f"Пересылка сообщения в группу {state['target_group_id']}")
-    await msg.bot.forward_message(
-        chat_id=state["target_group_id"],
-        from_chat_id=msg.chat.id,
-        message_id=msg.message_id,
-    )
+    # Пересылки из одного чата склеиваются агрегатором в forwardMessages; при исчерпанном
+    # лимите чата модераторов вместо пересылки уходит отчёт, и удаление его не ждёт
+    chat = getattr(msg.chat, "title", None) or msg.chat.id
+    report = (f"{state['sender_full_name']} в «{chat}» ({msg.chat.id}/{msg.message_id}):\n"
+              f"{(msg.text or '')[:MODERATION_REPORT_CHARS]}")
+    await get_moderator().forward(msg.bot, msg.chat.id, msg.message_id, state["target_group_id"], report)
+    await _mark_node_done(state, "forward_message")
 
     logger.info("✅ Сообщение переслано")
     logger.info("✅ Узел forward_message завершен")
-    return state
+    return {}
 
 
+@metrics.timed_node("delete_user_message")
 async def delete_message_node(state: AgentState) -> AgentState:
     logger.info("⏳ Выполнение узла delete_user_message...")
+    msg: types.Message = state["message"]
+    if _node_done(state, "delete_user_message"):
+        return {}
     try:
-        await state["message"].delete()
+        await get_moderator().delete(msg.bot, msg.chat.id, msg.message_id)
+        await _mark_node_done(state, "delete_user_message")
         logger.info("✅ Сообщение удалено")
     except Exception as e:
         logger.warning(f"⚠️ Не удалось удалить сообщение: {str(e)}")
     logger.info("✅ Узел delete_user_message завершен")
-    return state
+    return {}
 
 
 # ------------------------------------------------------------------ #
-# ⬇️ Построение графа
+# ⬇️ Переходы между узлами
 # ------------------------------------------------------------------ #
-graph = StateGraph(AgentState)
+# Ветка спама: сохранение и пересылка стартуют одновременно
+SPAM_BRANCH = ["save_spam", "forward_message"]
+# Ветка рейда: вместо пересылки каждой копии — одно оповещение и массовое удаление
+RAID_BRANCH = ["save_spam", "raid_action"]
+
+
+# Переход после быстрого этапа (предфильтр, почти-дубликаты, ML): уверенный вердикт минует LLM
+def route_or_next(next_node: str):
+    def route(state: AgentState):
+        if "is_spam" not in state:
+            return next_node
+        return route_decision(state)
+
+    return route
 
-graph.add_node("detect_spam", detect_spam)
-graph.add_node("save_spam", save_spam_node)
-graph.add_node("forward_message", forward_message_node)
-graph.add_node("delete_user_message", delete_message_node)
 
-# Установка точки входа
-graph.set_entry_point("detect_spam")
+# После LLM: перепроверка крупной моделью или обычный переход по вердикту
+def route_after_llm(state: AgentState):
+    if state.get("escalation_reason"):
+        return "escalate_model"
+    return route_decision(state)
+
+
+# После детектора рейдов: рейд → своя ветка; порог сработал на обычном сообщении → оповещение и проверка
+def route_after_flood(state: AgentState):
+    if state.get("verdict_source") == "raid":
+        return RAID_BRANCH
+    if "is_spam" in state:
+        return route_decision(state)  # вердикт восстановлен из долговечной очереди
+    if state.get("raid_trigger") is not None:
+        return "raid_action"
+    return "prefilter"
 
 
 # Условный переход после классификации
-def route_decision(state: AgentState) -> str:
+def route_decision(state: AgentState):
+    if state.get("dry_run"):
+        return END  # вердикт без действий
     if state.get("is_spam"):
         logger.info("🔄 Переход к обработке спама")
-        return "save_spam"
+        return SPAM_BRANCH
     logger.info("🛑 Сообщение не спам, завершение обработки")
     return END
 
 
-graph.add_conditional_edges(
-    "detect_spam",
-    route_decision,
-)
+# ------------------------------------------------------------------ #
+# ⬇️ Построение графа
+# ------------------------------------------------------------------ #
+def build_graph():
+    global _save_spam_tool
+    from langgraph.graph import StateGraph
+    from langchain.tools import tool
+
+    _save_spam_tool = tool("save_spam")(save_spam)
+
+    graph = StateGraph(AgentState)
+
+    graph.add_node("flood_check", flood_check_node)
+    graph.add_node("raid_action", raid_action_node)
+    graph.add_node("prefilter", prefilter_node)
+    graph.add_node("near_duplicate", near_duplicate_node)
+    graph.add_node("ml_classify", ml_classify_node)
+    graph.add_node("reputation", reputation_node)
+    graph.add_node("load_shed", load_shed_node)
+    graph.add_node("detect_spam", detect_spam)
+    graph.add_node("escalate_model", escalate_model_node)
+    graph.add_node("save_spam", save_spam_node)
+    graph.add_node("forward_message", forward_message_node)
+    graph.add_node("delete_user_message", delete_message_node)
+
+    # Установка точки входа
+    graph.set_entry_point("flood_check")
+
+    graph.add_conditional_edges(
+        "flood_check",
+        route_after_flood,
+        ["prefilter", "raid_action", "save_spam", "forward_message", END],
+    )
+
+    graph.add_conditional_edges(
+        "prefilter",
+        route_or_next("near_duplicate"),
+        ["near_duplicate", *SPAM_BRANCH, END],
+    )
+    graph.add_conditional_edges(
+        "near_duplicate",
+        route_or_next("ml_classify"),
+        ["ml_classify", *SPAM_BRANCH, END],  # END — теневая проверка (dry_run)
+    )
+    graph.add_conditional_edges(
+        "ml_classify",
+        route_or_next("reputation"),
+        ["reputation", *SPAM_BRANCH, END],
+    )
+    graph.add_conditional_edges(
+        "reputation",
+        route_or_next("load_shed"),
+        ["load_shed", END],
+    )
+    graph.add_conditional_edges(
+        "load_shed",
+        route_or_next("detect_spam"),
+        ["detect_spam", *SPAM_BRANCH, END],
+    )
+    graph.add_conditional_edges(
+        "detect_spam",
+        route_after_llm,
+        ["escalate_model", *SPAM_BRANCH, END],
+    )
+    graph.add_conditional_edges(
+        "escalate_model",
+        route_after_llm,
+        ["escalate_model", *SPAM_BRANCH, END],
+    )
+
+    # Пересылка модераторам всегда до удаления; сохранение идёт параллельно
+    # Оповещение о флуде в чате без признаков рейда у сообщения — дальше обычная проверка
+    graph.add_conditional_edges(
+        "raid_action",
+        lambda state: END if state.get("is_spam") else "prefilter",
+        ["prefilter", END],
+    )
+    graph.add_edge("save_spam", END)
+    graph.add_edge("forward_message", "delete_user_message")
+    graph.add_edge("delete_user_message", END)
+    return graph
 
-# Чёткая последовательность действий для спама
-graph.add_edge("save_spam", "forward_message")
-graph.add_edge("forward_message", "delete_user_message")
-graph.add_edge("delete_user_message", END)
 
 # ------------------------------------------------------------------ #
-# ⬇️ Компиляция графа
+# ⬇️ Ленивая компиляция графа
 # ------------------------------------------------------------------ #
-graph_executor = graph.compile()
+_graph_executor = None
+_graph_lock = threading.Lock()
+
+
+def get_graph_executor():
+    """Собирает и компилирует граф при первом обращении (потокобезопасно)."""
+    global _graph_executor
+    with _graph_lock:
+        if _graph_executor is None:
+            started = time.perf_counter()
+            _graph_executor = build_graph().compile()
+            for model in cascade_config.default_models:
+                llm = get_llm(model)
+                for endpoint in llm.pool.endpoints:  # клиенты всех эндпоинтов создаются заранее
+                    endpoint.client(llm.name, llm.factory)
+            logger.info(f"🧩 Граф собран и скомпилирован за {time.perf_counter() - started:.2f} с")
+        return _graph_executor
+
+
+async def _warm_up_llm() -> None:
+    await asyncio.to_thread(get_graph_executor)
+    try:
+        await asyncio.gather(*(get_classifier(model).warm_up() for model in cascade_config.default_models))
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прогреть LLM: {e}")
+
 
-try:
-    logger.info("Сохраняем картинку в файл")
-    # Сохраняем картинку в файл
-    graph_image = graph_executor.get_graph().draw_mermaid_png()
-    with open("../graph_image.png", "wb") as png:
-        png.write(graph_image)
+async def warm_up() -> None:
+    """Собирает граф, индекс почти-дубликатов и прогревает LLM, пока бот подключается к Telegram."""
+    await asyncio.gather(
+        _warm_up_llm(),
+        asyncio.to_thread(near_duplicate_index.load_from_store, get_spam_store()),
+    )
+
+
+def draw_graph(path: str = "../graph_image.png") -> bool:
+    """Сохраняет mermaid-картинку графа (может обращаться к сети)."""
+    try:
+        logger.info("Сохраняем картинку в файл")
+        graph_image = get_graph_executor().get_graph().draw_mermaid_png()
+        with open(path, "wb") as png:
+            png.write(graph_image)
+        return True
+    except Exception:
+        # This requires some extra dependencies and is optional
+        # Это требует некоторых дополнительных зависимостей и не является обязательным
+        logger.info(" Не удалось сохранить картинку в файл")
+        return False
 
-except Exception:
-    # This requires some extra dependencies and is optional
-    # Это требует некоторых дополнительных зависимостей и не является обязательным
-    logger.info(" Не удалось сохранить картинку в файл")
 
 # ------------------------------------------------------------------ #
 # ⬇️ Вызов из обработчика Telegram
 # ------------------------------------------------------------------ #
-async def agent_check_spam(message: types.Message) -> None:
-    """Telegram-entry-point."""
-    logger.info(f"\n🔔 Новое сообщение от @{message.from_user.username}: {message.text[:50]}...")
-    initial_state: AgentState = {
+def build_initial_state(
+        message: types.Message, recheck: bool = False, resume: Optional[PendingEntry] = None,
+) -> AgentState:
+    state: AgentState = {
         "message": message,
         "sender_full_name": message.from_user.full_name,
         "target_group_id": TARGET_GROUP_ID,
     }
-    await graph_executor.ainvoke(initial_state)
-    logger.info("🏁 Обработка сообщения завершена\n")
\ No newline at end of file
+    if recheck:
+        state["recheck"] = True
+    if resume is not None:
+        state["resumed"] = True
+        state["done_nodes"] = resume.done_nodes
+        if resume.is_spam:  # вердикт сохраняется вместе с первым побочным эффектом — LLM не нужна
+            state["is_spam"] = True
+            state["verdict_source"] = resume.verdict_source
+            state["classification_text"] = "RESUMED"
+    return state
+
+
+def ingest_risk(text: str) -> float:
+    """Дешёвая оценка риска при приёме: порядок разбора backlog после перезапуска."""
+    _, probability = ml_classifier.classify(text)
+    if probability is None:
+        probability = min(1.0, prefilter.score_message(text).spam_score / prefilter.SPAM_THRESHOLD)
+    if cascade_config.escalation_reason(text, None):
+        probability = min(1.0, probability + 0.1)  # ссылки, деньги, длинный текст
+    return probability
+
+
+async def agent_check_spam(
+        message: types.Message, recheck: bool = False, resume: Optional[PendingEntry] = None,
+) -> AgentState:
+    """
+    Telegram-entry-point.
+    recheck=True — перепроверка сообщения, отложенного при перегрузке;
+    resume — запись долговечной очереди, оставшаяся с прошлого запуска.
+    """
+    logger.info(f"\n🔔 Новое сообщение от @{message.from_user.username}: {message.text[:50]}...")
+    graph_executor = _graph_executor or await asyncio.to_thread(get_graph_executor)
+
+    started = time.perf_counter()
+    if slow_message_profiler is not None:
+        with slow_message_profiler.track(f"{message.chat.id}/{message.message_id}"):
+            final_state = await graph_executor.ainvoke(build_initial_state(message, recheck, resume))
+    else:
+        final_state = await graph_executor.ainvoke(build_initial_state(message, recheck, resume))
+
+    metrics.MESSAGE_DURATION.observe(time.perf_counter() - started)
+    # Пропуск по репутации и отложенный вердикт не говорят о пользователе ничего нового
+    if message.from_user and final_state.get("verdict_source") not in ("reputation", "deferred"):
+        get_reputation_store().record(message.chat.id, message.from_user.id, bool(final_state.get("is_spam")))
+    metrics.VERDICTS.inc(
+        verdict="SPAM" if final_state.get("is_spam") else "NOT_SPAM",
+        source=final_state.get("verdict_source", "unknown"),
+    )
+
+    store = get_pending_store()
+    if store is not None:
+        if final_state.get("verdict_source") == "deferred":
+            # Отложенное сообщение остаётся в очереди и после перезапуска попадёт в backlog
+            await asyncio.to_thread(store.set_state, message.chat.id, message.message_id, DEFERRED)
+        else:
+            await asyncio.to_thread(store.complete, message.chat.id, message.message_id)
+    logger.info("🏁 Обработка сообщения завершена\n")
+    return final_state
+
+
+async def classify_message(message: types.Message) -> AgentState:
+    """
+    Только вердикт (теневой режим): граф без действий и без изменения общего состояния — счётчиков
+    рейдов, предфильтра и репутации, индекса почти-дубликатов, кэша вердиктов, контроллера перегрузки
+    и метрик узлов.
+    """
+    graph_executor = _graph_executor or await asyncio.to_thread(get_graph_executor)
+    state = build_initial_state(message)
+    state["dry_run"] = True
+    return await graph_executor.ainvoke(state)
+
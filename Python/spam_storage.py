@@ -1,22 +1,240 @@
+"""
+Хранилище пойманного спама.
+
+Записи складываются в SQLite (режим WAL) фоновым потоком-писателем, который
+коммитит их пачками, поэтому save_spam_message() не блокирует event loop.
+Индексы по отправителю, чату и времени позволяют быстро отвечать на вопросы
+вроде «последние N спам-сообщений от X» или «спам по часам в чате Y».
+"""
+
+import asyncio
+import atexit
 import json
 import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
 from datetime import datetime
+from typing import Iterator, List, Optional
 
 logger = logging.getLogger(__name__)
 
+LEGACY_LOG_PATH = "spam_log.json"
+
+# Вердикты, на которых нельзя учиться (ML-модель) и которые нельзя размножать (индекс почти-дубликатов):
+# оценки самой модели (ml, degraded — с ослабленными порогами), эвристики предфильтра, массовые рейдовые
+# удаления без классификации и сами почти-дубликаты — иначе одна ошибка разрастается по похожим текстам
+UNTRUSTED_SPAM_SOURCES = frozenset({"ml", "degraded", "raid", "prefilter", "near_duplicate"})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spam (
+    id             INTEGER PRIMARY KEY,
+    ts             REAL    NOT NULL,
+    sender         TEXT,
+    sender_id      INTEGER,
+    chat_id        INTEGER,
+    message_id     INTEGER,
+    message        TEXT,
+    verdict_source TEXT
+);
+CREATE INDEX IF NOT EXISTS spam_sender_ts ON spam (sender_id, ts);
+CREATE INDEX IF NOT EXISTS spam_chat_ts   ON spam (chat_id, ts);
+CREATE INDEX IF NOT EXISTS spam_ts        ON spam (ts);
+"""
+
+_COLUMNS = ("ts", "sender", "sender_id", "chat_id", "message_id", "message", "verdict_source")
+_INSERT = f"INSERT INTO spam ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+
+
+class SpamStore:
+    """SQLite-хранилище с фоновым групповым коммитом."""
+
+    def __init__(
+            self,
+            path: str = "spam_log.sqlite3",
+            batch_size: int = 200,
+            flush_interval: float = 0.5,
+            legacy_log: Optional[str] = LEGACY_LOG_PATH,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._closed = False
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            if legacy_log:
+                self._import_legacy_log(conn, legacy_log)
+            conn.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="spam-store-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _import_legacy_log(conn: sqlite3.Connection, legacy_log: str) -> None:
+        """Однократно переносит записи из старого spam_log.json (NDJSON)."""
+        if not os.path.exists(legacy_log) or conn.execute("SELECT 1 FROM spam LIMIT 1").fetchone():
+            return
+        rows = []
+        with open(legacy_log, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                    ts = datetime.fromisoformat(data["timestamp"]).timestamp()
+                except (ValueError, KeyError):
+                    continue
+                rows.append((ts, data.get("sender"), None, None, None, data.get("message"), None))
+        conn.executemany(_INSERT, rows)
+        logger.info(f"Импортировано записей из {legacy_log}: {len(rows)}")
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Запись
+    # -------------------------------------------------------------- #
+    def add(self, **record) -> None:
+        """Ставит запись в очередь писателя и сразу возвращает управление."""
+        if self._closed:
+            logger.error("Хранилище спама уже закрыто, запись пропущена")
+            return
+        record.setdefault("ts", time.time())
+        self._queue.put_nowait(tuple(record.get(c) for c in _COLUMNS))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            batch = []
+            if first is None:
+                stop = True
+            else:
+                batch.append(first)
+            # Групповой коммит: забираем всё, что накопилось за flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(_INSERT, batch)
+                    logger.debug(f"Записано спам-сообщений: {len(batch)}")
+                except Exception as e:
+                    logger.error(f"Logging failed: {e}")
+        conn.close()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Дописывает очередь и останавливает поток-писатель."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Запросы (синхронные; из event loop — через a*-версии)
+    # -------------------------------------------------------------- #
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        data = dict(row)
+        data["timestamp"] = datetime.fromtimestamp(data.pop("ts")).isoformat()
+        return data
+
+    def last_spam_from_sender(self, sender_id: int, limit: int = 10) -> List[dict]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM spam WHERE sender_id = ? ORDER BY ts DESC LIMIT ?",
+                (sender_id, limit),
+            ).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def spam_per_hour(self, chat_id: int, since: Optional[float] = None) -> List[dict]:
+        """Количество спама по часам: [{'hour': '2025-05-01T13:00', 'count': 5}, ...]."""
+        since = since if since is not None else time.time() - 24 * 3600
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT CAST(ts / 3600 AS INTEGER) AS bucket, COUNT(*) AS count FROM spam "
+                "WHERE chat_id = ? AND ts >= ? GROUP BY bucket ORDER BY bucket",
+                (chat_id, since),
+            ).fetchall()
+        return [
+            {"hour": datetime.fromtimestamp(r["bucket"] * 3600).isoformat(timespec="minutes"),
+             "count": r["count"]}
+            for r in rows
+        ]
+
+    def iter_spam(self, after_id: int = 0, batch_size: int = 1000) -> Iterator[dict]:
+        """Все записи по возрастанию id (для обучения и построения индексов)."""
+        with closing(self._connect()) as conn:
+            while True:
+                rows = conn.execute(
+                    "SELECT * FROM spam WHERE id > ? ORDER BY id LIMIT ?", (after_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    return
+                for row in rows:
+                    yield self._to_dict(row)
+                after_id = rows[-1]["id"]
+
+    async def alast_spam_from_sender(self, sender_id: int, limit: int = 10) -> List[dict]:
+        return await asyncio.to_thread(self.last_spam_from_sender, sender_id, limit)
+
+    async def aspam_per_hour(self, chat_id: int, since: Optional[float] = None) -> List[dict]:
+        return await asyncio.to_thread(self.spam_per_hour, chat_id, since)
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Хранилище по умолчанию (создаётся при первом обращении, после load_dotenv)
+# ------------------------------------------------------------------ #
+_store: Optional[SpamStore] = None
+_store_lock = threading.Lock()
+
+
+def get_spam_store() -> SpamStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SpamStore(os.getenv("SPAM_DB_PATH", "spam_log.sqlite3"))
+        return _store
+
 
-def save_spam_message(sender_full_name: str, message_text: str):
-    spam_data = {
-        "timestamp": datetime.now().isoformat(),
-        "sender": sender_full_name,
-        "message": message_text
-    }
-
-    try:
-        with open('spam_log.json', 'a') as f:
-            json.dump(spam_data, f, ensure_ascii=False)
-            f.write('\n')
-        logger.info("Spam logged successfully")
-        logger.info(f"Spam saved. \nsender_full_name={sender_full_name}, \nmessage_text={message_text}")
-    except Exception as e:
-        logger.error(f"Logging failed: {e}")
\ No newline at end of file
+def save_spam_message(
+        sender_full_name: str,
+        message_text: str,
+        sender_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        message_id: Optional[int] = None,
+        verdict_source: Optional[str] = None,
+):
+    get_spam_store().add(
+        sender=sender_full_name,
+        message=message_text,
+        sender_id=sender_id,
+        chat_id=chat_id,
+        message_id=message_id,
+        verdict_source=verdict_source,
+    )
+    logger.info("Spam queued for storage")
+    logger.info(f"Spam saved. \nsender_full_name={sender_full_name}, \nmessage_text={message_text}")
@@ -0,0 +1,268 @@
+"""
+Локальный OpenAI-совместимый stub-сервер LLM для бенчмарков.
+
+Отвечает на /v1/chat/completions с настраиваемой задержкой. Вердикт берётся из
+словаря меток корпуса (текст → SPAM/NOT_SPAM), поэтому метрики качества
+бенчмарка показывают ошибки самого пайплайна, а не модели. Понимает одиночный
+промпт («Сообщение: «…»»), пачку («Сообщения: 1. «…»») и вызов инструмента
+process_spam для OpenAI Agents SDK. Поддерживает max_tokens, logprobs
+(top_logprobs первого токена) и потоковые ответы (stream=true).
+
+Оценка промпта имитируется как у llama.cpp с одним слотом: время пропорционально
+числу символов после общего префикса с предыдущим запросом (prompt_ms_per_kchar).
+
+Запуск отдельно:
+    python stub_llm_server.py --port 11435 --latency-ms 300 --labels benchmark_corpus.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+from typing import Dict, Optional
+
+from aiohttp import web
+
+_SINGLE_RE = re.compile(r"Сообщение: «(.*)»\s*$", re.DOTALL)
+_BATCH_ITEM_RE = re.compile(r"^(\d+)\. «(.*?)»$", re.MULTILINE | re.DOTALL)
+_WORD_RE = re.compile(r"\s*\S+")
+
+# Грубая имитация токенизатора для меток классификатора
+_LABEL_TOKENS = {"SPAM": ["SP", "AM"], "NOT_SPAM": ["NOT", "_SP", "AM"]}
+
+
+def _tokens(content: str) -> list:
+    return list(_LABEL_TOKENS.get(content) or _WORD_RE.findall(content))
+
+
+class StubLLMServer:
+    """Stub OpenAI API: фиксированная задержка + ответы по меткам корпуса."""
+
+    def __init__(
+            self,
+            labels: Optional[Dict[str, str]] = None,
+            latency_ms: float = 300,
+            jitter_ms: float = 0,
+            error_rate: float = 0.0,
+            logprobs: bool = True,
+            prompt_ms_per_kchar: float = 0.0,
+            host: str = "127.0.0.1",
+            port: int = 0,
+    ):
+        self.labels = labels or {}
+        self.logprobs = logprobs  # False — имитировать бэкенд без logprobs
+        self.prompt_seconds_per_char = prompt_ms_per_kchar / 1000 / 1000
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+
+        self.calls = 0
+        self.prompt_chars = 0
+        self.completion_tokens = 0
+        self.cached_prompt_chars = 0
+        self.total_prompt_chars = 0  # вместе с ролями, как видит шаблон чата
+        self.prompt_eval_seconds = 0.0
+        self._last_prompt = ""
+
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Логика ответа
+    # -------------------------------------------------------------- #
+    def _label(self, text: str) -> str:
+        label = self.labels.get(text.strip(), "NOT_SPAM")
+        if self.error_rate and random.random() < self.error_rate:
+            label = "NOT_SPAM" if label == "SPAM" else "SPAM"
+        return label
+
+    def _answer(self, body: dict) -> dict:
+        messages = body.get("messages", [])
+        user_text = "\n".join(
+            m["content"] for m in messages
+            if m.get("role") in ("user", "system") and isinstance(m.get("content"), str)
+        )
+        last_user = next(
+            (m["content"] for m in reversed(messages)
+             if m.get("role") == "user" and isinstance(m.get("content"), str)),
+            "",
+        )
+
+        # Агентский путь: сначала вызов process_spam, после результата — «SPAM»
+        if body.get("tools"):
+            if any(m.get("role") == "tool" for m in messages):
+                return {"role": "assistant", "content": "SPAM"}
+            if self._label(last_user) == "SPAM":
+                return {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [{
+                        "id": f"call_{uuid.uuid4().hex[:8]}",
+                        "type": "function",
+                        "function": {"name": "process_spam", "arguments": "{}"},
+                    }],
+                }
+            return {"role": "assistant", "content": "NOT_SPAM"}
+
+        if "Сообщения:" in user_text:
+            batch_part = user_text.split("Сообщения:", 1)[1]
+            items = sorted((int(n), t) for n, t in _BATCH_ITEM_RE.findall(batch_part))
+            return {"role": "assistant", "content": json.dumps([self._label(t) for _, t in items])}
+
+        match = _SINGLE_RE.search(user_text)
+        text = match.group(1) if match else last_user
+        return {"role": "assistant", "content": self._label(text)}
+
+    # -------------------------------------------------------------- #
+    # ⬇️ HTTP
+    # -------------------------------------------------------------- #
+    async def _chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.calls += 1
+        prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+        self.prompt_chars += prompt_chars
+
+        # Префикс, совпавший с предыдущим запросом, берётся из KV-кэша и не оценивается заново
+        prompt_text = "\n".join(f"{m.get('role')}: {m.get('content') or ''}" for m in body.get("messages", []))
+        cached = len(os.path.commonprefix([prompt_text, self._last_prompt]))
+        self._last_prompt = prompt_text
+        self.cached_prompt_chars += cached
+        self.total_prompt_chars += len(prompt_text)
+        prompt_eval = (len(prompt_text) - cached) * self.prompt_seconds_per_char
+        self.prompt_eval_seconds += prompt_eval
+
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter) + prompt_eval)
+
+        message = self._answer(body)
+        tokens = _tokens(message.get("content") or "")
+        if body.get("max_tokens"):
+            tokens = tokens[:body["max_tokens"]]
+        if message.get("content") is not None:
+            message["content"] = "".join(tokens)
+        completion_tokens = len(tokens) or 1
+        self.completion_tokens += completion_tokens
+        prompt_tokens = prompt_chars // 4  # грубая оценка, токенизатора у stub нет
+
+        if body.get("stream"):
+            return await self._stream(request, body, tokens)
+
+        choice = {
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+        }
+        if body.get("logprobs") and self.logprobs and tokens:
+            choice["logprobs"] = {"content": [self._first_token_logprobs(tokens[0])]}
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [choice],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    @staticmethod
+    def _first_token_logprobs(token: str) -> dict:
+        other = "NOT" if token == "SP" else "SP"
+        return {
+            "token": token,
+            "logprob": -0.05,
+            "top_logprobs": [{"token": token, "logprob": -0.05}, {"token": other, "logprob": -3.0}],
+        }
+
+    async def _stream(self, request: web.Request, body: dict, tokens: list) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        try:
+            for index, token in enumerate(tokens + [None]):
+                delta = {"content": token} if token is not None else {}
+                if index == 0:
+                    delta["role"] = "assistant"
+                chunk = {
+                    "id": chunk_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None if token else "stop"}],
+                }
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            pass  # клиент получил решающий токен и закрыл поток
+        return response
+
+    async def _models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        app.router.add_get("/v1/models", self._models)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        # port=0 — берём свободный порт, выданный ОС
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def load_labels(corpus_path: str) -> Dict[str, str]:
+    labels = {}
+    with open(corpus_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                labels[item["text"].strip()] = item["label"]
+    return labels
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    server = StubLLMServer(
+        labels=load_labels(args.labels) if args.labels else None,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        logprobs=not args.no_logprobs,
+        prompt_ms_per_kchar=args.prompt_ms_per_kchar,
+        host=args.host,
+        port=args.port,
+    )
+    await server.start()
+    print(f"Stub LLM слушает {server.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-совместимый stub LLM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--labels", help="JSONL-корпус с полями text/label")
+    parser.add_argument("--no-logprobs", action="store_true", help="не отдавать logprobs")
+    parser.add_argument("--prompt-ms-per-kchar", type=float, default=0.0,
+                        help="время оценки 1000 символов промпта вне KV-кэша")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,107 @@
+"""
+Минимальное декодирование BatchClassifier: logprobs, ранняя остановка и повтор полным запросом.
+
+Запуск: python -m pytest -q test_batch_classifier.py
+"""
+
+import asyncio
+import math
+from types import SimpleNamespace
+
+from batch_classifier import BatchClassifier, spam_probability
+
+
+def token(text: str, probability: float, top=None) -> dict:
+    item = {"token": text, "logprob": math.log(probability)}
+    if top is not None:
+        item["top_logprobs"] = [{"token": t, "logprob": math.log(p)} for t, p in top]
+    return item
+
+
+class FakeLLM:
+    """Отвечает по очереди заготовленными ответами; запоминает параметры вызовов."""
+
+    def __init__(self, answers, stream_answers=()):
+        self.answers = list(answers)
+        self.stream_answers = list(stream_answers)
+        self.calls = []
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls.append(("invoke", kwargs))
+        content, logprobs = self.answers.pop(0)
+        metadata = {"logprobs": logprobs} if logprobs is not None else {}
+        return SimpleNamespace(content=content, response_metadata=metadata, usage_metadata={})
+
+    async def astream_until(self, messages, done, **kwargs):
+        self.calls.append(("stream", kwargs))
+        answer = ""
+        for chunk in self.stream_answers.pop(0):
+            answer += chunk
+            if done(answer):
+                break
+        return answer
+
+
+def make_classifier(llm: FakeLLM) -> BatchClassifier:
+    return BatchClassifier(lambda: llm, "правила", max_batch_size=1)
+
+
+def test_formatting_tokens_are_skipped():
+    logprobs = {"content": [
+        token("**", 0.9, top=[("**", 0.9), ("\"", 0.1)]),
+        token("SP", 0.8, top=[("SP", 0.8), ("NOT", 0.2)]),
+    ]}
+    assert math.isclose(spam_probability(logprobs), 0.8)
+
+
+def test_probability_from_logprobs():
+    llm = FakeLLM([("SPAM", {"content": [token("SPAM", 0.9, top=[("SPAM", 0.9), ("NOT", 0.1)])]})])
+    result = asyncio.run(make_classifier(llm).classify("текст"))
+    assert result.is_spam and math.isclose(result.probability, 0.9)
+
+
+def test_undecided_short_answer_falls_back_to_full_prompt():
+    # logprobs есть, но первый значимый токен ни к какому классу не ведёт, а ответ оборван
+    llm = FakeLLM([
+        ("**", {"content": [token("**", 0.9), token("Ответ", 0.9)]}),
+        ("SPAM", None),
+    ])
+    classifier = make_classifier(llm)
+    result = asyncio.run(classifier.classify("текст"))
+    assert result.is_spam
+    assert "max_tokens" not in llm.calls[1][1]
+    # Поле logprobs пришло, просто не разобралось: режим logprobs остаётся
+    assert classifier._logprobs_supported is True
+
+
+def test_missing_logprobs_switches_to_stream():
+    llm = FakeLLM([("NOT_SPAM", None)], stream_answers=[["\"", "N", "O"], ["*", "*"]])
+    llm.answers.append(("SPAM", None))
+    classifier = make_classifier(llm)
+
+    async def scenario():
+        return [await classifier.classify("первый"), await classifier.classify("второй"),
+                await classifier.classify("третий")]
+
+    first, second, third = asyncio.run(scenario())
+    assert classifier._logprobs_supported is False
+    assert not first.is_spam and not second.is_spam
+    # Поток оборвался без решающего токена — повтор полным запросом, а не NOT_SPAM
+    assert third.is_spam
+    assert [kind for kind, _ in llm.calls] == ["invoke", "stream", "stream", "invoke"]
+
+
+def test_need_confidence_bypasses_batching():
+    spam = {"content": [token("SPAM", 0.6, top=[("SPAM", 0.6), ("NOT", 0.4)])]}
+    llm = FakeLLM([("SPAM", spam), ("SPAM", spam)])
+    classifier = BatchClassifier(lambda: llm, "правила", max_batch_size=8)
+
+    async def scenario():
+        results = await asyncio.gather(*(classifier.classify(t, need_confidence=True) for t in ("один", "два")))
+        await classifier.close()
+        return results
+
+    results = asyncio.run(scenario())
+    # Каскаду нужна вероятность: каждое сообщение — отдельный запрос с logprobs, а не пачка
+    assert [math.isclose(r.probability, 0.6) for r in results] == [True, True]
+    assert all(kwargs.get("logprobs") for _, kwargs in llm.calls) and classifier.batches == 0
@@ -0,0 +1,159 @@
+"""
+Реестр бэкендов, маршрутизатор с теневым режимом и теневая классификация графа без побочных эффектов.
+
+Запуск: python -m pytest -q test_classifier_backends.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import classifier_backends
+from batch_classifier import Classification
+from classifier_backends import ClassifierBackend, ClassifierRouter, Verdict, get_backend, register_backend
+
+
+class FakeBackend(ClassifierBackend):
+    def __init__(self, handle_verdict: Verdict = None, classify_spam: bool = False):
+        self.handle_verdict = handle_verdict or Verdict(True, "llm")
+        self.classify_spam = classify_spam
+        self.handled = []
+        self.classified = []
+
+    async def handle(self, message, **kwargs):
+        self.handled.append(message)
+        return Verdict(self.handle_verdict.is_spam, self.handle_verdict.source)
+
+    async def classify(self, message):
+        self.classified.append(message)
+        return Verdict(self.classify_spam, "llm")
+
+
+def make_message(text: str = "Привет всем, как дела?", message_id: int = 1):
+    return SimpleNamespace(
+        text=text, message_id=message_id, bot=None, chat=SimpleNamespace(id=-1001),
+        from_user=SimpleNamespace(id=42, full_name="Иван", username="ivan"),
+    )
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Реестр и контракт
+# ------------------------------------------------------------------ #
+def test_backend_contract_is_abstract():
+    with pytest.raises(TypeError):
+        ClassifierBackend()
+
+    class HandleOnly(ClassifierBackend):
+        async def handle(self, message, **kwargs):
+            return Verdict(False, "llm")
+
+    with pytest.raises(TypeError):
+        HandleOnly()
+
+
+def test_registry_creates_one_named_instance(monkeypatch):
+    monkeypatch.setattr(classifier_backends, "_BACKENDS", dict(classifier_backends._BACKENDS))
+    monkeypatch.setattr(classifier_backends, "_instances", {})
+    register_backend("fake")(FakeBackend)
+
+    backend = get_backend("fake")
+    assert isinstance(backend, FakeBackend) and backend.name == "fake"
+    assert get_backend("fake") is backend
+    assert "fake" in classifier_backends.available_backends()
+    with pytest.raises(ValueError):
+        get_backend("missing")
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Маршрутизатор
+# ------------------------------------------------------------------ #
+def route(router: ClassifierRouter, messages):
+    async def scenario():
+        verdicts = [await router(message) for message in messages]
+        await router.close()
+        return verdicts
+
+    return asyncio.run(scenario())
+
+
+def test_router_compares_shadow_with_primary():
+    primary, shadow = FakeBackend(Verdict(True, "llm")), FakeBackend(classify_spam=False)
+    primary.name, shadow.name = "primary", "shadow"
+    router = ClassifierRouter(primary, shadow, shadow_rate=1.0)
+
+    verdicts = route(router, [make_message(message_id=i) for i in range(3)])
+    assert [v.is_spam for v in verdicts] == [True, True, True]
+    assert len(primary.handled) == 3 and not primary.classified
+    assert len(shadow.classified) == 3 and not shadow.handled
+    assert router.stats()["shadowed"] == 3 and router.stats()["agreement"] == 0.0
+
+
+def test_router_skips_unclassified_and_busy_shadow():
+    primary, shadow = FakeBackend(Verdict(False, "reputation")), FakeBackend()
+    primary.name, shadow.name = "primary", "shadow"
+    router = ClassifierRouter(primary, shadow, shadow_rate=1.0)
+    route(router, [make_message()])
+    assert router.shadow_unclassified == 1 and not shadow.classified
+
+    primary.handle_verdict = Verdict(False, "llm")
+    router = ClassifierRouter(primary, shadow, shadow_rate=1.0, max_shadow_in_flight=0)
+    route(router, [make_message()])
+    assert router.shadow_skipped == 1 and not shadow.classified
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Теневая классификация графа
+# ------------------------------------------------------------------ #
+class FakeClassifier:
+    def __init__(self):
+        self.texts = []
+
+    async def classify(self, text: str, need_confidence: bool = False) -> Classification:
+        self.texts.append(text)
+        return Classification(False, "NOT_SPAM")
+
+
+def shared_state(agent) -> dict:
+    return {
+        "prefilter": (agent.prefilter.stats.checked, agent.prefilter.stats.spam, agent.prefilter.stats.ham),
+        "near_duplicate": (agent.near_duplicate_index.stats(), list(agent.near_duplicate_index._signatures)),
+        "verdict_cache": agent.verdict_cache.stats(),
+        "reputation": agent.get_reputation_store().stats(),
+        "flood": agent.flood_detector.stats(),
+        "overload": (list(agent.overload_controller._latencies), len(agent.overload_controller._deferred)),
+        "parent_flood_verdicts": dict(agent.parent_flood_verdicts),
+        "metrics": agent.metrics.REGISTRY.render(),
+    }
+
+
+def test_shadow_classification_has_no_side_effects(monkeypatch):
+    agent = pytest.importorskip("spam_agent_langgraph")
+    from flood_detector import FloodVerdict
+    from overload import DEGRADED, OverloadController
+
+    classifier = FakeClassifier()
+    monkeypatch.setattr(agent, "get_classifier", lambda model: classifier)
+    # Перегрузка: основной бэкенд отложил бы сообщение, теневой проверяет как обычно
+    controller = OverloadController()
+    controller._level, controller._evaluated_at = DEGRADED, float("inf")
+    monkeypatch.setattr(agent, "overload_controller", controller)
+    monkeypatch.setattr(agent, "near_duplicate_index", agent.NearDuplicateIndex())
+    agent.near_duplicate_index.add("Продам гараж на улице Ленина 15, недорого, звоните вечером после шести")
+    agent.near_duplicate_index.add("Ставки на спорт с гарантией выигрыша, вход в канал по ссылке в профиле")
+    monkeypatch.setattr(agent, "parent_flood_verdicts", {(-1001, 2): FloodVerdict(True)})
+
+    messages = [
+        make_message("Коллеги, во сколько завтра созвон по релизу?", 1),
+        make_message("Продам гараж на улице Ленина 17, недорого, звоните вечером после шести!", 2),
+    ]
+
+    async def scenario():
+        return [await agent.classify_message(message) for message in messages]
+
+    before = shared_state(agent)
+    states = asyncio.run(scenario())
+    assert shared_state(agent) == before
+
+    assert states[0]["verdict_source"] == "llm" and classifier.texts == [messages[0].text]
+    assert states[1]["verdict_source"] == "near_duplicate"
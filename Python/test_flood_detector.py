@@ -0,0 +1,109 @@
+"""
+Регрессия детектора рейдов: обычный поток не должен давать ложных рейдов.
+
+Запуск: python -m pytest -q test_flood_detector.py
+"""
+
+import random
+
+import pytest
+
+import flood_detector
+from flood_detector import FloodDetector, FloodVerdict, SlidingCountMin
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(flood_detector.time, "monotonic", lambda: now[0])
+    return now
+
+
+def replay_unique(detector: FloodDetector, clock, rate: float, count: int, chats: int) -> int:
+    """Уникальные тексты от разных пользователей; возвращает число сообщений, признанных рейдом."""
+    rnd = random.Random(1)
+    flagged = 0
+    for i in range(count):
+        clock[0] += 1 / rate
+        text = f"обычное сообщение номер {i} про погоду и дела {rnd.random()}"
+        flagged += detector.observe(rnd.randrange(chats), 10 ** 6 + i, i, text).is_raid
+    return flagged
+
+
+@pytest.mark.parametrize("rate", [30, 100])
+def test_no_false_raids_on_normal_traffic(clock, rate):
+    detector = FloodDetector(expected_rate=rate)
+    assert replay_unique(detector, clock, rate, count=rate * 120, chats=200) == 0
+    assert detector.raids == 0
+
+
+def test_rows_are_independent():
+    # Ключи одной длины не должны совпадать во всех строках сразу (так было с сидами crc32)
+    sketch = SlidingCountMin(width=4096, depth=4)
+    keys = [f"uc:{1000000 + i}:{i % 200}" for i in range(20000)]
+    by_first_row = {}
+    full_collisions = 0
+    for key in keys:
+        indexes = tuple(sketch._indexes(key))
+        previous = by_first_row.setdefault(indexes[0], indexes)
+        full_collisions += previous is not indexes and previous == indexes
+    assert full_collisions < 10
+
+
+def test_user_raid_still_detected(clock):
+    detector = FloodDetector()
+    verdicts = []
+    for chat_id in range(5):
+        clock[0] += 0.5
+        verdicts.append(detector.observe(chat_id, 42, chat_id, f"заработок без вложений, пиши в лс {chat_id}"))
+    assert [v.is_raid for v in verdicts] == [False, False, True, True, True]
+    assert verdicts[2].trigger.reason == "user_chats"
+    assert detector.in_raid_mode(0)
+
+
+def test_observe_update_for_webhook_shards(clock):
+    # Родитель видит чаты всех процессов: рейд по трём чатам замечен, оповещение — один раз на чат
+    detector = FloodDetector()
+    floods = []
+    for i, chat_id in enumerate([-1001, -1002, -1003, -1001], 1):
+        clock[0] += 0.5
+        update = {"update_id": i, "message": {"message_id": i, "chat": {"id": chat_id}, "from": {"id": 777},
+                                              "text": f"заработок без вложений {i}, пиши в лс"}}
+        floods.append(detector.observe_update(update))
+    assert floods[:2] == [None, None]
+    verdict = FloodVerdict.from_dict(floods[2], bot="bot")
+    assert verdict.is_raid and verdict.trigger.reason == "user_chats"
+    assert verdict.trigger.alert_chats == [-1003, -1002, -1001]
+    assert verdict.trigger.recent == [(-1001, 1, "bot"), (-1002, 2, "bot")]
+    assert floods[3] == {"is_raid": True, "trigger": None}
+
+
+def test_service_and_anonymous_senders_are_not_one_user(clock):
+    # Анонимные админы, уведомления Telegram, посты каналов и сообщения без from в разных чатах
+    detector = FloodDetector()
+    senders = [{"from": {"id": 1087968824}}, {"from": {"id": 777000}},
+               {"from": {"id": 136817688}, "sender_chat": {"id": -100500}}, {}]
+    floods = []
+    for i, sender in enumerate(senders * 3, 1):
+        clock[0] += 0.5
+        update = {"update_id": i, "message": {"message_id": i, "chat": {"id": -1000 - i},
+                                              "text": f"расписание занятий на неделю, версия {i}", **sender}}
+        floods.append(detector.observe_update(update))
+    assert floods == [None] * 12
+    assert detector.raids == 0
+
+
+def test_raid_mode_deletes_only_same_chat_repeats(clock):
+    detector = FloodDetector()
+    for chat_id in range(3):  # рейд аккаунта 42: чаты 0-2 в режиме рейда
+        clock[0] += 0.5
+        detector.observe(chat_id, 42, chat_id, f"заработок без вложений, пиши в лс {chat_id}")
+    assert detector.in_raid_mode(0) and not detector.in_raid_mode(5)
+
+    text = "кто-нибудь знает, во сколько завтра собрание?"
+    clock[0] += 0.5
+    assert not detector.observe(5, 100, 10, text).is_raid
+    clock[0] += 0.5
+    assert not detector.observe(0, 101, 11, text).is_raid  # тот же текст, но в этом чате впервые
+    clock[0] += 0.5
+    assert detector.observe(0, 102, 12, text).is_raid
@@ -0,0 +1,87 @@
+"""
+Пул LLM-эндпоинтов: hedging, дедлайны и учёт зависших попыток как таймаутов.
+
+Запуск: python -m pytest -q test_llm_pool.py
+"""
+
+import asyncio
+
+import pytest
+
+from llm_pool import LLMPool
+
+FAST, SLOW = "http://fast/v1", "http://slow/v1"
+
+
+def make_pool(*urls, **kwargs) -> LLMPool:
+    pool = LLMPool(list(urls), health_interval=0, hedge_min_samples=5, **kwargs)
+    for endpoint in pool.endpoints:
+        for _ in range(5):
+            endpoint.observe(0.01)  # p95 = 10 мс
+    return pool
+
+
+def responder(delays: dict):
+    async def call(endpoint):
+        await asyncio.sleep(delays[endpoint.base_url])
+        return endpoint.base_url
+
+    return call
+
+
+def test_hedged_request_counts_hung_attempt_as_timeout():
+    pool = make_pool(SLOW, FAST)
+    slow, fast = pool.endpoints
+    fast.outstanding = 1  # первым выбирается медленный
+
+    async def scenario():
+        result = await pool.call(responder({SLOW: 1.0, FAST: 0.0}))
+        fast.outstanding = 0
+        return result
+
+    assert asyncio.run(scenario()) == FAST
+    assert pool.hedged == 1 and pool.hedge_wins == 1
+    assert slow.consecutive_errors == 1 and fast.consecutive_errors == 0
+    assert slow.outstanding == 0
+    assert max(slow._latencies) > 0.01  # задержка зависшей попытки учтена в p95
+
+
+def test_deadline_marks_endpoint_unhealthy():
+    pool = make_pool(SLOW, max_errors=2)
+    slow = pool.endpoints[0]
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.call(responder({SLOW: 1.0}), timeout=0.05)
+
+    asyncio.run(scenario())
+    assert slow.consecutive_errors == 2 and not slow.healthy
+
+
+def test_cancelled_caller_is_not_endpoint_failure():
+    pool = make_pool(SLOW)
+    slow = pool.endpoints[0]
+
+    async def scenario():
+        task = asyncio.create_task(pool.call(responder({SLOW: 1.0})))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert slow.consecutive_errors == 0 and slow.healthy and slow.outstanding == 0
+
+
+def test_track_counts_outstanding_and_errors():
+    pool = make_pool(FAST, max_errors=1)
+    endpoint = pool.endpoints[0]
+    with pool.track(endpoint):
+        assert endpoint.outstanding == 1
+    assert endpoint.outstanding == 0 and len(endpoint._latencies) == 6
+
+    with pytest.raises(ConnectionError):
+        with pool.track(endpoint):
+            raise ConnectionError("обрыв потока")
+    assert endpoint.outstanding == 0 and not endpoint.healthy
@@ -0,0 +1,105 @@
+"""
+Агрегатор модерации вместе с очередью классификации: спам одного чата уходит bulk-вызовами.
+
+Запуск: python -m pytest -q test_moderation.py
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from moderation import ModerationAggregator
+from work_queue import ClassificationQueue, verdict_ready
+
+CHAT_ID = -1001
+TARGET_ID = -1002
+
+
+class RecordingBot:
+    def __init__(self):
+        self.calls = []  # (method, kwargs, когда)
+
+    def __getattr__(self, method: str):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(**kwargs):
+            self.calls.append((method, kwargs, time.monotonic()))
+            return True
+
+        return call
+
+    def methods(self):
+        return [method for method, _, _ in self.calls]
+
+
+def make_message(bot, message_id: int, user_id: int = 42):
+    return SimpleNamespace(
+        bot=bot, message_id=message_id, text=f"спам {message_id}",
+        chat=SimpleNamespace(id=CHAT_ID), from_user=SimpleNamespace(id=user_id),
+    )
+
+
+def test_same_chat_spam_is_moderated_in_bulk():
+    async def scenario():
+        bot = RecordingBot()
+        moderator = ModerationAggregator(window_ms=50)
+
+        async def handle(message):
+            await asyncio.sleep(0.01)  # классификация
+            await verdict_ready()
+            # Как в ветке спама графа: пересылка, затем удаление
+            await moderator.forward(message.bot, CHAT_ID, message.message_id, TARGET_ID, report=message.text)
+            await moderator.delete(message.bot, CHAT_ID, message.message_id)
+
+        queue = ClassificationQueue(handle, workers=4, stats_interval=0)
+        await queue.start()
+        for message_id in range(1, 13):
+            await queue.put(make_message(bot, message_id))
+        await queue.stop()
+        await moderator.close()
+        return bot
+
+    bot = asyncio.run(scenario())
+    methods = bot.methods()
+    assert "forward_messages" in methods and "delete_messages" in methods
+    assert len(methods) < 12
+    deleted = set()
+    for method, kwargs, _ in bot.calls:
+        if method == "delete_messages":
+            deleted.update(kwargs["message_ids"])
+        elif method == "delete_message":
+            deleted.add(kwargs["message_id"])
+    assert deleted == set(range(1, 13))
+
+
+def test_delete_does_not_wait_for_rate_limited_forward():
+    async def scenario():
+        bot = RecordingBot()
+        moderator = ModerationAggregator(window_ms=10, chat_rate_per_minute=120)  # токен раз в 0.5 с
+        moderator._chat_buckets[TARGET_ID]._tokens = 0  # лимит чата модераторов исчерпан
+
+        started = time.monotonic()
+        await moderator.forward(bot, CHAT_ID, 7, TARGET_ID, report="Иван: заработок без вложений")
+        await moderator.delete(bot, CHAT_ID, 7)
+        deleted_after = time.monotonic() - started
+        await moderator.close()
+        return bot, deleted_after
+
+    bot, deleted_after = asyncio.run(scenario())
+    assert deleted_after < 0.3
+    assert bot.methods() == ["delete_message", "send_message"]
+    _, kwargs, _ = bot.calls[1]
+    assert kwargs["chat_id"] == TARGET_ID and "заработок без вложений" in kwargs["text"]
+
+
+def test_forward_without_report_waits_for_limit():
+    async def scenario():
+        bot = RecordingBot()
+        moderator = ModerationAggregator(window_ms=10, chat_rate_per_minute=600)
+        moderator._chat_buckets[TARGET_ID]._tokens = 0
+        await moderator.forward(bot, CHAT_ID, 7, TARGET_ID)
+        await moderator.delete(bot, CHAT_ID, 7)
+        return bot
+
+    assert asyncio.run(scenario()).methods() == ["forward_message", "delete_message"]
@@ -0,0 +1,46 @@
+"""
+Индекс почти-дубликатов: находит слегка изменённый спам и не размножает недоверенные вердикты.
+
+Запуск: python -m pytest -q test_near_duplicate.py
+"""
+
+from near_duplicate import NearDuplicateIndex
+
+SPAM = "Доход 110$/день без вложений, удалённая работа, пиши в личку прямо сейчас"
+
+
+class FakeStore:
+    def __init__(self, records):
+        self.records = records
+
+    def iter_spam(self, after_id: int = 0):
+        return iter(self.records)
+
+
+def test_finds_slightly_changed_spam():
+    index = NearDuplicateIndex()
+    assert index.add(SPAM)
+    assert index.query("Доход 120$ в день без вложений, удалённая работа, пиши в личку прямо сейчас") >= 0.7
+    assert index.query("Завтра в десять утра собрание жильцов во дворе, приходите все") is None
+    assert index.stats()["matches"] == 1
+
+
+def test_short_text_is_not_indexed():
+    index = NearDuplicateIndex()
+    assert not index.add("купи")
+    assert index.query("купи") is None
+
+
+def test_load_from_store_skips_untrusted_sources():
+    records = [
+        {"id": 1, "message": SPAM, "verdict_source": "llm"},
+        {"id": 2, "message": "Срочно нужны курьеры, оплата каждый день, пишите в личные сообщения", "verdict_source": "prefilter"},
+        {"id": 3, "message": "Ставки на спорт с гарантией выигрыша, вход в канал по ссылке в профиле", "verdict_source": "ml"},
+        {"id": 4, "message": "Продам аккаунты с историей, отзывы есть, гарантия через гаранта", "verdict_source": "raid"},
+        {"id": 5, "message": "Бесплатные сигналы для трейдинга, подписывайтесь на наш канал", "verdict_source": "degraded"},
+        {"id": 6, "message": "Инвестиции в криптовалюту под сорок процентов в месяц, пишите", "verdict_source": "near_duplicate"},
+    ]
+    index = NearDuplicateIndex()
+    assert index.load_from_store(FakeStore(records)) == 1
+    assert index.query(records[1]["message"]) is None
+    assert index.query(SPAM) == 1.0
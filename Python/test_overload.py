@@ -0,0 +1,118 @@
+"""
+Контроллер перегрузки: гистерезис уровней и перепроверка отложенных сообщений через очередь.
+
+Запуск: python -m pytest -q test_overload.py
+"""
+
+import asyncio
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+
+import overload
+from overload import DEGRADED, NORMAL, SHEDDING, OverloadController
+from work_queue import ClassificationQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(overload.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_level_hysteresis(clock):
+    depth = [0]
+    controller = OverloadController(depth_slo=100, shed_factor=2.0, recover_ratio=0.7, cooldown_seconds=15)
+    controller.queue_depth = lambda: depth[0]
+
+    def level_after(seconds: float, queue_depth: int) -> int:
+        clock[0] += seconds
+        depth[0] = queue_depth
+        return controller.level
+
+    assert level_after(1, 50) == NORMAL
+    assert level_after(1, 250) == SHEDDING  # вверх — сразу через уровень
+    assert level_after(1, 150) == SHEDDING  # 1.5 ≥ 2.0 × 0.7: ещё не спокойно
+    assert level_after(1, 100) == SHEDDING  # спокойно, но cooldown не прошёл
+    assert level_after(16, 100) == DEGRADED  # вниз — по одному уровню
+    assert level_after(1, 80) == DEGRADED  # 0.8 ≥ 0.7: не спокойно
+    assert level_after(1, 50) == DEGRADED
+    assert level_after(16, 50) == NORMAL
+    assert controller.transitions == 3
+
+
+def test_deferred_recheck_goes_through_queue():
+    calls = []
+    running = set()
+
+    async def handle(message, recheck: bool = False):
+        chat_id = message.chat.id
+        assert chat_id not in running  # сообщения одного чата не обрабатываются одновременно
+        running.add(chat_id)
+        await asyncio.sleep(0.01)
+        running.discard(chat_id)
+        calls.append((message.message_id, recheck))
+
+    def message(message_id: int):
+        return SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=-1001), from_user=SimpleNamespace(id=7))
+
+    async def scenario():
+        queue = ClassificationQueue(handle, workers=4, stats_interval=0)
+        controller = OverloadController(depth_slo=10, cooldown_seconds=0)
+        controller.queue_depth = lambda: 30
+        controller.recheck = partial(queue.put, recheck=True)
+        await queue.start()
+
+        def level() -> int:
+            controller._evaluated_at = 0.0  # пересчитать, не дожидаясь секунды
+            return controller.level
+
+        assert level() == SHEDDING
+        controller.defer(message(1))
+        controller.defer(message(2))
+        await queue.put(message(3))
+
+        controller.queue_depth = lambda: 0
+        levels = [level() for _ in range(4)]  # вниз по одному уровню после спокойного замера
+        assert levels == [SHEDDING, DEGRADED, DEGRADED, NORMAL]
+        await controller._recheck_task
+        await queue.stop()
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert calls == [(3, False), (1, True), (2, True)]
+    assert controller.stats()["deferred"] == 0
+
+
+def test_degraded_verdict_without_escalation_is_not_cached(monkeypatch):
+    agent = pytest.importorskip("spam_agent_langgraph")
+    from batch_classifier import Classification
+    from cascade import CascadeConfig
+    from verdict_cache import VerdictCache
+
+    class SmallModel:
+        async def classify(self, text, need_confidence=False):
+            return Classification(False, "NOT_SPAM")
+
+    controller = OverloadController()
+    controller._level, controller._evaluated_at = DEGRADED, float("inf")
+    monkeypatch.setattr(agent, "overload_controller", controller)
+    monkeypatch.setattr(agent, "cascade_config", CascadeConfig(["small", "large"]))
+    monkeypatch.setattr(agent, "get_classifier", lambda model: SmallModel())
+    monkeypatch.setattr(agent, "verdict_cache", VerdictCache())
+
+    def classify(text: str) -> dict:
+        message = SimpleNamespace(text=text, chat=SimpleNamespace(id=-1001))
+        state = {"message": message}
+        asyncio.run(agent._classify_with_tier(state, tier=0))
+        return state
+
+    # Ссылка — повод спросить крупную модель; при перегрузке её не спрашивают, а вердикт не кэшируют
+    state = classify("Заходите к нам: https://t.me/join_now_free")
+    assert state["escalation_reason"] is None and not state["is_spam"]
+    assert agent.verdict_cache.get("Заходите к нам: https://t.me/join_now_free") is None
+
+    classify("Коллеги, созвон переносится на завтра")
+    assert agent.verdict_cache.get("Коллеги, созвон переносится на завтра") is not None
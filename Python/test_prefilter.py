@@ -0,0 +1,50 @@
+"""
+Правиловый предфильтр: очевидный спам и рабочие сообщения решаются без LLM, остальное — в LLM.
+
+Запуск: python -m pytest -q test_prefilter.py
+"""
+
+import pytest
+
+from prefilter import PrefilterStats, score_message
+
+
+@pytest.mark.parametrize("text", [
+    "Доход от 300$ в день, пиши в лс",
+    "Дoxoд от 300$ в день, пиши в лс",  # латинские двойники
+    "Розыгрыш 5 айфонов среди подписчиков",
+    "Требуются люди на удалёнку, доход 2000 руб в день",
+])
+def test_obvious_spam(text):
+    assert score_message(text).is_spam is True
+
+
+@pytest.mark.parametrize("text", [
+    "Кто запускал Q4_K_M через ollama на CUDA?",
+    "GPUStack",
+    "ок",
+])
+def test_obvious_ham(text):
+    assert score_message(text).is_spam is False
+
+
+@pytest.mark.parametrize("text", [
+    "Ollama отдаёт 500$ в день, пиши в лс",  # технические термины не перевешивают деньги и призыв
+    "Пишите, пожалуйста, подробнее про релиз",
+])
+def test_ambiguous_goes_to_llm(text):
+    assert score_message(text).is_spam is None
+
+
+def test_short_keywords_match_whole_words():
+    assert "contact" in score_message("Пишите в лс").markers
+    assert "contact" not in score_message("Алсу выступит в субботу").markers
+    assert "tech" not in score_message("q80 — модель пылесоса").markers
+
+
+def test_stats_skip_ratio():
+    stats = PrefilterStats()
+    for text in ("Доход от 300$ в день, пиши в лс", "ок", "Пишите, пожалуйста, подробнее про релиз"):
+        stats.record(score_message(text))
+    assert (stats.checked, stats.spam, stats.ham) == (3, 1, 1)
+    assert stats.skip_ratio == pytest.approx(2 / 3)
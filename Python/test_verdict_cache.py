@@ -0,0 +1,44 @@
+"""
+Кэш вердиктов: нормализация обходов (двойники букв, невидимые символы, эмодзи), TTL и вытеснение.
+
+Запуск: python -m pytest -q test_verdict_cache.py
+"""
+
+from verdict_cache import VerdictCache, normalize_text, text_fingerprint
+
+SPAM = "Доход 500$ в неделю, пиши в лс"
+
+
+def test_obfuscated_copies_share_fingerprint():
+    variants = [
+        "ДОХОД 500$ в неделю,  пиши в лс",
+        "Дoxoд 500$ в неделю, пиши в лс",  # латинские o и x
+        "До\u200bход 500$ в неделю, пиши\u00ad в лс",  # невидимые символы
+        "Доход 500$ в неделю, пиши в лс 🔥🔥",
+    ]
+    assert {text_fingerprint(v) for v in variants} == {text_fingerprint(SPAM)}
+    assert text_fingerprint("Доход 600$ в неделю, пиши в лс") != text_fingerprint(SPAM)
+
+
+def test_empty_text_is_not_cached():
+    cache = VerdictCache()
+    assert normalize_text("🔥 \u200b ") == "" and text_fingerprint("🔥") == ""
+    cache.put("🔥", True)
+    assert cache.get("🔥") is None and cache.stats()["entries"] == 0
+
+
+def test_hit_miss_ttl_and_eviction():
+    cache = VerdictCache(max_entries=2)
+    cache.put(SPAM, True, "SPAM")
+    assert cache.get("Дoxoд 500$ в неделю, пиши в лс") == (True, "SPAM")
+    assert cache.get("другое сообщение") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.put("второе", False)
+    cache.get(SPAM)  # SPAM становится самым свежим
+    cache.put("третье", False)
+    assert cache.get("второе") is None and cache.get(SPAM) is not None and cache.evictions == 1
+
+    expired = VerdictCache(ttl_seconds=-1)
+    expired.put(SPAM, True)
+    assert expired.get(SPAM) is None and expired.stats()["entries"] == 0
@@ -0,0 +1,78 @@
+"""
+Учёт обновлений в родителе вебхука: события процессов и перезапуск упавшего процесса.
+
+Запуск: python -m pytest -q test_webhook_server.py
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import webhook_server
+from webhook_server import WebhookDispatcher, shard_for
+
+
+class FakeQueue:
+    def __init__(self, size: int = 0, implemented: bool = True):
+        self.size = size
+        self.implemented = implemented
+
+    def qsize(self) -> int:
+        if not self.implemented:
+            raise NotImplementedError
+        return self.size
+
+
+def test_shard_keeps_chat_on_one_worker():
+    assert shard_for(-1001, 4) == shard_for(-1001, 4) == -1001 % 4
+    assert shard_for(None, 4) == 0
+
+
+def test_events_are_applied_on_the_loop():
+    dispatcher = WebhookDispatcher(worker_target=None, workers=2)
+    dispatcher.dispatched = [3, 0]
+    applied_in = []
+    on_event = dispatcher._on_event
+
+    def record(index, latency):
+        applied_in.append(threading.current_thread())
+        on_event(index, latency)
+
+    dispatcher._on_event = record
+
+    async def scenario():
+        dispatcher._loop = asyncio.get_running_loop()
+        for event in [(0, 0.2), (0, None), webhook_server._STOP]:
+            dispatcher._events.put(event)
+        await asyncio.to_thread(dispatcher._drain_events)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert dispatcher.completed == [2, 0]
+    assert applied_in == [threading.main_thread()] * 2
+
+
+def test_respawn_accounts_lost_updates(monkeypatch):
+    dispatcher = WebhookDispatcher(worker_target=None, workers=2)
+    # Принято 10: 2 ещё в родителе, 8 передано процессу; 3 разобрано, 1 ждёт в очереди — 4 пропали с процессом
+    dispatcher.dispatched, dispatcher.handed, dispatcher.completed = [10, 0], [8, 0], [3, 0]
+    dispatcher._updates = [FakeQueue(size=1), FakeQueue()]
+    dispatcher._processes = [SimpleNamespace(is_alive=lambda: False, exitcode=-9),
+                             SimpleNamespace(is_alive=lambda: True)]
+    spawned = []
+
+    def spawn(index):
+        spawned.append(index)
+        dispatcher._stopping = True
+        return SimpleNamespace(is_alive=lambda: True)
+
+    monkeypatch.setattr(dispatcher, "_spawn", spawn)
+    asyncio.run(dispatcher._supervise(interval=0))
+
+    assert spawned == [0]
+    assert dispatcher.lost == [4, 0]
+    assert dispatcher.stats()["workers"][0]["in_flight"] == 3  # 2 в родителе + 1 в очереди процесса
+
+
+def test_qsize_not_implemented_counts_as_empty():
+    assert WebhookDispatcher._qsize(FakeQueue(implemented=False)) == 0
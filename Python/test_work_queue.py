@@ -0,0 +1,105 @@
+"""
+Очередь классификации: порядок внутри чата, приоритет новых участников, high-water и verdict_ready.
+
+Запуск: python -m pytest -q test_work_queue.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from work_queue import ClassificationQueue, verdict_ready
+
+
+def make_message(chat_id: int, message_id: int, user_id: int = 1):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id, from_user=SimpleNamespace(id=user_id))
+
+
+def test_chat_order_is_preserved_with_many_workers():
+    done = []
+
+    async def handle(message):
+        await asyncio.sleep(0.001 * (message.message_id % 3))  # разная длительность проверки
+        done.append((message.chat.id, message.message_id))
+
+    async def scenario():
+        queue = ClassificationQueue(handle, workers=8, stats_interval=0)
+        await queue.start()
+        for message_id in range(30):
+            await queue.put(make_message(message_id % 3, message_id))
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+    for chat_id in range(3):
+        ids = [m for c, m in done if c == chat_id]
+        assert ids == sorted(ids) and len(ids) == 10
+    assert queue.stats()["processed"] == 30
+
+
+def test_new_members_and_first_messages_go_first():
+    done = []
+
+    async def handle(message):
+        done.append(message.message_id)
+
+    async def scenario():
+        queue = ClassificationQueue(handle, workers=1, stats_interval=0)
+        for chat_id in (1, 2):
+            queue._priority(make_message(chat_id, 0, user_id=10))  # давно пишущий пользователь
+        queue.mark_new_members(3, [30])
+        await queue.put(make_message(1, 1, user_id=10))
+        await queue.put(make_message(2, 2, user_id=10))
+        await queue.put(make_message(3, 3, user_id=30))  # новый участник
+        await queue.put(make_message(4, 4, user_id=40))  # первое сообщение
+        await queue.start()
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert done == [3, 4, 1, 2]
+
+
+def test_put_waits_above_high_water():
+    gate = asyncio.Event()
+
+    async def handle(message):
+        await gate.wait()
+
+    async def scenario():
+        queue = ClassificationQueue(handle, workers=1, high_water=2, stats_interval=0)
+        await queue.start()
+        for message_id in range(3):  # одно в работе, два в очереди
+            await queue.put(make_message(message_id, message_id))
+        await asyncio.sleep(0.01)
+        blocked = asyncio.create_task(queue.put(make_message(9, 9)))
+        await asyncio.sleep(0.01)
+        was_blocked = not blocked.done()
+        gate.set()
+        await blocked
+        await queue.stop()
+        return was_blocked
+
+    assert asyncio.run(scenario())
+
+
+def test_verdict_ready_releases_chat_before_moderation_ends():
+    events = []
+    moderation = asyncio.Event()
+
+    async def handle(message):
+        events.append(("verdict", message.message_id))
+        await verdict_ready()
+        if message.message_id == 1:
+            await moderation.wait()  # пересылка и удаление первого сообщения ещё идут
+        events.append(("done", message.message_id))
+
+    async def scenario():
+        queue = ClassificationQueue(handle, workers=2, stats_interval=0)
+        await queue.start()
+        await queue.put(make_message(1, 1))
+        await queue.put(make_message(1, 2))
+        await asyncio.sleep(0.02)
+        moderation.set()
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert events == [("verdict", 1), ("verdict", 2), ("done", 2), ("done", 1)]
@@ -0,0 +1,198 @@
+"""
+Кэш вердиктов классификатора спама.
+
+Спам-кампании повторяют один и тот же текст десятки раз в минуту, поэтому
+перед вызовом LLM вердикт ищется по нормализованному тексту сообщения.
+Кэш — LRU с TTL, ограничен по числу записей и по памяти, ведёт счётчики
+попаданий/промахов и при желании сохраняется на диск.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------ #
+# ⬇️ Нормализация текста
+# ------------------------------------------------------------------ #
+# Невидимые символы, которыми спамеры «ломают» совпадение текстов
+_ZERO_WIDTH = dict.fromkeys(
+    map(ord, "\u00ad\u180e\u200b\u200c\u200d\u200e\u200f\u2060\u2061\u2062\u2063\u2064\ufeff"),
+    None,
+)
+
+# Латинские и греческие двойники кириллических букв (после casefold)
+_HOMOGLYPHS = str.maketrans({
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+    "o": "о", "p": "р", "t": "т", "x": "х", "y": "у", "i": "і",
+    "α": "а", "β": "в", "ε": "е", "κ": "к", "ο": "о", "ρ": "р", "τ": "т",
+    "υ": "у", "χ": "х", "ё": "е",
+})
+
+# Категории Unicode, которые считаем «шумом»: эмодзи, символы-модификаторы,
+# форматирующие и комбинируемые знаки, приватная зона
+_NOISE_CATEGORIES = {"So", "Sk", "Cf", "Cs", "Co", "Mn", "Me"}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к каноническому виду для сравнения дубликатов."""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = text.translate(_ZERO_WIDTH).casefold().translate(_HOMOGLYPHS)
+    text = "".join(ch for ch in text if unicodedata.category(ch) not in _NOISE_CATEGORIES)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def text_fingerprint(text: str) -> str:
+    """Короткий стабильный ключ нормализованного текста ('' для пустого)."""
+    normalized = normalize_text(text)
+    if not normalized:
+        return ""
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ LRU/TTL-кэш
+# ------------------------------------------------------------------ #
+Verdict = Tuple[bool, str]  # (is_spam, classification_text)
+
+
+class VerdictCache:
+    """LRU-кэш вердиктов с TTL, лимитом памяти и опциональным сохранением."""
+
+    def __init__(
+            self,
+            max_entries: int = 10_000,
+            ttl_seconds: float = 3600.0,
+            max_bytes: int = 8 * 1024 * 1024,
+            path: Optional[str] = None,
+            persist_every: int = 100,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.path = path
+        self.persist_every = persist_every
+
+        # key -> (is_spam, classification_text, expires_at)
+        self._entries: "OrderedDict[str, Tuple[bool, str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._dirty = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    # -------------------------------------------------------------- #
+    @staticmethod
+    def _entry_size(key: str, entry: Tuple[bool, str, float]) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry[1])
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= self._entry_size(key, entry)
+
+    def _evict(self) -> None:
+        while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    # -------------------------------------------------------------- #
+    def get(self, text: str) -> Optional[Verdict]:
+        """Возвращает (is_spam, classification_text) или None при промахе."""
+        key = text_fingerprint(text)
+        if not key:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry[2] < time.time():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, text: str, is_spam: bool, classification_text: str = "") -> None:
+        key = text_fingerprint(text)
+        if not key:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        entry = (is_spam, classification_text, time.time() + self.ttl_seconds)
+        self._entries[key] = entry
+        self._bytes += self._entry_size(key, entry)
+        self._evict()
+
+        self._dirty += 1
+        if self.path and self._dirty >= self.persist_every:
+            self.save()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Сохранение на диск, чтобы рестарт не начинался «с холодного» кэша
+    # -------------------------------------------------------------- #
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([[k, *v] for k, v in self._entries.items()], f)
+            os.replace(tmp_path, self.path)
+            self._dirty = 0
+            logger.debug(f"Кэш вердиктов сохранён: {len(self._entries)} записей")
+        except Exception as e:
+            logger.error(f"Не удалось сохранить кэш вердиктов: {e}")
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить кэш вердиктов: {e}")
+            return
+
+        now = time.time()
+        for key, is_spam, classification_text, expires_at in rows:
+            if expires_at > now:
+                entry = (bool(is_spam), classification_text, expires_at)
+                self._entries[key] = entry
+                self._bytes += self._entry_size(key, entry)
+        self._evict()
+        logger.info(f"Кэш вердиктов загружен: {len(self._entries)} записей")
@@ -0,0 +1,295 @@
+"""
+Приём обновлений Telegram через вебхук с шардированием по процессам.
+
+При поллинге один event loop разбирает обновления всех чатов. В режиме
+вебхука локальный aiohttp-сервер принимает обновления и раскладывает их по
+WEBHOOK_WORKERS процессам по chat.id:
+- все обновления одного чата попадают в один процесс и в порядке прихода
+  (одна FIFO-очередь и один поставщик на процесс), а внутри процесса порядок
+  держит ClassificationQueue;
+- очереди ограничены: если процесс не успевает, ответ Telegram задерживается,
+  и Telegram сам притормаживает доставку;
+- при остановке сервер перестаёт принимать обновления, досылает принятые,
+  а процессы дожидаются разбора своих очередей;
+- процессы сообщают о каждом разобранном обновлении, поэтому задержка
+  «обновление → вердикт» и нагрузка на процесс видны на /metrics родителя;
+- упавший процесс перезапускается; обновления, которые он забрал из очереди
+  и не разобрал, учитываются как потерянные (сообщения из его долговечной
+  очереди продолжит новый процесс);
+- детектор рейдов работает в родителе, до шардирования: рейд по нескольким
+  чатам иначе заметил бы только процесс, которому достались все эти чаты.
+  Вердикт детектора уходит процессу вместе с обновлением.
+
+Процесс-воркер выполняет функцию worker_target(index, updates, events),
+которую передаёт main.py (см. run_webhook_worker).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+import metrics
+from flood_detector import FloodDetector
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+_STOP = None  # сигнал процессу-воркеру: новых обновлений не будет
+
+# Поля обновления, в которых лежит сообщение (или объект с chat)
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request", "message_reaction",
+)
+
+
+def extract_chat_id(update: dict) -> Optional[int]:
+    for name in _CHAT_FIELDS:
+        chat = (update.get(name) or {}).get("chat")
+        if chat:
+            return chat["id"]
+    callback_message = (update.get("callback_query") or {}).get("message") or {}
+    if callback_message.get("chat"):
+        return callback_message["chat"]["id"]
+    return None
+
+
+def shard_for(chat_id: Optional[int], workers: int) -> int:
+    """Номер процесса для чата; обновления без чата уходят в нулевой."""
+    return chat_id % workers if chat_id is not None else 0
+
+
+def _worker_entry(target: Callable, index: int, updates, events) -> None:
+    # Ctrl+C получает вся группа процессов; останавливает воркеров только родитель
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(target(index, updates, events))
+
+
+async def consume_updates(updates, handle: Callable[[dict, float, Optional[dict]], Awaitable[Any]]) -> None:
+    """
+    Цикл процесса-воркера: обновления по одному, строго в порядке очереди.
+    handle(update, received_at, flood) — flood: вердикт детектора рейдов родителя (FloodVerdict.to_dict) или None.
+    """
+    while True:
+        item = await asyncio.to_thread(updates.get)
+        if item is _STOP:
+            return
+        update, received_at, flood = item
+        try:
+            await handle(update, received_at, flood)
+        except Exception as exc:
+            logger.exception(f"Ошибка при разборе обновления {update.get('update_id')}: {exc}")
+
+
+# ------------------------------------------------------------------ #
+# ⬇️ Родительский процесс
+# ------------------------------------------------------------------ #
+class WebhookDispatcher:
+    """Процессы-воркеры, очереди к ним и учёт нагрузки."""
+
+    def __init__(
+            self,
+            worker_target: Callable,
+            workers: int = 4,
+            queue_size: int = 1000,
+            shutdown_timeout: float = 30.0,
+            flood_detector: Optional[FloodDetector] = None,
+    ):
+        self.worker_target = worker_target
+        self.flood_detector = flood_detector
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.shutdown_timeout = shutdown_timeout
+
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue()
+        self._updates: List[Any] = []  # multiprocessing.Queue на процесс
+        self._pending: List[asyncio.Queue] = []  # очередь в родителе до передачи процессу
+        self._processes: List[Any] = []
+        self._feeders: List[asyncio.Task] = []
+        self._supervisor: Optional[asyncio.Task] = None
+        self._events_thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+        # Счётчики меняются только в event loop (события процессов передаются через call_soon_threadsafe)
+        self.dispatched = [0] * self.workers
+        self.handed = [0] * self.workers  # передано в multiprocessing-очередь процесса
+        self.completed = [0] * self.workers
+        self.lost = [0] * self.workers
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_worker_entry,
+            args=(self.worker_target, index, self._updates[index], self._events),
+            name=f"nospam-worker-{index}",
+            daemon=False,
+        )
+        process.start()
+        return process
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        for index in range(self.workers):
+            self._updates.append(self._context.Queue(maxsize=self.queue_size))
+            self._pending.append(asyncio.Queue(maxsize=self.queue_size))
+            metrics.WORKER_IN_FLIGHT.set(0, worker=index)
+        self._processes = [self._spawn(index) for index in range(self.workers)]
+        self._feeders = [asyncio.create_task(self._feed(index)) for index in range(self.workers)]
+        self._supervisor = asyncio.create_task(self._supervise())
+        self._events_thread = threading.Thread(target=self._drain_events, name="webhook-events", daemon=True)
+        self._events_thread.start()
+        logger.info(f"🧵 Запущено процессов-воркеров: {self.workers}")
+
+    async def dispatch(self, update: dict) -> None:
+        index = shard_for(extract_chat_id(update), self.workers)
+        received_at = time.time()
+        flood = self.flood_detector.observe_update(update) if self.flood_detector is not None else None
+        self.dispatched[index] += 1
+        metrics.WEBHOOK_UPDATES.inc(worker=index)
+        metrics.WORKER_IN_FLIGHT.set(self.dispatched[index] - self.completed[index], worker=index)
+        await self._pending[index].put((update, received_at, flood))
+
+    async def _feed(self, index: int) -> None:
+        """Один поставщик на процесс: порядок передачи совпадает с порядком приёма."""
+        while True:
+            item = await self._pending[index].get()
+            await asyncio.to_thread(self._updates[index].put, item)
+            self.handed[index] += 1
+            self._pending[index].task_done()
+
+    def _drain_events(self) -> None:
+        """Поток чтения событий процессов: (worker, задержка до вердикта или None) → в event loop."""
+        while True:
+            event = self._events.get()
+            if event is _STOP:
+                return
+            self._loop.call_soon_threadsafe(self._on_event, *event)
+
+    def _on_event(self, index: int, latency: Optional[float]) -> None:
+        self.completed[index] += 1
+        if latency is not None:
+            metrics.UPDATE_TO_VERDICT.observe(latency, worker=index)
+        metrics.WORKER_IN_FLIGHT.set(self.dispatched[index] - self.completed[index], worker=index)
+
+    @staticmethod
+    def _qsize(queue) -> int:
+        try:
+            return queue.qsize()
+        except NotImplementedError:  # macOS: sem_getvalue не реализован
+            return 0
+
+    def _reconcile_lost(self, index: int) -> int:
+        """Обновления, которые упавший процесс забрал из очереди, но не разобрал: событий о них не будет."""
+        # Ещё в родителе (или у поставщика) — не передано; в multiprocessing-очереди — достанется новому процессу
+        lost = max(0, self.handed[index] - self.completed[index] - self._qsize(self._updates[index]))
+        if lost:
+            self.completed[index] += lost
+            self.lost[index] += lost
+            metrics.WORKER_IN_FLIGHT.set(self.dispatched[index] - self.completed[index], worker=index)
+            logger.error(f"💥 Процесс-воркер {index} не разобрал {lost} обновл.; сообщения, уже записанные "
+                         f"в его долговечную очередь, новый процесс продолжит при старте")
+        return lost
+
+    async def _supervise(self, interval: float = 5.0) -> None:
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stopping:
+                    logger.error(f"💥 Процесс-воркер {index} завершился (код {process.exitcode}), перезапуск")
+                    # События, отправленные процессом до падения, должны дойти до счётчиков
+                    await asyncio.sleep(0.1)
+                    self._reconcile_lost(index)
+                    self._processes[index] = self._spawn(index)
+
+    async def stop(self) -> None:
+        """Досылает принятые обновления и ждёт, пока процессы разберут свои очереди."""
+        self._stopping = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        for queue in self._pending:
+            await queue.join()
+        for task in self._feeders:
+            task.cancel()
+        for queue in self._updates:
+            await asyncio.to_thread(queue.put, _STOP)
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for index, process in enumerate(self._processes):
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"⚠️ Процесс-воркер {index} не остановился за {self.shutdown_timeout:.0f} с")
+                process.terminate()
+        self._events.put(_STOP)
+        if self._events_thread is not None:
+            await asyncio.to_thread(self._events_thread.join, 5.0)
+        logger.info(f"Процессы-воркеры остановлены, разобрано обновлений: {sum(self.completed)}")
+
+    def stats(self) -> dict:
+        return {
+            "workers": [
+                {
+                    "dispatched": self.dispatched[i],
+                    "completed": self.completed[i],
+                    "lost": self.lost[i],
+                    "in_flight": self.dispatched[i] - self.completed[i],
+                    "alive": self._processes[i].is_alive() if self._processes else False,
+                }
+                for i in range(self.workers)
+            ],
+        }
+
+
+async def serve(
+        worker_target: Callable,
+        workers: int = 4,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        path: str = "/webhook",
+        secret: str = "",
+        queue_size: int = 1000,
+        shutdown_timeout: float = 30.0,
+        on_started: Optional[Callable[[], Awaitable[Any]]] = None,
+        flood_detector: Optional[FloodDetector] = None,
+) -> None:
+    """Поднимает вебхук и работает до SIGINT/SIGTERM."""
+    from aiohttp import web
+
+    dispatcher = WebhookDispatcher(worker_target, workers, queue_size, shutdown_timeout, flood_detector)
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=401)
+        await dispatcher.dispatch(await request.json())
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response(dispatcher.stats())
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    app.router.add_get("/healthz", health)
+    runner = web.AppRunner(app)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await dispatcher.start()
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"🌐 Вебхук слушает http://{host}:{port}{path}")
+    try:
+        if on_started is not None:
+            await on_started()
+        await stop.wait()
+        logger.info("Получен сигнал на завершение работы, останавливаем приём обновлений")
+    finally:
+        await runner.cleanup()  # новые запросы больше не принимаются
+        await dispatcher.stop()
@@ -0,0 +1,277 @@
+"""
+Очередь классификации между aiogram-хэндлером и графом.
+
+Хэндлер только ставит сообщение в очередь, а проверку выполняют N воркеров.
+- порядок сообщений внутри одного чата сохраняется (в каждый момент времени
+  у чата не больше одного сообщения на классификации); как только вердикт
+  вынесен (verdict_ready), чат освобождается, и действия модерации идут
+  параллельно со следующими сообщениями — так агрегатор склеивает их в
+  bulk-вызовы;
+- сообщения новых участников и первые сообщения пользователя идут вперёд;
+- при глубине очереди выше high_water метод put() ждёт — это backpressure
+  для поллинга;
+- именованные аргументы put() передаются обработчику: так через очередь
+  (и её порядок внутри чата) идёт перепроверка отложенных сообщений.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import types
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0     # новый участник или первое сообщение
+PRIORITY_NORMAL = 1   # давно пишущие пользователи
+
+# Освобождение чата сообщения, которое сейчас обрабатывает воркер (см. verdict_ready)
+_release_chat: ContextVar[Optional[Callable[[], Awaitable[None]]]] = ContextVar("release_chat", default=None)
+
+
+async def verdict_ready() -> None:
+    """
+    Вердикт по текущему сообщению вынесен: следующее сообщение того же чата можно брать
+    в работу, не дожидаясь пересылки и удаления. Вне воркера очереди ничего не делает.
+    """
+    release = _release_chat.get()
+    if release is not None:
+        await release()
+
+
+class ClassificationQueue:
+    """Ограниченный пул воркеров с приоритетами и FIFO внутри чата."""
+
+    def __init__(
+            self,
+            handler: Callable[..., Awaitable[None]],
+            workers: int = 4,
+            high_water: int = 200,
+            new_member_window: float = 24 * 3600,
+            max_tracked_users: int = 100_000,
+            stats_interval: float = 60.0,
+            on_processed: Optional[Callable[[types.Message], None]] = None,
+    ):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.high_water = max(1, high_water)
+        self.new_member_window = new_member_window
+        self.max_tracked_users = max_tracked_users
+        self.stats_interval = stats_interval
+        self.on_processed = on_processed  # вызывается после проверки каждого сообщения (в том числе с ошибкой)
+
+        # chat_id -> очередь (priority, enqueued_at, message, аргументы обработчика)
+        self._chats: Dict[int, Deque[Tuple[int, float, types.Message, Dict[str, Any]]]] = {}
+        # Куча готовых к обработке чатов: (priority, seq, chat_id)
+        self._ready: List[Tuple[int, int, int]] = []
+        self._scheduled: Dict[int, int] = {}  # chat_id -> приоритет актуальной записи в куче
+        self._busy_chats: set = set()
+        self._seq = itertools.count()
+        self._depth = 0
+
+        self._seen_users: "OrderedDict[Tuple[int, int], None]" = OrderedDict()
+        self._new_members: "OrderedDict[Tuple[int, int], float]" = OrderedDict()
+
+        self._cond = asyncio.Condition()
+        self._tasks: List[asyncio.Task] = []
+        self._started_at = 0.0
+
+        # Наблюдаемость
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.busy_seconds = 0.0
+        self._busy_since: Dict[int, float] = {}
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Сигналы о новых участниках
+    # -------------------------------------------------------------- #
+    def mark_new_members(self, chat_id: int, user_ids: Iterable[int]) -> None:
+        now = time.monotonic()
+        for user_id in user_ids:
+            key = (chat_id, user_id)
+            self._new_members[key] = now
+            self._new_members.move_to_end(key)
+        while len(self._new_members) > self.max_tracked_users:
+            self._new_members.popitem(last=False)
+
+    def _priority(self, message: types.Message) -> int:
+        user_id = message.from_user.id if message.from_user else 0
+        key = (message.chat.id, user_id)
+
+        joined_at = self._new_members.get(key)
+        if joined_at is not None:
+            if time.monotonic() - joined_at <= self.new_member_window:
+                return PRIORITY_HIGH
+            del self._new_members[key]
+
+        if key not in self._seen_users:
+            self._seen_users[key] = None
+            while len(self._seen_users) > self.max_tracked_users:
+                self._seen_users.popitem(last=False)
+            return PRIORITY_HIGH
+
+        self._seen_users.move_to_end(key)
+        return PRIORITY_NORMAL
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Постановка в очередь
+    # -------------------------------------------------------------- #
+    async def put(self, message: types.Message, **kwargs) -> None:
+        """
+        Ставит сообщение в очередь; ждёт, пока глубина выше high_water.
+        kwargs передаются обработчику вместе с сообщением (например, recheck=True).
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._depth < self.high_water)
+
+            priority = self._priority(message)
+            chat_id = message.chat.id
+            self._chats.setdefault(chat_id, deque()).append((priority, time.monotonic(), message, kwargs))
+            self._depth += 1
+            self.enqueued += 1
+            self._schedule(chat_id, priority)
+            self._cond.notify_all()
+
+    def _schedule(self, chat_id: int, priority: int) -> None:
+        """Помещает чат в кучу готовых (или повышает его приоритет)."""
+        if chat_id in self._busy_chats:
+            return
+        current = self._scheduled.get(chat_id)
+        if current is None or priority < current:
+            self._scheduled[chat_id] = priority
+            heapq.heappush(self._ready, (priority, next(self._seq), chat_id))
+
+    def _pop_ready(self) -> Optional[Tuple[int, float, types.Message, Dict[str, Any]]]:
+        while self._ready:
+            priority, _, chat_id = heapq.heappop(self._ready)
+            if self._scheduled.get(chat_id) != priority:
+                continue  # устаревшая запись после повышения приоритета
+            del self._scheduled[chat_id]
+            self._busy_chats.add(chat_id)
+            item = self._chats[chat_id].popleft()
+            self._depth -= 1
+            return item
+        return None
+
+    def _release(self, chat_id: int) -> None:
+        self._busy_chats.discard(chat_id)
+        pending = self._chats.get(chat_id)
+        if pending:
+            self._schedule(chat_id, min(item[0] for item in pending))
+        else:
+            self._chats.pop(chat_id, None)
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Воркеры
+    # -------------------------------------------------------------- #
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._ready)
+                item = self._pop_ready()
+                self._cond.notify_all()  # освободилось место для put()
+            if item is None:
+                continue
+
+            _, enqueued_at, message, kwargs = item
+            started = time.monotonic()
+            wait = started - enqueued_at
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            metrics.QUEUE_LAG.observe(wait)
+            self._busy_since[worker_id] = started
+
+            released = False
+
+            async def release() -> None:
+                nonlocal released
+                if released:
+                    return
+                released = True
+                async with self._cond:
+                    self._release(message.chat.id)
+                    self._cond.notify_all()
+
+            token = _release_chat.set(release)
+            try:
+                await self.handler(message, **kwargs)
+            except Exception as exc:
+                self.failed += 1
+                logger.exception(f"Ошибка при проверке сообщения {message.message_id}: {exc}")
+            finally:
+                _release_chat.reset(token)
+                self.processed += 1
+                self.busy_seconds += time.monotonic() - self._busy_since.pop(worker_id)
+                if self.on_processed is not None:
+                    self.on_processed(message)
+                async with self._cond:
+                    if not released:
+                        released = True
+                        self._release(message.chat.id)
+                    self._cond.notify_all()
+
+    async def _report_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            s = self.stats()
+            logger.info(
+                f"📊 Очередь: глубина={s['depth']}, в работе={s['in_flight']}, "
+                f"ожидание ср/макс={s['wait_avg']:.2f}/{s['wait_max']:.2f} с, "
+                f"загрузка воркеров={s['utilisation']:.0%}"
+            )
+
+    async def start(self) -> None:
+        self._started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        if self.stats_interval > 0:
+            self._tasks.append(asyncio.create_task(self._report_stats()))
+        logger.info(f"Запущено воркеров классификации: {self.workers} (high-water={self.high_water})")
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Дожидается разбора очереди (не дольше drain_timeout) и останавливает воркеров."""
+        if not self._tasks:
+            return
+        try:
+            async with self._cond:
+                await asyncio.wait_for(
+                    # Чаты освобождаются по вердикту, а модерация ещё идёт — ждём и воркеров
+                    self._cond.wait_for(lambda: not self._depth and not self._busy_chats and not self._busy_since),
+                    drain_timeout,
+                )
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Очередь не разобрана до остановки: осталось {self._depth} сообщений")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # -------------------------------------------------------------- #
+    # ⬇️ Наблюдаемость
+    # -------------------------------------------------------------- #
+    def stats(self) -> dict:
+        now = time.monotonic()
+        started = self.processed + len(self._busy_since)
+        busy = self.busy_seconds + sum(now - t for t in self._busy_since.values())
+        elapsed = (now - self._started_at) * self.workers if self._started_at else 0.0
+        return {
+            "depth": self._depth,
+            "in_flight": len(self._busy_since),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_avg": self.wait_total / started if started else 0.0,
+            "wait_max": self.wait_max,
+            "utilisation": busy / elapsed if elapsed else 0.0,
+            "workers": self.workers,
+            "high_water": self.high_water,
+        }